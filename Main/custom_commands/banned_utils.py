@@ -1,35 +1,142 @@
-import re
+import asyncio
 import logging
+from typing import Optional
 from Main.database import (
-    is_user_banned, ban_user, get_banned_words, add_user_warning, get_user_warnings
+    is_user_banned, ban_user, get_banned_word_matcher, get_fuzzy_banned_matcher, find_banned_word, find_banned_words,
+    peek_banned_word, UNCHECKED, get_user_warnings, run_db, moderation_cache_ready, get_image_blocklist
 )
+from Main.history_writer import queue_warning, queue_audit, pending_warnings, record_audit
+from Main.image_hash import image_hashes
+from Main.tracing import span
 
 logger = logging.getLogger(__name__)
 
-def check_banned(user_id: str, prompt: str):
+BANNED_MESSAGE = "You are banned from using this command. Please contact an admin if you believe this is an error."
+ENHANCED_BANNED_MESSAGE = ("🚫 The enhanced prompt came back with a banned word, so it wasn't generated. "
+                           "This doesn't count against you; try again or lower the creativity level.")
+REGENERATE_BANNED_MESSAGE = "🚫 This prompt contains the banned word '{word}', so it can't be regenerated."
+BLOCKED_IMAGE_MESSAGE = "🚫 This image can't be used as a reference. Please contact an admin if you believe this is an error."
+
+async def banned_word_in(prompt: str):
+    """The banned word prompt uses, or None; a cached verdict is answered without leaving the loop."""
+    if moderation_cache_ready():
+        word = peek_banned_word(prompt)
+        if word is not UNCHECKED:
+            return word
+        # Typo matching can take milliseconds on a long prompt, so when it is on the check leaves the loop
+        if not get_fuzzy_banned_matcher():
+            return find_banned_word(prompt)
+    return await run_db(find_banned_word, prompt)
+
+async def banned_words_in(prompt: str):
+    """Every banned word prompt uses, as a frozenset; computed where banned_word_in would compute a verdict."""
+    if moderation_cache_ready() and not get_fuzzy_banned_matcher():
+        return find_banned_words(prompt)
+    return await run_db(find_banned_words, prompt)
+
+async def check_banned(user_id: str, prompt: str):
+    """
+    Run the ban and banned-word checks on the prompt the user typed. Both
+    are in memory once init_db has run, and verdicts are cached per prompt,
+    so only a prompt that contains a banned word (and needs a warning or
+    ban written) goes to the database thread.
+    """
+    with span('moderation', phase='moderation', stage='raw'):
+        if moderation_cache_ready():
+            if is_user_banned(user_id):
+                return True, BANNED_MESSAGE
+            if await banned_word_in(prompt) is None:
+                return False, ""
+        return await run_db(_check_banned, user_id, prompt)
+
+async def check_enhanced(user_id: str, original: str, enhanced: str) -> str:
+    """
+    Re-check a prompt after AI enhancement, before it goes to ComfyUI.
+    Banned words the user typed were already dealt with by check_banned;
+    any banned word the enhancement added, even alongside one the user
+    typed, stops the request without a strike.
+    Returns a message to send instead of running the request, or "".
+    """
+    with span('moderation', phase='moderation', stage='enhanced'):
+        # The cached single verdict clears the usual clean prompt without listing every word
+        if await banned_word_in(enhanced) is None:
+            return ""
+        added = await banned_words_in(enhanced) - await banned_words_in(original)
+        if not added:
+            return ""
+    logger.info(f"Enhanced prompt for {user_id} introduced banned words {sorted(added)}; not generating")
+    return ENHANCED_BANNED_MESSAGE
+
+async def check_regenerate(user_id: str, prompt: str) -> str:
+    """
+    Check a prompt being re-run from a button on an earlier result. Anyone
+    can press the button, and the prompt was judged when it was first
+    submitted, so a banned word here refuses the run without a strike.
+    Returns a message to send instead of running the request, or "".
+    """
+    with span('moderation', phase='moderation', stage='regenerate'):
+        if moderation_cache_ready():
+            banned = is_user_banned(user_id)
+        else:
+            banned = await run_db(is_user_banned, user_id)
+        if banned:
+            return BANNED_MESSAGE
+        word = await banned_word_in(prompt)
+    if word is None:
+        return ""
+    logger.info(f"Refused regenerate for {user_id}: prompt uses banned word '{word}'")
+    return REGENERATE_BANNED_MESSAGE.format(word=word)
+
+def _check_banned(user_id: str, prompt: str):
     if is_user_banned(user_id):
-        return True, "You are banned from using this command. Please contact an admin if you believe this is an error."
-    
-    prompt_lower = prompt.lower()
-    banned_words = get_banned_words()
+        return True, BANNED_MESSAGE
     
-    for word in banned_words:
-        if re.search(r'\b' + re.escape(word.lower()) + r'\b', prompt_lower):
-            warning_count = get_user_warnings(user_id)
-            
-            if warning_count >= 2:  # Third strike
-                ban_user(user_id, f"Used banned word after two warnings: {word}")
-                return True, (f"🚫 You have been banned for using the banned word '{word}'.\n"
-                            f"This was your third violation. Please contact an admin if you believe this is an error.")
-            elif warning_count == 1:  # Second strike
-                add_user_warning(user_id, prompt, word)
-                return False, (f"⚠️ FINAL WARNING: Your prompt contains the banned word '{word}'.\n"
-                             f"This is your second warning. One more violation will result in a permanent ban.\n"
-                             f"Banned words list: {', '.join(banned_words)}")
-            else:  # First strike
-                add_user_warning(user_id, prompt, word)
-                return False, (f"⚠️ WARNING: Your prompt contains the banned word '{word}'.\n"
-                             f"This is your first warning. You have one more warnings remaining before a permanent ban.\n"
-                             f"Banned words list: {', '.join(banned_words)}")
+    banned_words = get_banned_word_matcher().words
     
-    return False, ""
\ No newline at end of file
+    # Exact matching is one pass over the prompt however long the list is; typos are checked per token
+    word = find_banned_word(prompt)
+    if word:
+        # Warnings still queued in the history writer count too
+        warning_count = get_user_warnings(user_id) + pending_warnings(user_id)
+        
+        if warning_count >= 2:  # Third strike
+            reason = f"Used banned word after two warnings: {word}"
+            ban_user(user_id, reason)
+            queue_audit('moderation', 'ban_user', user_id, reason)
+            return True, (f"🚫 You have been banned for using the banned word '{word}'.\n"
+                        f"This was your third violation. Please contact an admin if you believe this is an error.")
+        elif warning_count == 1:  # Second strike
+            queue_warning(user_id, prompt, word)
+            return False, (f"⚠️ FINAL WARNING: Your prompt contains the banned word '{word}'.\n"
+                         f"This is your second warning. One more violation will result in a permanent ban.\n"
+                         f"Banned words list: {', '.join(banned_words)}")
+        else:  # First strike
+            queue_warning(user_id, prompt, word)
+            return False, (f"⚠️ WARNING: Your prompt contains the banned word '{word}'.\n"
+                         f"This is your first warning. You have one more warnings remaining before a permanent ban.\n"
+                         f"Banned words list: {', '.join(banned_words)}")
+
+    return False, ""
+
+async def check_reference_image(user_id: str, data: bytes) -> Optional[str]:
+    """
+    Check an uploaded reference image against the perceptual-hash blocklist.
+    Returns a message to send instead of using the image when it is blocked.
+    """
+    with span('image_blocklist', phase='image_blocklist'):
+        blocklist = await run_db(get_image_blocklist)
+        if not len(blocklist):
+            return None
+        try:
+            # Decoding and resizing is tens of milliseconds for a large upload, so it stays off the loop
+            phash, dhash = await asyncio.to_thread(image_hashes, data)
+        except Exception as e:
+            # Pillow can't read it, so the workflow couldn't use it either; let that fail where it normally would
+            logger.warning(f"Could not hash reference image from {user_id}: {str(e)}")
+            return None
+        entry = blocklist.match(phash, dhash)
+    if entry is None:
+        return None
+    logger.info(f"Refused reference image from {user_id}: matches blocklist entry {entry.id}")
+    await record_audit(user_id, 'blocked_image_upload', str(entry.id), entry.reason)
+    return BLOCKED_IMAGE_MESSAGE
@@ -11,16 +11,27 @@ import uuid
 import json
 import os
 import re
-from Main.utils import load_json, generate_random_seed, save_json
+from Main.utils import load_json_snapshot, generate_random_seed, save_json
 from Main.database import (
     is_user_banned, ban_user, get_banned_words, add_user_warning, 
     get_user_warnings, remove_user_warnings, get_all_warnings, add_banned_word, 
-    remove_banned_word, unban_user, get_ban_info, get_all_banned_users
+    remove_banned_word, unban_user, get_ban_info, get_all_banned_users, run_db,
+    get_user_image_count, get_top_users, get_lora_usage,
+    add_blocked_image, remove_blocked_image, get_blocked_images
 )
-from .banned_utils import check_banned
-from .views import CreativityModal, LoRAView, LoraInfoView, ReduxPromptModal, PulidModal
+from Main.image_hash import image_hashes, content_hash
+from .banned_utils import check_banned, check_enhanced
+from .quota_utils import check_quota, charge_quota
+from Main.quota import template_kind
+from Main.history_writer import record_audit, flush_pending
+from Main.tracing import span, start_trace
+from .views import CreativityModal, LoRAView, LoraInfoView, ReduxPromptModal, PulidModal, HistorySearchView
 from .image_processing import process_image_request
-from config import ENABLE_PROMPT_ENHANCEMENT, AI_PROVIDER, fluxversion
+from config import (
+    ENABLE_PROMPT_ENHANCEMENT, AI_PROVIDER, fluxversion, BOT_MANAGER_ROLE_ID,
+    HISTORY_EXPORT_DIR, DISCORD_UPLOAD_LIMIT_BYTES
+)
+from Main.history_export import export_history
 from ..LMstudio_bot.ai_providers import AIProviderFactory
 from .workflow_utils import update_workflow
 from .models import RequestItem
@@ -99,7 +110,7 @@ async def setup_commands(bot: commands.Bot):
     @check_channel()
     async def lorainfo(interaction: discord.Interaction):
         try:
-            loras_data = load_json('lora.json')
+            loras_data = load_json_snapshot('lora.json')
             available_loras = loras_data.get('available_loras', [])
             view = LoraInfoView(available_loras)
             await interaction.response.send_message(
@@ -120,30 +131,37 @@ async def setup_commands(bot: commands.Bot):
         seed="Enter a seed for reproducibility (optional)"
     )
     @app_commands.choices(resolution=[
-        app_commands.Choice(name=name, value=name) for name in load_json('ratios.json')['ratios'].keys()
+        app_commands.Choice(name=name, value=name) for name in load_json_snapshot('ratios.json')['ratios'].keys()
     ])
     @app_commands.choices(upscale_factor=[
         app_commands.Choice(name=str(i), value=i) for i in range(1, 5)
     ])
     async def comfy(interaction: discord.Interaction, prompt: str, resolution: str, 
                     upscale_factor: int = 1, seed: Optional[int] = None):
+        trace_id = start_trace()
         try:
             logger.info(f"Comfy command invoked by {interaction.user.id}")
             
             # Check for banned words first, before any other processing
-            is_banned, message = check_banned(str(interaction.user.id), prompt)
+            is_banned, message = await check_banned(str(interaction.user.id), prompt)
             if message:  # If there's a message, either a warning or ban
                 await interaction.response.send_message(message, ephemeral=True)
                 return  # Don't continue with image generation if banned word is detected
+
+            message = check_quota(interaction, template_kind(fluxversion), resolution, upscale_factor)
+            if message:
+                await interaction.response.send_message(message, ephemeral=True)
+                return
             
             # Show creativity modal or process directly based on prompt enhancement setting
             if ENABLE_PROMPT_ENHANCEMENT:
                 # Show creativity modal without initializing AI provider yet
-                creativity_modal = CreativityModal(interaction.client, resolution, prompt, upscale_factor, seed)
+                creativity_modal = CreativityModal(interaction.client, resolution, prompt, upscale_factor, seed, trace_id)
                 await interaction.response.send_modal(creativity_modal)
             else:
                 # If prompt enhancement is disabled, process directly
-                await process_image_request(interaction, prompt, resolution, upscale_factor, seed)
+                await process_image_request(interaction, prompt, resolution, upscale_factor, seed,
+                                            quota_kind=template_kind(fluxversion))
 
         except Exception as e:
             logger.error(f"Error in comfy command: {str(e)}", exc_info=True)
@@ -168,6 +186,11 @@ async def setup_commands(bot: commands.Bot):
 
             logger.debug(f"Received reduxprompt command with resolution: {resolution}, strength: {strength}")
 
+            message = check_quota(interaction, 'reduxprompt', resolution)
+            if message:
+                await interaction.response.send_message(message, ephemeral=True)
+                return
+
             # Show the modal for prompt input first
             modal = ReduxPromptModal(bot, resolution, strength)
             await interaction.response.send_modal(modal)
@@ -191,7 +214,7 @@ async def setup_commands(bot: commands.Bot):
             app_commands.choices(
                 resolution=[
                     app_commands.Choice(name=name, value=name)
-                    for name in load_json('ratios.json')['ratios'].keys()
+                    for name in load_json_snapshot('ratios.json')['ratios'].keys()
                 ],
                 strength=[
                     app_commands.Choice(name="Highest", value="highest"),
@@ -231,7 +254,8 @@ async def setup_commands(bot: commands.Bot):
             await interaction.response.defer(ephemeral=True)
             
             word = word.lower()
-            add_banned_word(word)
+            await run_db(add_banned_word, word)
+            await record_audit(str(interaction.user.id), 'add_banned_word', word)
             await interaction.followup.send(f"Added '{word}' to the banned words list.", ephemeral=True)
         except Exception as e:
             logger.error(f"Error in add_banned_word command: {str(e)}")
@@ -244,22 +268,71 @@ async def setup_commands(bot: commands.Bot):
     @app_commands.checks.has_permissions(administrator=True)
     async def remove_banned_word_command(interaction: discord.Interaction, word: str):
         word = word.lower()
-        remove_banned_word(word)
+        await run_db(remove_banned_word, word)
+        await record_audit(str(interaction.user.id), 'remove_banned_word', word)
         await interaction.response.send_message(f"Removed '{word}' from the banned words list.", ephemeral=True)
 
     @bot.tree.command(name="list_banned_words", description="List all banned words")
     @app_commands.checks.has_permissions(administrator=True)
     async def list_banned_words(interaction: discord.Interaction):
-        banned_words = get_banned_words()
+        banned_words = await run_db(get_banned_words)
         if banned_words:
             await interaction.response.send_message(f"Banned words: {', '.join(banned_words)}", ephemeral=True)
         else:
             await interaction.response.send_message("There are no banned words.", ephemeral=True)
 
+    @bot.tree.command(name="block_image", description="Stop an image (and close copies of it) being used as a reference image")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def block_image_command(interaction: discord.Interaction, image: discord.Attachment, reason: str):
+        try:
+            await interaction.response.defer(ephemeral=True)
+
+            data = await image.read()
+            try:
+                phash, dhash = await asyncio.to_thread(image_hashes, data)
+            except Exception as e:
+                await interaction.followup.send(f"Could not read {image.filename} as an image: {str(e)}", ephemeral=True)
+                return
+
+            entry_id = await run_db(add_blocked_image, phash, dhash, content_hash(data), reason, str(interaction.user.id))
+            if entry_id is None:
+                await interaction.followup.send("That image is already blocked.", ephemeral=True)
+                return
+            await record_audit(str(interaction.user.id), 'block_image', str(entry_id), reason)
+            await interaction.followup.send(f"Blocked image as entry {entry_id}. Reason: {reason}", ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in block_image command: {str(e)}")
+            if not interaction.response.is_done():
+                await interaction.response.send_message(f"Error blocking image: {str(e)}", ephemeral=True)
+            else:
+                await interaction.followup.send(f"Error blocking image: {str(e)}", ephemeral=True)
+
+    @bot.tree.command(name="unblock_image", description="Remove an image from the reference image blocklist")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def unblock_image_command(interaction: discord.Interaction, entry_id: int):
+        if await run_db(remove_blocked_image, entry_id):
+            await record_audit(str(interaction.user.id), 'unblock_image', str(entry_id))
+            await interaction.response.send_message(f"Removed entry {entry_id} from the image blocklist.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"There is no image blocklist entry {entry_id}.", ephemeral=True)
+
+    @bot.tree.command(name="list_blocked_images", description="List the reference image blocklist")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def list_blocked_images(interaction: discord.Interaction):
+        entries = await run_db(get_blocked_images)
+        if not entries:
+            await interaction.response.send_message("There are no blocked images.", ephemeral=True)
+            return
+        lines = [f"#{entry['id']} — {entry['reason']} (by <@{entry['added_by']}>, {entry['added_at']})" for entry in entries[:25]]
+        if len(entries) > 25:
+            lines.append(f"...and {len(entries) - 25} more")
+        await interaction.response.send_message("Blocked images:\n" + "\n".join(lines), ephemeral=True)
+
     @bot.tree.command(name="ban_user", description="Ban a user from using the comfy command")
     @app_commands.checks.has_permissions(administrator=True)
     async def ban_user_command(interaction: discord.Interaction, user: discord.User, reason: str):
-        ban_user(str(user.id), reason)
+        await run_db(ban_user, str(user.id), reason)
+        await record_audit(str(interaction.user.id), 'ban_user', str(user.id), reason)
         await interaction.response.send_message(f"Banned {user.name} from using the comfy command. Reason: {reason}", ephemeral=True)
 
     @bot.tree.command(name="unban_user", description="Unban a user from using the comfy command")
@@ -269,7 +342,8 @@ async def setup_commands(bot: commands.Bot):
             # Defer the response first
             await interaction.response.defer(ephemeral=True)
             
-            if unban_user(str(user.id)):
+            if await run_db(unban_user, str(user.id)):
+                await record_audit(str(interaction.user.id), 'unban_user', str(user.id))
                 await interaction.followup.send(f"Unbanned {user.name} from using the comfy command.", ephemeral=True)
             else:
                 await interaction.followup.send(f"{user.name} is not banned.", ephemeral=True)
@@ -284,7 +358,7 @@ async def setup_commands(bot: commands.Bot):
     @app_commands.checks.has_permissions(administrator=True)
     async def whybanned(interaction: discord.Interaction, user: discord.User):
         try:
-            ban_info = get_ban_info(str(user.id))
+            ban_info = await run_db(get_ban_info, str(user.id))
             if ban_info:
                 await interaction.response.send_message(
                     f"{user.name} was banned on {ban_info['banned_at']} for the following reason: {ban_info['reason']}", 
@@ -303,7 +377,7 @@ async def setup_commands(bot: commands.Bot):
     @app_commands.checks.has_permissions(administrator=True)
     async def list_banned_users(interaction: discord.Interaction):
         try:
-            banned_users = get_all_banned_users()
+            banned_users = await run_db(get_all_banned_users)
             if not banned_users:
                 await interaction.response.send_message("No users are currently banned.", ephemeral=True)
                 return
@@ -341,8 +415,9 @@ async def setup_commands(bot: commands.Bot):
             # Defer the response first
             await interaction.response.defer(ephemeral=True)
             
-            # Get current warnings
-            current_warnings = get_user_warnings(str(user.id))
+            # Get current warnings, including any still queued for writing
+            await flush_pending()
+            current_warnings = await run_db(get_user_warnings, str(user.id))
             
             if current_warnings == 0:
                 await interaction.followup.send(
@@ -352,9 +427,10 @@ async def setup_commands(bot: commands.Bot):
                 return
                 
             # Remove all warnings
-            success, message = remove_user_warnings(str(user.id))
+            success, message = await run_db(remove_user_warnings, str(user.id))
             
             if success:
+                await record_audit(str(interaction.user.id), 'remove_warnings', str(user.id), message)
                 await interaction.followup.send(
                     f"Successfully removed all warnings from {user.mention}. ({message})",
                     ephemeral=True
@@ -389,7 +465,8 @@ async def setup_commands(bot: commands.Bot):
             # Defer the response first since we might need time to process
             await interaction.response.defer(ephemeral=True)
             
-            success, result = get_all_warnings()
+            await flush_pending()
+            success, result = await run_db(get_all_warnings)
             
             if not success:
                 await interaction.followup.send(result, ephemeral=True)
@@ -502,6 +579,97 @@ async def setup_commands(bot: commands.Bot):
                     ephemeral=True
                 )
 
+    history_group = app_commands.Group(name="history", description="Browse past image generations")
+
+    @history_group.command(name="search", description="Search the prompts of past images")
+    @check_channel()
+    @app_commands.describe(
+        query="Words to look for in prompts; end a word with * to match prefixes",
+        user="Search another user's images (admins and bot managers)",
+        all_users="Search everyone's images (admins and bot managers)"
+    )
+    async def history_search(interaction: discord.Interaction, query: str,
+                             user: Optional[discord.User] = None, all_users: bool = False):
+        try:
+            target = user or interaction.user
+            if all_users or target.id != interaction.user.id:
+                permissions = getattr(interaction.user, 'guild_permissions', None)
+                is_admin = permissions is not None and permissions.administrator
+                is_manager = any(role.id == BOT_MANAGER_ROLE_ID for role in getattr(interaction.user, 'roles', []))
+                if not (is_admin or is_manager):
+                    await interaction.response.send_message("You can only search your own images.", ephemeral=True)
+                    return
+
+            view = HistorySearchView(query, None if all_users else str(target.id))
+            await view.load_page()
+            await interaction.response.send_message(content=view.get_page_content(), view=view, ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in history search command: {str(e)}")
+            if not interaction.response.is_done():
+                await interaction.response.send_message("An error occurred while searching history.", ephemeral=True)
+            else:
+                await interaction.followup.send("An error occurred while searching history.", ephemeral=True)
+
+    @history_group.command(name="export", description="Export image history as compressed JSON Lines or CSV")
+    @has_admin_or_bot_manager_role()
+    @app_commands.describe(
+        format="File format",
+        since="Only images from this date on (YYYY-MM-DD)",
+        user="Only this user's images"
+    )
+    @app_commands.choices(format=[
+        app_commands.Choice(name="JSON Lines", value="jsonl"),
+        app_commands.Choice(name="CSV", value="csv")
+    ])
+    async def history_export(interaction: discord.Interaction, format: str = "jsonl",
+                             since: Optional[str] = None, user: Optional[discord.User] = None):
+        try:
+            await interaction.response.defer(ephemeral=True)
+            filename = f"history_{time.strftime('%Y%m%d_%H%M%S')}.{format}.gz"
+            path = os.path.join(HISTORY_EXPORT_DIR, filename)
+            # A long export gets its own thread and connection so the database thread stays free
+            count = await asyncio.to_thread(
+                export_history, path, format, since=since, user_id=str(user.id) if user else None
+            )
+            await record_audit(str(interaction.user.id), 'export_history', str(user.id) if user else None,
+                               f"{count} rows to {path}")
+
+            if os.path.getsize(path) <= DISCORD_UPLOAD_LIMIT_BYTES:
+                await interaction.followup.send(
+                    f"Exported {count} images.", file=discord.File(path, filename), ephemeral=True
+                )
+            else:
+                await interaction.followup.send(
+                    f"Exported {count} images to `{path}` on the bot host (too large to attach).", ephemeral=True
+                )
+        except Exception as e:
+            logger.error(f"Error in history export command: {str(e)}")
+            await interaction.followup.send(f"Error exporting history: {str(e)}", ephemeral=True)
+
+    @history_group.command(name="top", description="Today's most active users and the most used LoRAs")
+    @check_channel()
+    async def history_top(interaction: discord.Interaction):
+        try:
+            # Served from the usage rollups, so this doesn't scan history
+            top_users = await run_db(get_top_users, None, 5)
+            top_loras = await run_db(get_lora_usage, 5)
+            own_count = await run_db(get_user_image_count, str(interaction.user.id))
+            lora_names = {lora['file']: lora['name'] for lora in bot.lora_options}
+
+            lines = ["**Most images today (UTC)**"]
+            lines += [f"{rank}. <@{user_id}>: {images}" for rank, (user_id, images) in enumerate(top_users, 1)] or ["No images yet today."]
+            lines.append("\n**Most used LoRAs**")
+            lines += [f"{rank}. {lora_names.get(lora, lora)}: {uses}" for rank, (lora, uses) in enumerate(top_loras.items(), 1)] or ["No LoRAs used yet."]
+            lines.append(f"\nYou have made {own_count} images today.")
+            await interaction.response.send_message(
+                "\n".join(lines), ephemeral=True, allowed_mentions=discord.AllowedMentions.none()
+            )
+        except Exception as e:
+            logger.error(f"Error in history top command: {str(e)}")
+            await interaction.response.send_message("An error occurred while reading usage.", ephemeral=True)
+
+    bot.tree.add_command(history_group)
+
     @bot.tree.command(name="sync", description="Sync bot commands")
     @has_admin_or_bot_manager_role()
     async def sync_commands(interaction: discord.Interaction):
@@ -525,12 +693,17 @@ async def setup_commands(bot: commands.Bot):
     )
     @app_commands.choices(resolution=[
         app_commands.Choice(name=name, value=name)
-        for name in load_json('ratios.json')['ratios'].keys()
+        for name in load_json_snapshot('ratios.json')['ratios'].keys()
     ])
     async def pulid(interaction: discord.Interaction, resolution: str):
         try:
             logger.debug(f"Received pulid command with resolution: {resolution}")
 
+            message = check_quota(interaction, 'pulid', resolution)
+            if message:
+                await interaction.response.send_message(message, ephemeral=True)
+                return
+
             # Show the modal for prompt input
             modal = PulidModal(bot, resolution)
             await interaction.response.send_modal(modal)
@@ -543,13 +716,14 @@ async def setup_commands(bot: commands.Bot):
             )
 
     class CreativityModal(discord.ui.Modal, title='Select Creativity Level'):
-        def __init__(self, bot, resolution, prompt, upscale_factor, seed):
+        def __init__(self, bot, resolution, prompt, upscale_factor, seed, trace_id=None):
             super().__init__()
             self.bot = bot
             self.resolution = resolution
             self.prompt = prompt
             self.upscale_factor = upscale_factor
             self.seed = seed  # Store the seed as an instance variable
+            self.trace_id = trace_id  # Continue the trace of the /comfy command
             
             self.creativity = discord.ui.TextInput(
                 label='Creativity Level (1-10)',
@@ -572,6 +746,7 @@ async def setup_commands(bot: commands.Bot):
             self.add_item(self.note)
 
         async def on_submit(self, interaction: discord.Interaction):
+            start_trace(self.trace_id)
             try:
                 creativity_level = int(self.creativity.value)
                 if not 1 <= creativity_level <= 10:
@@ -584,7 +759,7 @@ async def setup_commands(bot: commands.Bot):
                 await interaction.response.defer(ephemeral=True)
                 
                 # Check for banned words first
-                is_banned, message = check_banned(str(interaction.user.id), self.prompt)
+                is_banned, message = await check_banned(str(interaction.user.id), self.prompt)
                 if message:  # If there's a warning or ban message
                     await interaction.followup.send(message, ephemeral=True)
                     if is_banned:  # If the user is banned, stop processing
@@ -592,7 +767,7 @@ async def setup_commands(bot: commands.Bot):
 
                 # Clean prompt of any existing LoRA trigger words and timestamps
                 base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.prompt)
-                lora_config = load_json('lora.json')
+                lora_config = load_json_snapshot('lora.json')
                 
                 # Remove existing LoRA trigger words from base prompt
                 for lora in lora_config['available_loras']:
@@ -621,10 +796,11 @@ async def setup_commands(bot: commands.Bot):
                             enhanced_prompt = base_prompt
                         else:
                             # Enhance the cleaned prompt
-                            enhanced_prompt = await interaction.client.ai_provider.generate_response(
-                                base_prompt,
-                                temperature=float(creativity_level) / 10.0  # Convert 1-10 to 0.1-1.0
-                            )
+                            with span('prompt_enhancement', phase='prompt_enhancement', creativity=creativity_level):
+                                enhanced_prompt = await interaction.client.ai_provider.generate_response(
+                                    base_prompt,
+                                    temperature=float(creativity_level) / 10.0  # Convert 1-10 to 0.1-1.0
+                                )
                             
                             if not enhanced_prompt:
                                 enhanced_prompt = base_prompt
@@ -649,12 +825,11 @@ async def setup_commands(bot: commands.Bot):
                     else:
                         logger.info("Prompt enhancement disabled, using original prompt")
 
-                # Check enhanced prompt for banned words
-                is_banned, message = check_banned(str(interaction.user.id), enhanced_prompt)
-                if message:  # If there's a warning or ban message
+                # Check enhanced prompt for banned words the enhancement added
+                message = await check_enhanced(str(interaction.user.id), self.prompt, enhanced_prompt)
+                if message:
                     await interaction.followup.send(message, ephemeral=True)
-                    if is_banned:  # If the user is banned, stop processing
-                        return
+                    return
 
                 # Show the original prompt
                 await interaction.followup.send(
@@ -714,14 +889,18 @@ async def setup_commands(bot: commands.Bot):
                 full_prompt = full_prompt.strip(' ,')
                 logger.debug(f"Final prompt with LoRA triggers: {full_prompt}")
                 
+                message = charge_quota(interaction, template_kind(fluxversion), self.resolution, self.upscale_factor)
+                if message:
+                    await interaction.followup.send(message, ephemeral=True)
+                    return
+
                 # Use the seed from instance variable, or generate new one if None
                 current_seed = self.seed if self.seed is not None else generate_random_seed()
                 
-                workflow = load_json(f'{fluxversion}')
                 request_uuid = str(uuid.uuid4())
                 
                 workflow = update_workflow(
-                    workflow,
+                    fluxversion,
                     full_prompt,
                     self.resolution,
                     selected_loras,
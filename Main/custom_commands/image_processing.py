@@ -7,14 +7,20 @@ from typing import Optional, List, Any, Dict
 from discord import Interaction
 
 # Local application imports
-from Main.utils import load_json, save_json, generate_random_seed
+from Main.utils import load_json_snapshot, save_json, generate_random_seed
+from Main.tracing import span
 from .workflow_utils import update_workflow
+from .quota_utils import charge_quota
 from config import fluxversion
 
 logger = logging.getLogger(__name__)
 
-async def process_image_request(interaction: discord.Interaction, prompt: str, resolution: str, upscale_factor: int = 1, seed: Optional[int] = None, workflow: Optional[Dict] = None, workflow_filename: Optional[str] = None):
-    """Process a standard image generation request without prompt enhancement."""
+async def process_image_request(interaction: discord.Interaction, prompt: str, resolution: str, upscale_factor: int = 1, seed: Optional[int] = None, workflow: Optional[Dict] = None, workflow_filename: Optional[str] = None, quota_kind: Optional[str] = None):
+    """
+    Process a standard image generation request without prompt enhancement.
+    When quota_kind is given, a workflow built here is charged to the user's
+    quota once the LoRAs are picked; callers passing a workflow charge it themselves.
+    """
     try:
         # Only defer if we haven't responded yet (i.e., no warning message was sent)
         if not interaction.response.is_done():
@@ -32,7 +38,8 @@ async def process_image_request(interaction: discord.Interaction, prompt: str, r
             )
             
             # Wait for LoRA selection
-            await lora_view.wait()
+            with span('lora_selection'):
+                await lora_view.wait()
             
             if not hasattr(lora_view, 'has_confirmed') or not lora_view.has_confirmed:
                 await lora_message.edit(content="Selection cancelled or timed out.", view=None)
@@ -45,9 +52,15 @@ async def process_image_request(interaction: discord.Interaction, prompt: str, r
                 await lora_message.delete()
             except discord.NotFound:
                 pass
+
+            if quota_kind:
+                message = charge_quota(interaction, quota_kind, resolution, upscale_factor)
+                if message:
+                    await interaction.followup.send(message, ephemeral=True)
+                    return
             
             # Get LoRA trigger words for currently selected LoRAs
-            lora_config = load_json('lora.json')
+            lora_config = load_json_snapshot('lora.json')
             additional_prompts = []
             for lora_file in selected_loras:
                 lora_info = next(
@@ -70,11 +83,10 @@ async def process_image_request(interaction: discord.Interaction, prompt: str, r
             # Use provided seed or generate new one
             current_seed = seed if seed is not None else generate_random_seed()
             
-            workflow = load_json(fluxversion)
             request_uuid = str(uuid.uuid4())
             
             workflow = update_workflow(
-                workflow,
+                fluxversion,
                 full_prompt,
                 resolution,
                 selected_loras,
@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List, Optional, Union
 import logging
 import os
+import time
+from Main.tracing import trace_id_for_request
 
 logger = logging.getLogger(__name__)
 
@@ -15,13 +17,19 @@ class BaseRequestItem:
     original_message_id: str
     resolution: str
     workflow_filename: str
+    # Monotonic creation time, used to measure how long the request waited in the queue
+    created_at: float = field(default_factory=time.monotonic, init=False, repr=False, compare=False)
+    # Trace id of the command that created the request, reused as the runner's request_id
+    request_id: str = field(default_factory=trace_id_for_request, init=False, compare=False)
+
+    backend = 'standard'
 
     def __post_init__(self):
         # Convert all string fields to strings and handle None values
-        for field in self.__dataclass_fields__:
-            if field not in ['upscale_factor', 'loras', 'seed', 'strength1', 'strength2', 'image1', 'image2']:
-                value = getattr(self, field)
-                setattr(self, field, str(value) if value is not None else '')
+        for field_name in self.__dataclass_fields__:
+            if field_name not in ['upscale_factor', 'loras', 'seed', 'strength1', 'strength2', 'image1', 'image2', 'created_at']:
+                value = getattr(self, field_name)
+                setattr(self, field_name, str(value) if value is not None else '')
 
 @dataclass
 class RequestItem(BaseRequestItem):
@@ -45,6 +53,11 @@ class RequestItem(BaseRequestItem):
         if self.seed is not None:
             self.seed = int(self.seed)
 
+    @property
+    def backend(self) -> str:
+        # is_pulid has been stringified by BaseRequestItem.__post_init__
+        return 'pulid' if str(self.is_pulid).lower() == 'true' else 'standard'
+
 @dataclass
 class ReduxPromptRequestItem(BaseRequestItem):
     """Request item for ReduxPrompt image generation with one reference image and prompt"""
@@ -54,6 +67,8 @@ class ReduxPromptRequestItem(BaseRequestItem):
     image_filename: str
     seed: Optional[int] = None  # Optional seed value for generation
 
+    backend = 'reduxprompt'
+
     def __post_init__(self):
         super().__post_init__()
         
@@ -91,6 +106,8 @@ class ReduxRequestItem(BaseRequestItem):
     image1_filename: str
     image2_filename: str
 
+    backend = 'redux'
+
     def __post_init__(self):
         super().__post_init__()
         
@@ -0,0 +1,61 @@
+import logging
+from typing import Optional
+
+import discord
+
+from Main.utils import load_json_snapshot
+from Main.quota import estimate_gpu_seconds
+from Main.metrics import QUOTA_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+def format_wait(seconds: float) -> str:
+    seconds = int(seconds + 0.999)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m"
+
+def _quota_decision(interaction: discord.Interaction, kind: str, resolution: str, upscale_factor: int,
+                    charge: bool) -> Optional[str]:
+    quota = getattr(interaction.client, 'quota', None)
+    if quota is None:
+        return None
+    try:
+        size = load_json_snapshot('ratios.json')['ratios'][resolution]
+        cost = estimate_gpu_seconds(kind, size['width'], size['height'], upscale_factor)
+    except Exception as e:
+        # An unknown resolution is the command's problem to report, not the quota's
+        logger.warning(f"Could not price {kind} request at {resolution}: {str(e)}")
+        return None
+
+    role_ids = [role.id for role in getattr(interaction.user, 'roles', [])]
+    admit = quota.try_consume if charge else quota.would_admit
+    admitted, retry_after = admit(str(interaction.user.id), role_ids, cost)
+    # A check that passes is counted when the request is charged, so each admitted request counts once
+    if charge or not admitted:
+        QUOTA_DECISIONS.inc(kind=kind, outcome='admitted' if admitted else 'rejected')
+    if admitted:
+        return None
+    logger.info(f"Quota rejected {kind} request from {interaction.user.id} (~{cost:.0f} GPU-seconds)")
+    return (f"⏳ You've used your GPU quota for now. This request needs about {cost:.0f} GPU-seconds; "
+            f"try again in {format_wait(retry_after)}.")
+
+def check_quota(interaction: discord.Interaction, kind: str, resolution: str, upscale_factor: int = 1) -> Optional[str]:
+    """
+    Check that the user's quota covers the request's estimated GPU time,
+    without charging it. Returns a message to send instead of starting the
+    request when over quota.
+    """
+    return _quota_decision(interaction, kind, resolution, upscale_factor, charge=False)
+
+def charge_quota(interaction: discord.Interaction, kind: str, resolution: str, upscale_factor: int = 1) -> Optional[str]:
+    """
+    Charge the request's estimated GPU time to the user's quota; call it
+    just before the request goes on the queue. Returns a message to send
+    instead of queueing the request when over quota.
+    """
+    return _quota_decision(interaction, kind, resolution, upscale_factor, charge=True)
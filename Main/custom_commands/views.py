@@ -7,12 +7,17 @@ import asyncio
 from discord import app_commands, SelectOption
 from discord.ui import View, Select, Button, Modal, TextInput
 from typing import List, Optional, Dict, Any
-from Main.utils import load_json, save_json, generate_random_seed
-from .workflow_utils import update_workflow, update_pulid_workflow, update_reduxprompt_workflow
+from Main.utils import load_json_snapshot, save_json, generate_random_seed
+from .workflow_utils import update_workflow, update_pulid_workflow, update_redux_workflow, update_reduxprompt_workflow
 from .models import RequestItem, ReduxPromptRequestItem, ReduxRequestItem
-from .banned_utils import check_banned
+from .banned_utils import check_banned, check_regenerate, check_reference_image
+from .quota_utils import charge_quota
+from Main.quota import template_kind
+from Main.tracing import span, start_trace
+from Main.database import run_db, search_history
+from Main.image_store import STORED_NAME_PATTERN
 from .image_processing import process_image_request
-from config import PULIDWORKFLOW, fluxversion
+from config import PULIDWORKFLOW, fluxversion, IMAGE_PUBLIC_BASE_URL
 
 logger = logging.getLogger(__name__)
 
@@ -464,7 +469,7 @@ class OptionsView(View):
             logger.debug(f"Final LoRA selections at confirmation: {self.all_selected_loras}")
             
             # Process the prompt with LoRA trigger words
-            lora_config = load_json('lora.json')
+            lora_config = load_json_snapshot('lora.json')
             base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.original_prompt)
             
             # First remove ALL existing trigger words from the base prompt
@@ -566,8 +571,9 @@ class PromptModal(Modal, title="Edit Prompt"):
         self.add_item(self.seed)
 
     async def on_submit(self, interaction: discord.Interaction):
+        start_trace()
         try:
-            lora_config = load_json('lora.json')
+            lora_config = load_json_snapshot('lora.json')
             base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.prompt.value)
             
             # Clean base prompt of any existing LoRA trigger words
@@ -594,10 +600,9 @@ class PromptModal(Modal, title="Edit Prompt"):
             except ValueError:
                 seed = None
 
-            workflow = load_json(fluxversion)
             request_uuid = str(uuid.uuid4())
             
-            workflow = update_workflow(workflow, 
+            workflow = update_workflow(fluxversion, 
                                   full_prompt,
                                   self.resolution, 
                                   self.loras, 
@@ -655,6 +660,7 @@ class ReduxModal(Modal, title='Redux Image Generator'):
         self.add_item(self.strength2)
 
     async def on_submit(self, interaction: discord.Interaction):
+        start_trace()
         try:
             # Validate strength inputs
             try:
@@ -692,6 +698,10 @@ class ReduxModal(Modal, title='Redux Image Generator'):
                 await msg1.delete()
                 # Delete first prompt after image is received
                 await first_prompt.delete()
+                blocked = await check_reference_image(str(interaction.user.id), image1_data)
+                if blocked:
+                    await interaction.followup.send(blocked, ephemeral=True)
+                    return
                 
                 # Get second image
                 second_prompt = await interaction.followup.send(
@@ -705,6 +715,15 @@ class ReduxModal(Modal, title='Redux Image Generator'):
                 await msg2.delete()
                 # Delete second prompt after image is received
                 await second_prompt.delete()
+                blocked = await check_reference_image(str(interaction.user.id), image2_data)
+                if blocked:
+                    await interaction.followup.send(blocked, ephemeral=True)
+                    return
+
+                message = charge_quota(interaction, 'redux', self.resolution)
+                if message:
+                    await interaction.followup.send(message, ephemeral=True)
+                    return
 
                 # Create processing message
                 processing_msg = await interaction.followup.send(
@@ -715,7 +734,7 @@ class ReduxModal(Modal, title='Redux Image Generator'):
 
                 # Create request item
                 workflow_filename = f'redux_{str(uuid.uuid4())}.json'
-                workflow = load_json('Redux.json')
+                workflow = load_json_snapshot('Redux.json')
                 save_json(workflow_filename, workflow)
 
                 request_item = ReduxRequestItem(
@@ -786,6 +805,7 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
         self.add_item(self.seed)
 
     async def on_submit(self, interaction: discord.Interaction):
+        start_trace()
         try:
             # Process seed value
             seed = None
@@ -800,7 +820,7 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
                     return
 
             # Check for banned words in the prompt
-            is_banned, message = check_banned(str(interaction.user.id), self.prompt.value)
+            is_banned, message = await check_banned(str(interaction.user.id), self.prompt.value)
             if message:  # If there's a warning or ban message
                 await interaction.response.send_message(message, ephemeral=True)
                 if is_banned:  # If the user is banned, stop processing
@@ -835,11 +855,27 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
                     )
                     return
 
+                image_data = await attachment.read()
+                blocked = await check_reference_image(str(interaction.user.id), image_data)
+                if blocked:
+                    try:
+                        await message.delete()
+                    except Exception as e:
+                        logger.error(f"Error deleting blocked upload: {str(e)}")
+                    await interaction.followup.send(blocked, ephemeral=True)
+                    return
+
+                message = charge_quota(interaction, 'reduxprompt', self.resolution)
+                if message:
+                    await interaction.followup.send(message, ephemeral=True)
+                    return
+
                 # Save the image
                 temp_dir = os.path.join(os.getcwd(), 'Main', 'Datasets', 'temp')
                 os.makedirs(temp_dir, exist_ok=True)
                 image_path = os.path.join(temp_dir, f"{request_id}_{attachment.filename}")
-                await attachment.save(image_path)
+                with open(image_path, 'wb') as f:
+                    f.write(image_data)
 
                 # Delete both the upload message and the original request message
                 try:
@@ -851,9 +887,8 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
 
                 # Load and update the workflow
                 try:
-                    base_workflow = load_json('Reduxprompt.json')
                     workflow = update_reduxprompt_workflow(
-                        workflow=base_workflow,
+                        workflow='Reduxprompt.json',
                         image_path=image_path,
                         prompt=self.prompt.value,
                         strength=self.strength,
@@ -960,7 +995,13 @@ class ReduxProcessingView(View):
         
         try:
             msg = await self.bot.wait_for('message', timeout=60.0, check=check)
-            self.image1 = await msg.attachments[0].read()
+            image_data = await msg.attachments[0].read()
+            blocked = await check_reference_image(str(interaction.user.id), image_data)
+            if blocked:
+                await msg.delete()
+                await interaction.followup.send(blocked, ephemeral=True)
+                return
+            self.image1 = image_data
             # Keep original filename but prefix with request ID
             original_filename = msg.attachments[0].filename
             self.image1_filename = f"redux_{self.request_id}_1_{original_filename}"
@@ -989,7 +1030,13 @@ class ReduxProcessingView(View):
         
         try:
             msg = await self.bot.wait_for('message', timeout=60.0, check=check)
-            self.image2 = await msg.attachments[0].read()
+            image_data = await msg.attachments[0].read()
+            blocked = await check_reference_image(str(interaction.user.id), image_data)
+            if blocked:
+                await msg.delete()
+                await interaction.followup.send(blocked, ephemeral=True)
+                return
+            self.image2 = image_data
             # Keep original filename but prefix with request ID
             original_filename = msg.attachments[0].filename
             self.image2_filename = f"redux_{self.request_id}_2_{original_filename}"
@@ -1005,24 +1052,8 @@ class ReduxProcessingView(View):
             await interaction.followup.send("Timed out waiting for image upload", ephemeral=True)
 
     async def process_images(self, interaction: discord.Interaction):
+        start_trace()
         try:
-            # Load and modify the Redux workflow
-            workflow = load_json('Redux.json')
-            
-            # Update resolution
-            if '49' in workflow:
-                workflow['49']['inputs']['ratio_selected'] = self.resolution
-            
-            # Update strength values
-            if '53' in workflow:
-                workflow['53']['inputs']['conditioning_to_strength'] = self.strength1
-            if '44' in workflow:
-                workflow['44']['inputs']['conditioning_to_strength'] = self.strength2
-            
-            # Generate workflow filename with request ID
-            workflow_filename = f'redux_{self.request_id}.json'
-            save_json(workflow_filename, workflow)
-
             # Save images in the DataSets directory (not temp)
             datasets_dir = os.path.join('Main', 'DataSets')
             os.makedirs(datasets_dir, exist_ok=True)
@@ -1036,13 +1067,14 @@ class ReduxProcessingView(View):
             with open(image2_path, 'wb') as f:
                 f.write(self.image2)
 
-            # Update workflow with image paths
-            if '40' in workflow:
-                workflow['40']['inputs']['image'] = self.image1_filename
-            if '46' in workflow:
-                workflow['46']['inputs']['image'] = self.image2_filename
+            # Fill in the Redux workflow's resolution, strengths and images
+            workflow = update_redux_workflow(
+                'Redux.json', self.resolution, self.strength1, self.strength2,
+                self.image1_filename, self.image2_filename
+            )
             
-            # Save updated workflow
+            # Generate workflow filename with request ID
+            workflow_filename = f'redux_{self.request_id}.json'
             save_json(workflow_filename, workflow)
 
             # Convert to absolute paths and use forward slashes for logging
@@ -1111,14 +1143,26 @@ class ImageControlView(View):
 
     @discord.ui.button(label="Regenerate", style=discord.ButtonStyle.primary, custom_id="regenerate_button", emoji="♻️")
     async def regenerate(self, interaction: discord.Interaction, button: Button):
+        start_trace()
         try:
+            # The prompt's verdict is cached from the first run, so this is mostly the ban check
+            message = await check_regenerate(str(interaction.user.id), self.original_prompt)
+            if message:
+                await interaction.response.send_message(message, ephemeral=True)
+                return
+
+            message = charge_quota(interaction, template_kind(fluxversion),
+                                   self.original_resolution, self.original_upscale_factor)
+            if message:
+                await interaction.response.send_message(message, ephemeral=True)
+                return
+
             await interaction.response.defer(ephemeral=False)
             
-            workflow = load_json(fluxversion)
             request_uuid = str(uuid.uuid4())
             new_seed = generate_random_seed()
             
-            workflow = update_workflow(workflow, 
+            workflow = update_workflow(fluxversion, 
                                     self.original_prompt, 
                                     self.original_resolution, 
                                     self.original_loras, 
@@ -1199,8 +1243,14 @@ class PromptModal(Modal, title="Edit Prompt"):
         self.add_item(self.seed)
 
     async def on_submit(self, interaction: discord.Interaction):
+        start_trace()
         try:
-            lora_config = load_json('lora.json')
+            is_banned, message = await check_banned(str(interaction.user.id), self.prompt.value)
+            if message:
+                await interaction.response.send_message(message, ephemeral=True)
+                return
+
+            lora_config = load_json_snapshot('lora.json')
             base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.prompt.value)
             
             # Clean base prompt of any existing LoRA trigger words
@@ -1227,10 +1277,9 @@ class PromptModal(Modal, title="Edit Prompt"):
             except ValueError:
                 seed = None
 
-            workflow = load_json(fluxversion)
             request_uuid = str(uuid.uuid4())
             
-            workflow = update_workflow(workflow, 
+            workflow = update_workflow(fluxversion, 
                                   full_prompt,
                                   self.resolution, 
                                   self.loras, 
@@ -1334,6 +1383,55 @@ class LoraInfoView(View):
         self.update_buttons()
         await self.update_message(interaction)
 
+class HistorySearchView(View):
+    """Pages through /history search results, newest first"""
+    def __init__(self, query: str, user_id: Optional[str] = None, page_size: int = 5):
+        super().__init__(timeout=300)  # 5 minute timeout
+        self.query = query
+        self.user_id = user_id
+        self.page_size = page_size
+        # Keyset cursors: cursors[n] is where page n starts (None for the newest page)
+        self.cursors: List[Optional[tuple]] = [None]
+        self.next_cursor: Optional[tuple] = None
+        self.results: List[dict] = []
+
+    async def load_page(self):
+        self.results, self.next_cursor = await run_db(
+            search_history, self.query, self.user_id, self.cursors[-1], self.page_size
+        )
+        self.prev_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = self.next_cursor is None
+
+    def get_page_content(self) -> str:
+        if not self.results:
+            return f"No images found for **{self.query}**."
+        content = [f"Results for **{self.query}** (page {len(self.cursors)})\n"]
+        for entry in self.results:
+            prompt = entry['prompt'] if len(entry['prompt']) <= 200 else entry['prompt'][:197] + '...'
+            line = [f"**{entry['timestamp']}** · {entry['resolution']}"]
+            if not self.user_id:
+                line.append(f"<@{entry['user_id']}>")
+            if IMAGE_PUBLIC_BASE_URL and STORED_NAME_PATTERN.match(entry['image_filename'] or ''):
+                line.append(f"[Image]({IMAGE_PUBLIC_BASE_URL}/images/{entry['image_filename']})")
+            content.append(" · ".join(line) + f"\n{prompt}\n")
+        return "\n".join(content)
+
+    async def update_message(self, interaction: discord.Interaction):
+        await self.load_page()
+        await interaction.response.edit_message(content=self.get_page_content(), view=self)
+
+    @discord.ui.button(label="◀️ Newer", style=discord.ButtonStyle.gray)
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self.update_message(interaction)
+
+    @discord.ui.button(label="Older ▶️", style=discord.ButtonStyle.gray)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        if self.next_cursor is not None:
+            self.cursors.append(self.next_cursor)
+        await self.update_message(interaction)
+
 class ReduxImageView(View):
     """A simple view for Redux images that contains a delete button."""
     def __init__(self):
@@ -1389,11 +1487,12 @@ class PuLIDImageView(View):
         bot.add_view(view)
 
 class CreativityModal(Modal, title='Creativity Settings'):
-    def __init__(self, bot, resolution: str = None, initial_prompt: str = None, upscale_factor: int = 1, initial_seed: Optional[int] = None):
+    def __init__(self, bot, resolution: str = None, initial_prompt: str = None, upscale_factor: int = 1, initial_seed: Optional[int] = None, trace_id: Optional[str] = None):
         super().__init__()
         self.bot = bot
         self.resolution = resolution
         self.upscale_factor = upscale_factor
+        self.trace_id = trace_id  # Continue the trace of the command that opened the modal
 
         self.prompt = TextInput(
             label='Enter your prompt',
@@ -1427,6 +1526,7 @@ class CreativityModal(Modal, title='Creativity Settings'):
         self.add_item(self.creativity)
 
     async def on_submit(self, interaction: discord.Interaction):
+        start_trace(self.trace_id)
         try:
             # Validate creativity value
             try:
@@ -1466,10 +1566,11 @@ class CreativityModal(Modal, title='Creativity Settings'):
                         )
                         return
 
-                enhanced_prompt = await self.bot.ai_provider.generate_response(
-                    prompt,
-                    temperature=temperature
-                )
+                with span('prompt_enhancement', phase='prompt_enhancement', creativity=creativity):
+                    enhanced_prompt = await self.bot.ai_provider.generate_response(
+                        prompt,
+                        temperature=temperature
+                    )
 
                 # Get the enhancement level description
                 if creativity == 1:
@@ -1563,6 +1664,7 @@ class PulidModal(discord.ui.Modal, title='PuLID Image Generation'):
         self.add_item(self.seed)
 
     async def on_submit(self, interaction: discord.Interaction):
+        start_trace()
         try:
             # Process seed value
             seed = None
@@ -1579,7 +1681,7 @@ class PulidModal(discord.ui.Modal, title='PuLID Image Generation'):
                 seed = generate_random_seed()
 
             # Check for banned words in the prompt
-            is_banned, message = check_banned(str(interaction.user.id), self.prompt.value)
+            is_banned, message = await check_banned(str(interaction.user.id), self.prompt.value)
             if message:  # If there's a warning or ban message
                 await interaction.response.send_message(message, ephemeral=True)
                 if is_banned:  # If the user is banned, stop processing
@@ -1615,11 +1717,22 @@ class PulidModal(discord.ui.Modal, title='PuLID Image Generation'):
                     )
                     return
 
+                image_data = await attachment.read()
+                blocked = await check_reference_image(str(interaction.user.id), image_data)
+                if blocked:
+                    try:
+                        await message.delete()
+                    except Exception as e:
+                        logger.error(f"Error deleting blocked upload: {str(e)}")
+                    await interaction.followup.send(blocked, ephemeral=True)
+                    return
+
                 # Save the image
                 temp_dir = os.path.join(os.getcwd(), 'Main', 'Datasets', 'temp')
                 os.makedirs(temp_dir, exist_ok=True)
                 image_path = os.path.join(temp_dir, f"{request_id}_{attachment.filename}")
-                await attachment.save(image_path)
+                with open(image_path, 'wb') as f:
+                    f.write(image_data)
 
                 # Convert to absolute path with forward slashes
                 image_path = os.path.abspath(image_path).replace('\\', '/')
@@ -1651,11 +1764,14 @@ class PulidModal(discord.ui.Modal, title='PuLID Image Generation'):
                 except Exception as e:
                     logger.error(f"Error deleting LoRA selection message: {str(e)}")
 
+                message = charge_quota(interaction, 'pulid', self.resolution)
+                if message:
+                    await interaction.followup.send(message, ephemeral=True)
+                    return
+
                 # Load and update workflow using environment variable
-                workflow_path = os.path.join('Main', 'Datasets', PULIDWORKFLOW)
-                workflow = load_json(workflow_path)
                 workflow = update_pulid_workflow(
-                    workflow,
+                    PULIDWORKFLOW,
                     image_url=image_path,  # Convert to forward slashes
                     prompt=self.prompt.value,
                     resolution=self.resolution,
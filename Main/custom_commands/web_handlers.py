@@ -1,21 +1,156 @@
 import discord
 from aiohttp import web
 import logging
-import json
 import io
-from Main.database import add_to_history
-from Main.utils import load_json
+import json
+import os
+import shutil
+import tempfile
+from Main.history_writer import record_history
+from Main.utils import load_json_snapshot
+from Main.image_compression import compress_file_to_budget, preview_from_file, format_size
+from Main.image_store import ImageStore, StoredImage, CONTENT_TYPES
+from Main.metrics import JOBS_COMPLETED
+from Main.tracing import span, start_trace, import_spans
 from .models import RequestItem, ReduxRequestItem, ReduxPromptRequestItem
-from typing import Dict, Any
+from typing import Dict, Any, Tuple, Optional
 import asyncio
 from .message_constants import STATUS_MESSAGES
 from .views import ImageControlView, ReduxImageView, PuLIDImageView
+from config import (
+    MAX_IMAGE_UPLOAD_BYTES, IMAGE_SPOOL_MEMORY_BYTES, DISCORD_UPLOAD_LIMIT_BYTES,
+    IMAGE_PUBLIC_BASE_URL, IMAGE_PREVIEW_MAX_EDGE
+)
 
 logger = logging.getLogger(__name__)
 
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+class ImageTooLargeError(ValueError):
+    """Raised when an uploaded image exceeds MAX_IMAGE_UPLOAD_BYTES"""
+
+async def spool_image_part(part, max_bytes: int = MAX_IMAGE_UPLOAD_BYTES) -> Tuple[tempfile.SpooledTemporaryFile, int]:
+    """
+    Stream a multipart image part into a spooled temp file.
+    Small images stay in memory, larger ones roll over to disk, and anything
+    above max_bytes is rejected without buffering the rest of the body.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_MEMORY_BYTES)
+    size = 0
+    try:
+        while True:
+            chunk = await part.read_chunk(IMAGE_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageTooLargeError(f"Image exceeds upload limit of {max_bytes} bytes")
+            spool.write(chunk)
+        spool.seek(0)
+        return spool, size
+    except Exception:
+        spool.close()
+        raise
+
+def spill_to_file(fileobj) -> str:
+    """Copy fileobj to a named temp file in chunks and rewind it; the caller removes the file."""
+    fd, path = tempfile.mkstemp(suffix='.img')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            shutil.copyfileobj(fileobj, out, IMAGE_CHUNK_SIZE)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        fileobj.seek(0)
+    return path
+
+async def store_image(image_store: Optional[ImageStore], image_data) -> Optional[StoredImage]:
+    """Save the full-resolution image to the local store on a worker thread."""
+    if image_store is None:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, image_store.save, image_data)
+    except Exception as e:
+        logger.error(f"Error saving image to local store: {str(e)}")
+        return None
+
+async def prepare_attachment(request_data: Dict[str, Any], embed: discord.Embed, stored_image: Optional[StoredImage]) -> str:
+    """
+    Replace request_data['image_data'] with what should be uploaded to Discord
+    and return its file extension. Stored images served by the web server get a
+    downscaled preview plus a link to the full resolution; otherwise images are
+    only recompressed when they exceed Discord's upload limit.
+    """
+    image_extension = stored_image.extension if stored_image else 'png'
+    try:
+        if stored_image and IMAGE_PUBLIC_BASE_URL:
+            result = await preview_from_file(stored_image.path, IMAGE_PREVIEW_MAX_EDGE, DISCORD_UPLOAD_LIMIT_BYTES)
+            embed.add_field(
+                name="Full Resolution",
+                value=f"[Download ({format_size(stored_image.size)})]({IMAGE_PUBLIC_BASE_URL}/images/{stored_image.filename})",
+                inline=False
+            )
+        elif request_data['image_size'] > DISCORD_UPLOAD_LIMIT_BYTES:
+            # The worker reads the image from disk, so the upload is never read into memory here
+            if stored_image:
+                result = await compress_file_to_budget(stored_image.path, DISCORD_UPLOAD_LIMIT_BYTES)
+            else:
+                temp_path = await asyncio.to_thread(spill_to_file, request_data['image_data'])
+                try:
+                    result = await compress_file_to_budget(temp_path, DISCORD_UPLOAD_LIMIT_BYTES)
+                finally:
+                    os.remove(temp_path)
+            if result.compressed:
+                embed.set_footer(
+                    text=f"Compressed {format_size(result.original_size)} → "
+                         f"{format_size(result.final_size)} ({result.format})"
+                )
+        else:
+            return image_extension
+    except Exception as e:
+        logger.error(f"Image recompression failed, uploading original: {str(e)}")
+        request_data['image_data'].seek(0)
+        return image_extension
+
+    if not result.compressed:
+        request_data['image_data'].seek(0)
+        return image_extension
+
+    request_data['image_data'].close()
+    request_data['image_data'] = io.BytesIO(result.data)
+    return result.extension
+
+async def serve_stored_image(request):
+    """Serve a full-resolution image from the local store with range and ETag support."""
+    image_store = request.app.get('image_store')
+    filename = request.match_info.get('filename', '')
+    path = image_store.path_for(filename) if image_store else None
+    if not path or not os.path.isfile(path):
+        return web.Response(text="Image not found", status=404)
+
+    # Stored names are content hashes, so the name itself is a strong ETag
+    etag = f'"{filename.split(".", 1)[0]}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Content-Type': CONTENT_TYPES[filename.rsplit('.', 1)[1]]
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+
+    # FileResponse streams from disk and answers Range requests itself
+    return web.FileResponse(path, headers=headers)
+
 async def handle_generated_image(request):
+    request_data = {'image_data': None}
     try:
         logger.debug("Received request to handle_generated_image")
+        if request.content_length and request.content_length > MAX_IMAGE_UPLOAD_BYTES + IMAGE_CHUNK_SIZE:
+            logger.warning(f"Rejected oversized image upload: {request.content_length} bytes")
+            return web.Response(text="Image too large", status=413)
+
         reader = await request.multipart()
         request_data = {
             'request_id': None,
@@ -29,13 +164,29 @@ async def handle_generated_image(request):
             'loras': None,
             'upscale_factor': None,
             'seed': None,
-            'image_data': None
+            'workflow': None,
+            'image_data': None,
+            'image_size': 0,
+            'spans': []
         }
 
-        # Read multipart data
+        # Read multipart data, streaming the image instead of buffering it
         async for part in reader:
             if part.name == 'image_data':
-                request_data['image_data'] = await part.read(decode=False)
+                try:
+                    spool, image_size = await spool_image_part(part)
+                except ImageTooLargeError as e:
+                    logger.warning(str(e))
+                    return web.Response(text="Image too large", status=413)
+                if request_data['image_data'] is not None:
+                    request_data['image_data'].close()
+                    request_data['image_data'] = None
+                if image_size:
+                    request_data['image_data'] = spool
+                    request_data['image_size'] = image_size
+                else:
+                    spool.close()
+                logger.debug(f"Spooled image upload: {image_size} bytes")
             elif part.name == 'loras':
                 request_data['loras'] = json.loads(await part.text())
             elif part.name == 'upscale_factor':
@@ -43,6 +194,16 @@ async def handle_generated_image(request):
                     request_data['upscale_factor'] = int(await part.text())
                 except (ValueError, TypeError):
                     request_data['upscale_factor'] = 1
+            elif part.name == 'workflow':
+                try:
+                    request_data['workflow'] = json.loads(await part.text())
+                except (ValueError, TypeError):
+                    request_data['workflow'] = None
+            elif part.name == 'spans':
+                try:
+                    request_data['spans'] = json.loads(await part.text())
+                except (ValueError, TypeError):
+                    request_data['spans'] = []
             else:
                 request_data[part.name] = await part.text()
 
@@ -64,6 +225,12 @@ async def handle_generated_image(request):
 
         # Get request item to check type
         request_item = request.app['bot'].pending_requests[request_data['request_id']]
+        backend = getattr(request_item, 'backend', 'unknown')
+
+        # The request_id is the trace id; keep the runner's spans with ours
+        start_trace(request_data['request_id'])
+        if isinstance(request_data['spans'], list):
+            import_spans(request_data['spans'], backend)
 
         try:
             # Fetch necessary Discord objects
@@ -105,7 +272,7 @@ async def handle_generated_image(request):
                 pass
             else:
                 # Show LoRAs for both standard and PuLID requests
-                lora_config = load_json('lora.json')
+                lora_config = load_json_snapshot('lora.json')
                 lora_names = []
                 if request_data['loras']:
                     for lora_file in request_data['loras']:
@@ -125,9 +292,16 @@ async def handle_generated_image(request):
             if request_data['seed'] is not None:
                 embed.add_field(name="Seed", value=str(request_data['seed']), inline=True)
 
+            # Keep the full-resolution copy locally and pick what goes to Discord
+            with span('image_store', size=request_data['image_size']):
+                stored_image = await store_image(request.app.get('image_store'), request_data['image_data'])
+            with span('prepare_attachment') as attrs:
+                image_extension = await prepare_attachment(request_data, embed, stored_image)
+                attrs['extension'] = image_extension
+
             # Generate image filename and create file
-            image_filename = f"generated_image_{request_data['request_id']}.png"
-            image_file = discord.File(io.BytesIO(request_data['image_data']), image_filename)
+            image_filename = f"generated_image_{request_data['request_id']}.{image_extension}"
+            image_file = discord.File(request_data['image_data'], image_filename)
 
             # Select appropriate view based on request type
             if isinstance(request_item, (ReduxRequestItem, ReduxPromptRequestItem)):
@@ -148,40 +322,49 @@ async def handle_generated_image(request):
             # Update the original message
             channel = await request.app['bot'].fetch_channel(int(request_data['channel_id']))
             original_message = await channel.fetch_message(int(request_data['original_message_id']))
-            await original_message.edit(content=None, embed=embed, attachments=[image_file], view=view)
+            with span('discord_upload', phase='discord_upload', backend=backend):
+                await original_message.edit(content=None, embed=embed, attachments=[image_file], view=view)
             request.app['bot'].add_view(view, message_id=original_message.id)
 
             # Add to history
-            add_to_history(
+            await record_history(
                 request_data['user_id'],
                 request_data['prompt'],
-                None,  # workflow
-                image_filename,
+                request_data['workflow'],
+                stored_image.filename if stored_image else image_filename,
                 request_data['resolution'],
                 request_data['loras'],
-                request_data['upscale_factor']
+                request_data['upscale_factor'],
+                request_id=request_data['request_id']
             )
 
             # Remove from pending requests
             if request_data['request_id'] in request.app['bot'].pending_requests:
                 del request.app['bot'].pending_requests[request_data['request_id']]
 
+            JOBS_COMPLETED.inc(backend=backend, outcome='success')
             logger.info(f"Successfully processed image for user {request_data['user_id']}")
             return web.Response(text="Success")
 
         except discord.NotFound:
             logger.error("Channel or message not found")
+            JOBS_COMPLETED.inc(backend=backend, outcome='error')
             return web.Response(text="Channel or message not found", status=404)
         except discord.Forbidden:
             logger.error("Bot lacks required permissions")
+            JOBS_COMPLETED.inc(backend=backend, outcome='error')
             return web.Response(text="Permission denied", status=403)
         except Exception as e:
             logger.error(f"Error updating message: {str(e)}")
+            JOBS_COMPLETED.inc(backend=backend, outcome='error')
             return web.Response(text=f"Error updating message: {str(e)}", status=500)
 
     except Exception as e:
         logger.error(f"Error in handle_generated_image: {str(e)}", exc_info=True)
         return web.Response(text=f"Internal server error: {str(e)}", status=500)
+    finally:
+        if request_data.get('image_data') is not None:
+            request_data['image_data'].close()
 
 async def update_progress(request):
     try:
@@ -1,140 +1,105 @@
 import logging
 import json
-from Main.utils import load_json, generate_random_seed
+from Main.utils import load_json_snapshot, generate_random_seed
+from Main.workflow_templates import (
+    CompiledTemplate, compile_template, get_template, validate_nodes,
+    STANDARD_SLOTS, STANDARD_REQUIRED, PULID_SLOTS, REDUX_SLOTS, REDUXPROMPT_SLOTS, REDUXPROMPT_REQUIRED
+)
 import os
 import random
 from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
+# Flux guidance every standard request runs at, whatever the template says
+DEFAULT_GUIDANCE = 3.5
+
+# (lora.json snapshot, file -> entry) so the index is rebuilt only when the file changes
+_lora_index = (None, {})
+
 def validate_workflow(workflow):
     """Validates the workflow structure with enhanced checks"""
-    if not isinstance(workflow, dict):
-        raise ValueError("Workflow must be a dictionary")
-    
-    # Check for required nodes
-    required_nodes = ['69', '258', '271']
-    missing_nodes = [node for node in required_nodes if node not in workflow]
-    if missing_nodes:
-        raise ValueError(f"Missing required nodes in workflow: {missing_nodes}")
-    
-    # Validate node structure
-    for node_id, node in workflow.items():
-        if not isinstance(node, dict):
-            raise ValueError(f"Node {node_id} must be a dictionary")
-        
-        if 'inputs' not in node:
-            raise ValueError(f"Node {node_id} is missing 'inputs' field")
-            
-        if not isinstance(node.get('inputs'), dict):
-            raise ValueError(f"Node {node_id} 'inputs' must be a dictionary")
-            
-        if 'class_type' not in node:
-            raise ValueError(f"Node {node_id} is missing 'class_type' field")
-    
+    validate_nodes(workflow, STANDARD_REQUIRED)
     logger.debug(f"Workflow validation passed: {len(workflow)} nodes checked")
     return True
 
-def update_workflow(workflow, prompt, resolution, loras, upscale_factor, seed):
-    """Updates the workflow with the provided parameters with enhanced validation"""
-    try:
-        # Validate workflow first
-        validate_workflow(workflow)
-        logger.debug("Initial workflow validation passed")
-
-        # Create a copy to avoid modifying the original
-        workflow = workflow.copy()
-
-        # Update prompt
-        if '69' in workflow:
-            workflow['69']['inputs']['prompt'] = prompt
-            logger.debug(f"Updated prompt: {prompt}")
+def _template(workflow, slots, required_nodes, name) -> CompiledTemplate:
+    # A file name uses the cached compiled template; a dict is compiled for this one call
+    if isinstance(workflow, str):
+        return get_template(workflow, slots, required_nodes)
+    return compile_template(workflow, slots, required_nodes, name)
+
+def lora_info_by_file():
+    global _lora_index
+    snapshot = load_json_snapshot('lora.json')
+    if _lora_index[0] is not snapshot:
+        _lora_index = (snapshot, {lora['file']: lora for lora in snapshot['available_loras']})
+    return _lora_index[1]
+
+def lora_entries(loras: List[str], scale_multiple: bool = True) -> List[dict]:
+    """lora_N input values for the selected LoRA files, weighted from lora.json."""
+    lora_info = lora_info_by_file()
+    entries = []
+    for lora in loras:
+        if lora not in lora_info:
+            logger.warning(f"LoRA {lora} not found in configuration")
+            continue
+        base_strength = float(lora_info[lora].get('weight', 1.0))
+        # If multiple LoRAs are selected, scale down to 0.5 unless already lower
+        if scale_multiple and len(loras) > 1:
+            lora_strength = min(base_strength, 0.5)
         else:
-            logger.warning("Node 69 (prompt node) not found in workflow")
-
-        # Update resolution
-        if '258' in workflow:
-            workflow['258']['inputs']['ratio_selected'] = resolution
-            logger.debug(f"Updated resolution: {resolution}")
-        else:
-            logger.warning("Node 258 (resolution node) not found in workflow")
-
-        # Update LoRAs
-        if '271' in workflow:
-            lora_loader = workflow['271']['inputs']
-            
-            # Load lora config
-            lora_config = load_json('lora.json')
-            lora_info = {lora['file']: lora for lora in lora_config['available_loras']}
-
-            # Clean existing LoRA entries
-            for key in list(lora_loader.keys()):
-                if key.startswith('lora_'):
-                    del lora_loader[key]
-
-            # Add new LoRA entries
-            for i, lora in enumerate(loras, start=1):
-                if lora in lora_info:
-                    lora_key = f'lora_{i}'
-                    # Get base strength from config
-                    base_strength = float(lora_info[lora].get('weight', 1.0))
-                    
-                    # If multiple LoRAs are selected, scale down to 0.5 unless already lower
-                    if len(loras) > 1:
-                        lora_strength = min(base_strength, 0.5)
-                    else:
-                        lora_strength = base_strength
-                        
-                    lora_loader[lora_key] = {
-                        'on': True,
-                        'lora': lora,
-                        'strength': lora_strength
-                    }
-                    logger.debug(f"Added LoRA {lora} with strength {lora_strength}")
-                else:
-                    logger.warning(f"LoRA {lora} not found in configuration")
-
-        # Update upscale factor
-        if '279' in workflow:
-            workflow['279']['inputs']['rescale_factor'] = upscale_factor
-            logger.debug(f"Updated upscale factor: {upscale_factor}")
-        else:
-            logger.warning("Node 279 (upscale node) not found in workflow")
-
-        # Update seed
-        if '198:2' in workflow:
-            workflow['198:2']['inputs']['noise_seed'] = seed
-            logger.debug(f"Updated seed: {seed}")
-        else:
-            logger.warning("Node 198:2 (seed node) not found in workflow")
-
-        # Validate the updated workflow
-        validate_workflow(workflow)
-        logger.debug("Final workflow validation passed")
-        
-        # Update guidance value if present
-        if '198:4' in workflow and 'inputs' in workflow['198:4']:
-            workflow['198:4']['inputs']['guidance'] = 3.5
-            logger.debug("Set default guidance value to 3.5")
-        
-        # Keep original steps value from workflow template
-        if '198:1' in workflow and 'inputs' in workflow['198:1']:
-            original_steps = workflow['198:1']['inputs'].get('steps', 20)  # fallback to 20 if not found
-            logger.debug(f"Using steps value from workflow: {original_steps}")
+            lora_strength = base_strength
+        entries.append({'on': True, 'lora': lora, 'strength': lora_strength})
+        logger.debug(f"Added LoRA {lora} with strength {lora_strength}")
+    return entries
 
+def update_workflow(workflow, prompt, resolution, loras, upscale_factor, seed):
+    """
+    Fill in a text-to-image workflow. workflow is a template file name
+    (config.fluxversion), compiled and validated once, or a workflow dict,
+    which is left unchanged.
+    """
+    try:
+        template = _template(workflow, STANDARD_SLOTS, STANDARD_REQUIRED, 'workflow')
+        workflow = template.instantiate(
+            prompt=prompt,
+            resolution=resolution,
+            loras=lora_entries(loras),
+            upscale_factor=upscale_factor,
+            seed=seed,
+            guidance=DEFAULT_GUIDANCE
+        )
+        logger.debug(f"Updated workflow: resolution {resolution}, {len(loras)} LoRAs, seed {seed}")
         return workflow
 
     except Exception as e:
         logger.error(f"Error updating workflow: {str(e)}", exc_info=True)
         raise ValueError(f"Failed to update workflow: {str(e)}")
 
+def update_redux_workflow(workflow, resolution, strength1, strength2, image1_path=None, image2_path=None, seed=None):
+    """
+    Fill in the two-image Redux workflow (a dict or template file name).
+    Image paths are used as given; arguments left as None keep the template's value.
+    """
+    values = {
+        'resolution': resolution,
+        'strength1': strength1,
+        'strength2': strength2,
+        'image1': image1_path,
+        'image2': image2_path,
+        'seed': seed,
+    }
+    template = _template(workflow, REDUX_SLOTS, (), 'Redux workflow')
+    return template.instantiate(**{name: value for name, value in values.items() if value is not None})
+
 def update_reduxprompt_workflow(workflow, image_path, prompt, strength, seed=None, resolution=None):
     """
     Updates the ReduxPrompt workflow with the provided parameters.
     The strength parameter must be one of: 'highest', 'high', 'medium', 'low', 'lowest'
     
     Args:
-        workflow: The workflow dictionary to update
+        workflow: The workflow dictionary, or template file name, to fill in
         image_path: Full absolute path to the image file
         prompt: The prompt text
         strength: Strength value ('highest', 'high', 'medium', 'low', 'lowest')
@@ -142,8 +107,7 @@ def update_reduxprompt_workflow(workflow, image_path, prompt, strength, seed=Non
         resolution: Optional resolution value for the image generation
     """
     try:
-        # Create a copy to avoid modifying the original
-        workflow = workflow.copy()
+        template = _template(workflow, REDUXPROMPT_SLOTS, REDUXPROMPT_REQUIRED, 'ReduxPrompt workflow')
 
         # Generate random seed if none provided
         if seed is None:
@@ -159,71 +123,28 @@ def update_reduxprompt_workflow(workflow, image_path, prompt, strength, seed=Non
         image_path = os.path.abspath(image_path).replace('\\', '/')
         logger.debug(f"Using image path: {image_path}")
 
-        # Update image path in node 40
-        if '40' in workflow:
-            workflow['40']['inputs']['image'] = image_path
-            logger.debug(f"Updated image path in node 40: {image_path}")
-        else:
-            raise ValueError("Node 40 (LoadImage node) not found in workflow")
-
-        # Update prompt in node 6 if it exists
-        if '6' in workflow:
-            workflow['6']['inputs']['text'] = prompt
-            logger.debug(f"Updated prompt in node 6: {prompt}")
-
-        # Update strength in node 54 if it exists (using string value directly)
-        if '54' in workflow:
-            workflow['54']['inputs']['image_strength'] = strength
-            logger.debug(f"Updated strength in node 54: {strength}")
+        values = {'image': image_path, 'prompt': prompt, 'strength': strength, 'seed': seed}
+        if resolution:
+            values['resolution'] = resolution
+        elif 'resolution' in template:
+            logger.warning("Resolution not provided, using the template's default")
 
-        # Update seed in RandomNoise node
-        if '25' in workflow:
-            workflow['25']['inputs']['noise_seed'] = seed
-            logger.debug(f"Updated seed in RandomNoise node: {seed}")
-
-        # Update resolution in node 62 if resolution is provided
-        if resolution and '62' in workflow:
-            workflow['62']['inputs']['ratio_selected'] = resolution
-            logger.debug(f"Updated resolution in node 62: {resolution}")
-        elif '62' in workflow:
-            logger.warning("Resolution not provided, using default in node 62")
-        else:
-            logger.warning("Node 62 (resolution node) not found in workflow")
-
-        return workflow
+        return template.instantiate(**values)
 
     except Exception as e:
         logger.error(f"Error updating ReduxPrompt workflow: {str(e)}")
         raise
 
-def update_pulid_workflow(workflow: dict, image_url: str, prompt: str, resolution: str, loras: List[str], seed: Optional[int] = None) -> dict:
-    """Updates the PuLID workflow with the provided parameters."""
+def update_pulid_workflow(workflow, image_url: str, prompt: str, resolution: str, loras: List[str], seed: Optional[int] = None) -> dict:
+    """Updates the PuLID workflow (a dict or template file name) with the provided parameters."""
     try:
-        # Create a deep copy to avoid modifying original
-        workflow = json.loads(json.dumps(workflow))
+        template = _template(workflow, PULID_SLOTS, (), 'PuLID workflow')
         
         # Ensure image_url is an absolute path with forward slashes
         image_url = os.path.abspath(image_url).replace('\\', '/')
-        
-        # Update image URL in LoadImage node
-        if '54' in workflow:
-            workflow['54']['inputs']['image'] = image_url
-            logger.debug(f"Updated image URL in workflow: {image_url}")
-        else:
-            logger.warning("LoadImage node (54) not found in workflow")
-
-        # Update resolution in node 70 if it exists
-        if '70' in workflow:
-            workflow['70']['inputs']['ratio_selected'] = resolution
-            logger.debug(f"Updated resolution in node 70: {resolution}")
-        else:
-            logger.warning("Resolution node (70) not found in workflow")
-
-        # Load lora config and get trigger words
-        lora_config = load_json('lora.json')
-        lora_info = {lora['file']: lora for lora in lora_config['available_loras']}
 
         # Add LoRA trigger words to prompt
+        lora_info = lora_info_by_file()
         modified_prompt = prompt
         for lora in loras:
             if lora in lora_info and lora_info[lora].get('add_prompt'):
@@ -232,58 +153,19 @@ def update_pulid_workflow(workflow: dict, image_url: str, prompt: str, resolutio
                     modified_prompt = f"{modified_prompt}, {trigger_words}"
                     logger.debug(f"Added trigger words '{trigger_words}' for LoRA {lora}")
 
-        # Update prompt with trigger words
-        if '6' in workflow:
-            workflow['6']['inputs']['text'] = modified_prompt
-            logger.debug(f"Updated prompt in workflow with trigger words")
-        else:
-            logger.warning("CLIPTextEncode node (6) not found in workflow")
-
-        # Update LoRAs in node 73
-        if '73' in workflow:
-            lora_loader = workflow['73']['inputs']
-            
-            # Clean existing LoRA entries
-            for key in list(lora_loader.keys()):
-                if key.startswith('lora_'):
-                    del lora_loader[key]
-
-            # Add new LoRA entries
-            for i, lora in enumerate(loras, start=1):
-                if lora in lora_info:
-                    lora_key = f'lora_{i}'
-                    base_strength = float(lora_info[lora].get('weight', 1.0))
-                    
-                    # If multiple LoRAs are selected, scale down to 0.5 unless already lower
-                    if len(loras) > 1:
-                        lora_strength = min(base_strength, 0.5)
-                    else:
-                        lora_strength = base_strength
-                        
-                    lora_loader[lora_key] = {
-                        'on': True,
-                        'lora': lora,
-                        'strength': lora_strength
-                    }
-                    logger.debug(f"Added LoRA {lora} with strength {lora_strength}")
-            logger.debug(f"Updated LoRAs in workflow: {len(loras)} LoRAs configured")
-        else:
-            logger.warning("LoraLoader node (73) not found in workflow")
-
-        # Update seed
-        if seed is not None and '25' in workflow:
-            workflow['25']['inputs']['noise_seed'] = seed
-            logger.debug(f"Updated seed in workflow: {seed}")
-        else:
-            logger.warning("RandomNoise node (25) not found in workflow")
-
-        # Validate the final workflow
-        if not isinstance(workflow, dict):
-            raise ValueError("Workflow must remain a dictionary after updates")
-
-        logger.debug("Successfully updated workflow with all parameters")
+        values = {
+            'image': image_url,
+            'resolution': resolution,
+            'prompt': modified_prompt,
+            'loras': lora_entries(loras),
+        }
+        if seed is not None:
+            values['seed'] = seed
+
+        workflow = template.instantiate(**values)
+        logger.debug(f"Updated PuLID workflow: {len(loras)} LoRAs configured")
         return workflow
 
     except Exception as e:
         logger.error(f"Error updating workflow: {str(e)}")
-        raise ValueError(f"Failed to update workflow: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Failed to update workflow: {str(e)}")
@@ -1,15 +1,167 @@
 import sqlite3
 import json
 import logging
-import time
 import os
 import re
+import asyncio
+import contextvars
+import functools
+import hashlib
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+from typing import FrozenSet, Optional, Set
+
+from Main.migrations import migrate
+from Main.word_matcher import WordMatcher
+from Main.fuzzy_matcher import FuzzyMatcher
+from Main.image_hash import ImageBlocklist, BlockedImage, to_signed, to_unsigned
+from Main.text_normalizer import normalize as normalize_for_moderation, normalized_forms
+from Main.workflow_store import (
+    workflow_shape, content_hash, diff_workflow, apply_delta, encode_blob, decode_blob
+)
 
 logger = logging.getLogger(__name__)
 
-DB_NAME = 'image_history.db'
+DB_NAME = os.getenv('IMAGE_HISTORY_DB', 'image_history.db')
 BANNED_WORDS_FILE = os.path.join(os.path.dirname(__file__), 'banned.json')
 
+# How long a writer waits on a locked database before raising, in milliseconds
+BUSY_TIMEOUT_MS = 5000
+# Prepared statements kept per connection; the bot runs a few dozen distinct queries
+CACHED_STATEMENTS = 128
+# zlib-compress stored workflow templates and deltas
+HISTORY_COMPRESSION = os.getenv('HISTORY_COMPRESSION', 'true').lower() == 'true'
+# Prompt words within this many edits of a banned word count as using it. Off by default:
+# at one edit, ordinary words land near banned ones ("combing"/"bombing") and earn strikes.
+# Banned words shorter than the minimum length are only matched exactly.
+MODERATION_FUZZY_DISTANCE = int(os.getenv('MODERATION_FUZZY_DISTANCE', '0'))
+MODERATION_FUZZY_MIN_LENGTH = int(os.getenv('MODERATION_FUZZY_MIN_LENGTH', '6'))
+# Distinct prompts whose banned-word verdict is remembered, per banned-list version
+MODERATION_VERDICT_CACHE_SIZE = int(os.getenv('MODERATION_VERDICT_CACHE_SIZE', '4096'))
+# Uploads whose pHash and dHash are both within this many bits of a blocklisted image are refused
+IMAGE_BLOCKLIST_DISTANCE = int(os.getenv('IMAGE_BLOCKLIST_DISTANCE', '10'))
+
+_local = threading.local()
+_connections = set()
+_connections_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+# (DB_NAME, shape) -> (template hash, template), filled as templates are read or written
+_template_cache = {}
+# (DB_NAME, WordMatcher, FuzzyMatcher, version) for the current banned words; replaced whole when the list changes
+_banned_matcher = None
+_banned_versions = itertools.count(1)
+# (banned-list version, 'raw' or 'normalized', digest of the prompt) -> banned word or None, least recently used first
+_verdicts: 'OrderedDict[tuple, Optional[str]]' = OrderedDict()
+_verdicts_lock = threading.Lock()
+# peek_banned_word's answer for a prompt the current list hasn't judged
+UNCHECKED = object()
+# (DB_NAME, ModerationState) mirroring banned_users and per-user warning counts
+_moderation = None
+# (DB_NAME, ImageBlocklist) over image_blocklist; replaced whole when the list changes
+_image_blocklist = None
+
+class ModerationState:
+    """
+    Banned user ids and warning counts, kept in memory so the checks every
+    request runs don't query SQLite. Loaded once and written through by
+    ban_user, unban_user, remove_user_warnings and warning writes, each after
+    its transaction commits. Only the database thread writes to it.
+    """
+    def __init__(self, banned, warnings):
+        self.banned = set(banned)
+        self.warnings = Counter(warnings)
+
+def _moderation_state() -> ModerationState:
+    global _moderation
+    current = _moderation
+    if current is not None and current[0] == DB_NAME:
+        return current[1]
+    conn = get_connection()
+    state = ModerationState(
+        (row[0] for row in conn.execute("SELECT user_id FROM banned_users")),
+        dict(conn.execute("SELECT user_id, COUNT(*) FROM user_warnings GROUP BY user_id").fetchall())
+    )
+    _moderation = (DB_NAME, state)
+    logger.debug(f"Loaded moderation state: {len(state.banned)} banned users, {len(state.warnings)} warned users")
+    return state
+
+def moderation_cache_ready() -> bool:
+    """Whether bans and banned words can be checked without touching the database."""
+    return (_moderation is not None and _moderation[0] == DB_NAME
+            and _banned_matcher is not None and _banned_matcher[0] == DB_NAME)
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return this thread's connection to DB_NAME, opening it on first use.
+    Connections stay open for the life of the thread and are reopened if
+    DB_NAME changes. Use `with conn:` around writes to commit or roll back.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == DB_NAME and conn in _connections:
+        return conn
+    if conn is not None:
+        _close_connection(conn)
+
+    # Each connection is only used by the thread that opened it;
+    # check_same_thread is off so shutdown_db can close it from elsewhere
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False
+    )
+    # auto_vacuum can only be chosen on an empty file, and switching to WAL writes its first page;
+    # incremental mode lets retention hand freed pages back to the OS
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    # WAL makes NORMAL durable against application crashes
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn = conn
+    _local.path = DB_NAME
+    with _connections_lock:
+        _connections.add(conn)
+    return conn
+
+def _close_connection(conn: sqlite3.Connection):
+    with _connections_lock:
+        _connections.discard(conn)
+    try:
+        conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Error closing database connection: {e}")
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """The single thread all async database calls run on."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+    return _executor
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run a database function on the database thread without blocking the
+    event loop. The caller's context (the current trace) is carried over.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_db_executor(), call)
+
+def shutdown_db():
+    """Stop the database thread and close every open connection; called when the bot closes."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    with _connections_lock:
+        connections = list(_connections)
+    for conn in connections:
+        _close_connection(conn)
+
 def load_banned_words_from_json():
     try:
         with open(BANNED_WORDS_FILE, 'r') as f:
@@ -28,91 +180,262 @@ def save_banned_words_to_json(words):
         logger.error(f"Error saving banned words to JSON: {e}")
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Existing tables remain the same
-    c.execute('''CREATE TABLE IF NOT EXISTS image_history
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id TEXT,
-                  prompt TEXT,
-                  workflow JSON,
-                  image_filename TEXT,
-                  resolution TEXT,
-                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                  loras JSON,
-                  upscale_factor INTEGER)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS banned_users
-                 (user_id TEXT PRIMARY KEY,
-                  reason TEXT,
-                  banned_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    
-    # New tables for banned words and warnings
-    c.execute('''CREATE TABLE IF NOT EXISTS banned_words
-                 (word TEXT PRIMARY KEY,
-                  added_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-                  
-    c.execute('''CREATE TABLE IF NOT EXISTS user_warnings
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id TEXT,
-                  prompt TEXT,
-                  word TEXT,
-                  warned_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    
-    conn.commit()
+    """Bring the schema up to date and sync banned words from banned.json."""
+    conn = get_connection()
+    migrate(conn)
     
     # Load banned words from JSON and sync with database
     banned_words = load_banned_words_from_json()
-    for word in banned_words:
-        c.execute("INSERT OR IGNORE INTO banned_words (word) VALUES (?)", (word,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO banned_words (word) VALUES (?)", ((word,) for word in banned_words))
+    _rebuild_banned_matcher()
+    _moderation_state()
+    _rebuild_image_blocklist()
+
+def _get_template(conn, key, query, params):
+    cached = _template_cache.get((DB_NAME, key))
+    if cached is not None:
+        return cached
+    row = conn.execute(query, params).fetchone()
+    if row is None:
+        return None
+    template = (row[0], decode_blob(row[1]))
+    _template_cache[(DB_NAME, key)] = template
+    return template
 
-def add_to_history(user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor):
+def _encode_workflow(conn, workflow):
+    """
+    Store workflow's template if its shape is new and return the
+    (template hash, delta blob) to save on the history row.
+    Must be called inside the history write transaction.
+    """
+    shape = workflow_shape(workflow)
+    template = _get_template(
+        conn, shape, "SELECT hash, body FROM workflow_templates WHERE shape = ? ORDER BY created_at LIMIT 1", (shape,)
+    )
+    if template is None:
+        template = (content_hash(workflow), workflow)
+        conn.execute(
+            "INSERT OR IGNORE INTO workflow_templates (hash, shape, body) VALUES (?, ?, ?)",
+            (template[0], shape, encode_blob(workflow, HISTORY_COMPRESSION))
+        )
+        _template_cache[(DB_NAME, shape)] = template
+        _template_cache[(DB_NAME, template[0])] = template
+    template_hash, template_body = template
+    return template_hash, encode_blob(diff_workflow(template_body, workflow), HISTORY_COMPRESSION)
+
+def decode_history_workflow(workflow_json, template_hash, delta_blob):
+    """Rebuild a row's workflow from either storage format; None if none was stored."""
+    if template_hash is not None and delta_blob is not None:
+        template = _get_template(
+            get_connection(), template_hash, "SELECT hash, body FROM workflow_templates WHERE hash = ?", (template_hash,)
+        )
+        if template is None:
+            logger.warning(f"Missing workflow template {template_hash}")
+            return None
+        return apply_delta(template[1], decode_blob(delta_blob))
+    # Rows written before templates stored the full JSON
+    return json.loads(workflow_json) if workflow_json else None
+
+def get_history_workflow(image_filename):
+    """The workflow that produced an image in history, or None."""
+    row = get_connection().execute(
+        "SELECT workflow, workflow_template, workflow_delta FROM image_history WHERE image_filename = ?",
+        (image_filename,)
+    ).fetchone()
+    if row is None:
+        return None
+    return decode_history_workflow(*row)
+
+def _insert_history(conn, user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor, request_id=None):
+    """Insert one history row inside the caller's transaction; True if a row was added."""
     if image_filename.startswith('ComfyUI'):
         logger.debug(f"Skipping temporary file: {image_filename}")
-        return
+        return False
 
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    # Ensure loras is a list of up to 25 items
+    loras_list = loras[:25] if isinstance(loras, list) else [loras]
+    loras_json = json.dumps(loras_list)
     
-    c.execute("""
-        SELECT id FROM image_history 
-        WHERE user_id = ? AND prompt = ? AND 
-        datetime(timestamp, 'unixepoch') = datetime(?, 'unixepoch')
-    """, (user_id, prompt, int(time.time())))
+    # The full workflow lives in workflow_templates; the row keeps only what differs
+    template_hash, delta = _encode_workflow(conn, workflow) if isinstance(workflow, dict) else (None, None)
+    added = conn.execute(
+        "INSERT INTO image_history (request_id, user_id, prompt, workflow, workflow_template, workflow_delta, "
+        "image_filename, resolution, loras, upscale_factor) "
+        "VALUES (?, ?, ?, NULL, ?, ?, ?, ?, ?, ?) ON CONFLICT (request_id) DO NOTHING",
+        (request_id, user_id, prompt, template_hash, delta, image_filename, resolution, loras_json, upscale_factor)
+    ).rowcount > 0
     
-    existing_entry = c.fetchone()
-    
-    if existing_entry:
-        logger.debug(f"Skipping duplicate entry for user_id={user_id}, prompt={prompt}")
+    if added:
+        logger.debug(f"Added to history: request_id={request_id}, user_id={user_id}, prompt={prompt}, image_filename={image_filename}, resolution={resolution}, loras={loras_json}, upscale_factor={upscale_factor}")
     else:
-        # Ensure loras is a list of up to 25 items
-        loras_list = loras[:25] if isinstance(loras, list) else [loras]
-        loras_json = json.dumps(loras_list)
-        
-        c.execute("INSERT INTO image_history (user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                  (user_id, prompt, json.dumps(workflow), image_filename, resolution, loras_json, upscale_factor))
-        conn.commit()
-        logger.debug(f"Added to history: user_id={user_id}, prompt={prompt}, image_filename={image_filename}, resolution={resolution}, loras={loras_json}, upscale_factor={upscale_factor}")
-    
-    conn.close()
+        logger.debug(f"History already recorded for request_id={request_id}")
+    return added
+
+def _insert_warning(conn, user_id, prompt, word):
+    conn.execute("INSERT INTO user_warnings (user_id, prompt, word) VALUES (?, ?, ?)", (user_id, prompt, word))
+
+def _insert_audit(conn, actor_id, action, target=None, details=None):
+    conn.execute("INSERT INTO audit_log (actor_id, action, target, details) VALUES (?, ?, ?, ?)",
+                 (actor_id, action, target, details))
+
+# Row kinds write_batch accepts, for the batched writer in Main/history_writer.py
+_BATCH_WRITERS = {
+    'history': _insert_history,
+    'warning': _insert_warning,
+    'audit': _insert_audit
+}
+
+def write_batch(entries):
+    """
+    Write (kind, args) entries in a single transaction and return each
+    entry's result. If any entry fails the whole batch is rolled back.
+    """
+    conn = get_connection()
+    try:
+        with conn:
+            results = [_BATCH_WRITERS[kind](conn, *args) for kind, args in entries]
+    except sqlite3.Error:
+        # A template cached during the rolled-back transaction was never stored
+        _template_cache.clear()
+        raise
+    warnings = _moderation_state().warnings
+    for kind, args in entries:
+        if kind == 'warning':
+            warnings[str(args[0])] += 1
+    return results
+
+def add_to_history(user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor, request_id=None):
+    """
+    Record a generated image. Rows are keyed by request_id, so a retried
+    callback for the same job is a no-op. Returns True if a row was added.
+    """
+    return write_batch([('history', (user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor, request_id))])[0]
+
+def add_audit_entry(actor_id, action, target=None, details=None):
+    """Record a moderation or admin action in audit_log."""
+    write_batch([('audit', (actor_id, action, target, details))])
+
+def _fts_query(text):
+    """
+    Turn free text into an FTS5 query that can't be a syntax error: every
+    word must appear, and a trailing * keeps its prefix-match meaning.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+def search_history(text, user_id=None, before=None, limit=10):
+    """
+    Newest-first history rows whose prompt matches text, optionally for one user.
+    Pages are keyed on (timestamp, id): pass the returned cursor as `before`
+    to get the next page, which costs the same as the first.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    conn = get_connection()
+    conditions = []
+    params = []
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'image_history_fts'").fetchone():
+        query = _fts_query(text)
+        if not query:
+            return [], None
+        source = "image_history_fts f JOIN image_history h ON h.id = f.rowid"
+        conditions.append("image_history_fts MATCH ?")
+        params.append(query)
+    else:
+        source = "image_history h"
+        for word in text.split():
+            conditions.append("h.prompt LIKE ? ESCAPE '\\'")
+            escaped = word.rstrip('*').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f"%{escaped}%")
+        if not conditions:
+            return [], None
+    if user_id is not None:
+        conditions.append("h.user_id = ?")
+        params.append(user_id)
+    if before is not None:
+        conditions.append("(h.timestamp, h.id) < (?, ?)")
+        params.extend(before)
+
+    rows = conn.execute(
+        f"SELECT h.id, h.user_id, h.prompt, h.image_filename, h.resolution, h.timestamp "
+        f"FROM {source} WHERE {' AND '.join(conditions)} "
+        f"ORDER BY h.timestamp DESC, h.id DESC LIMIT ?",
+        (*params, limit + 1)
+    ).fetchall()
+    results = [
+        {'id': row[0], 'user_id': row[1], 'prompt': row[2], 'image_filename': row[3],
+         'resolution': row[4], 'timestamp': row[5]}
+        for row in rows[:limit]
+    ]
+    next_cursor = (results[-1]['timestamp'], results[-1]['id']) if len(rows) > limit else None
+    return results, next_cursor
 
 def get_user_history(user_id, limit=10):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT * FROM image_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?", (user_id, limit))
     history = c.fetchall()
-    conn.close()
     logger.debug(f"Retrieved history for user_id={user_id}: {len(history)} entries")
     return history
 
+def get_user_image_count(user_id, day=None):
+    """Images user_id generated on day (YYYY-MM-DD, UTC; defaults to today), from the usage rollup."""
+    row = get_connection().execute(
+        "SELECT images FROM usage_user_daily WHERE user_id = ? AND day = coalesce(?, date('now'))",
+        (str(user_id), day)
+    ).fetchone()
+    return row[0] if row else 0
+
+def get_top_users(day=None, limit=10):
+    """(user_id, images) for the busiest users on day, most images first."""
+    return get_connection().execute(
+        "SELECT user_id, images FROM usage_user_daily WHERE day = coalesce(?, date('now')) "
+        "ORDER BY images DESC LIMIT ?",
+        (day, limit)
+    ).fetchall()
+
+def get_lora_usage(limit=None):
+    """{lora: uses} for every LoRA used so far, most used first."""
+    rows = get_connection().execute(
+        "SELECT lora, uses FROM usage_lora ORDER BY uses DESC LIMIT ?",
+        (-1 if limit is None else limit,)
+    ).fetchall()
+    return dict(rows)
+
+def sort_loras_by_usage(loras):
+    """lora.json entries ordered by how often their file has been used; ties keep file order."""
+    usage = get_lora_usage()
+    return sorted(loras, key=lambda lora: -usage.get(lora.get('file'), 0))
+
+def get_resolution_usage():
+    """{resolution: images}, most used first."""
+    return dict(get_connection().execute(
+        "SELECT resolution, images FROM usage_resolution ORDER BY images DESC"
+    ).fetchall())
+
+def load_quota_buckets():
+    """(user_id, tokens, updated_at) for every checkpointed quota bucket."""
+    return get_connection().execute("SELECT user_id, tokens, updated_at FROM quota_buckets").fetchall()
+
+def save_quota_buckets(buckets, dropped=()):
+    """Upsert (user_id, tokens, updated_at) rows and delete the dropped user ids, in one transaction."""
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO quota_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+            buckets
+        )
+        conn.executemany("DELETE FROM quota_buckets WHERE user_id = ?", ((user_id,) for user_id in dropped))
+
 def get_image_info(image_filename):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT * FROM image_history WHERE image_filename = ?", (image_filename,))
     info = c.fetchone()
-    conn.close()
     if info:
         loras = json.loads(info[7])
         logger.debug(f"Image info found for {image_filename}: {info}")
@@ -126,9 +449,62 @@ def get_image_info(image_filename):
         logger.warning(f"No image info found for {image_filename}")
     return None
 
+# Columns iter_image_history can project; 'workflow' is rebuilt from its template and delta
+HISTORY_COLUMNS = (
+    'id', 'request_id', 'user_id', 'prompt', 'image_filename', 'resolution',
+    'timestamp', 'loras', 'upscale_factor', 'workflow'
+)
+DEFAULT_HISTORY_COLUMNS = tuple(column for column in HISTORY_COLUMNS if column != 'workflow')
+
+def iter_image_history(columns=DEFAULT_HISTORY_COLUMNS, user_id=None, since=None, until=None, chunk_size=1000):
+    """
+    Yield history rows as dicts in id order, reading chunk_size rows at a time.
+    Each chunk is a separate keyset query on id, so no read transaction is
+    held open between chunks and memory stays flat however big the table is.
+    since/until bound the timestamp ('YYYY-MM-DD HH:MM:SS', until exclusive).
+    """
+    unknown = set(columns) - set(HISTORY_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown history columns: {', '.join(sorted(unknown))}")
+    with_workflow = 'workflow' in columns
+    selected = ['id'] + [column for column in columns if column not in ('id', 'workflow')]
+    if with_workflow:
+        selected += ['workflow', 'workflow_template', 'workflow_delta']
+
+    conditions = ["id > ?"]
+    params = []
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    query = (f"SELECT {', '.join(selected)} FROM image_history "
+             f"WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?")
+
+    conn = get_connection()
+    last_id = 0
+    while True:
+        rows = conn.execute(query, (last_id, *params, chunk_size)).fetchall()
+        for row in rows:
+            values = dict(zip(selected, row))
+            if with_workflow:
+                values['workflow'] = decode_history_workflow(
+                    values['workflow'], values.pop('workflow_template'), values.pop('workflow_delta')
+                )
+            if 'loras' in values and values['loras']:
+                values['loras'] = json.loads(values['loras'])
+            yield {column: values[column] for column in columns}
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
 def get_all_image_info():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    """Every history row as a tuple; loads the whole table, so prefer iter_image_history."""
+    c = get_connection().cursor()
     try:
         c.execute("SELECT * FROM image_history")
         info = c.fetchall()
@@ -139,14 +515,9 @@ def get_all_image_info():
             info = []
         else:
             raise
-    finally:
-        conn.close()
     return info
 
 def update_image_info(image_filename, new_prompt=None, new_resolution=None, new_loras=None, new_upscale_factor=None):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
     update_fields = []
     update_values = []
     
@@ -171,33 +542,128 @@ def update_image_info(image_filename, new_prompt=None, new_resolution=None, new_
         update_query = f"UPDATE image_history SET {', '.join(update_fields)} WHERE image_filename = ?"
         update_values.append(image_filename)
         
-        c.execute(update_query, tuple(update_values))
-        conn.commit()
+        conn = get_connection()
+        with conn:
+            conn.execute(update_query, tuple(update_values))
         
         logger.debug(f"Updated image info for {image_filename}: prompt={new_prompt}, resolution={new_resolution}, loras={new_loras}, upscale_factor={new_upscale_factor}")
     else:
         logger.debug(f"No updates provided for {image_filename}")
-    
-    conn.close()
 
 def get_banned_words():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT word FROM banned_words")
-    words = [row[0] for row in c.fetchall()]
-    conn.close()
+    return [row[0] for row in c.fetchall()]
+
+def _rebuild_banned_matcher():
+    global _banned_matcher
+    words = get_banned_words()
+    # Banned words and prompts are folded the same way, so obfuscated spellings still match
+    matcher = WordMatcher(words, normalize_for_moderation)
+    fuzzy = FuzzyMatcher(words, MODERATION_FUZZY_DISTANCE, MODERATION_FUZZY_MIN_LENGTH, normalize_for_moderation)
+    # Verdicts cached under the old version are never looked up again and age out of the LRU
+    _banned_matcher = (DB_NAME, matcher, fuzzy, next(_banned_versions))
+    logger.debug(f"Built banned-word matchers for {len(matcher)} words ({len(fuzzy)} fuzzy)")
+    return _banned_matcher
+
+def _banned_matchers():
+    current = _banned_matcher
+    if current is None or current[0] != DB_NAME:
+        current = _rebuild_banned_matcher()
+    return current
+
+def get_banned_word_matcher() -> WordMatcher:
+    """The exact matcher for the current banned words, built on first use and after each change."""
+    return _banned_matchers()[1]
+
+def get_fuzzy_banned_matcher() -> FuzzyMatcher:
+    """The typo-tolerant matcher built alongside get_banned_word_matcher."""
+    return _banned_matchers()[2]
+
+def _digest(text: str) -> bytes:
+    # Keys hold a digest rather than the text, so long prompts aren't kept in memory
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+def _cached_verdict(key):
+    with _verdicts_lock:
+        if key not in _verdicts:
+            return UNCHECKED
+        _verdicts.move_to_end(key)
+        return _verdicts[key]
+
+def _cache_verdict(keys, word):
+    with _verdicts_lock:
+        for key in keys:
+            _verdicts[key] = word
+        while len(_verdicts) > MODERATION_VERDICT_CACHE_SIZE:
+            _verdicts.popitem(last=False)
+
+def peek_banned_word(prompt):
+    """find_banned_word's cached verdict for prompt under the current list, or UNCHECKED. Safe on any thread."""
+    return _cached_verdict((_banned_matchers()[3], 'raw', _digest(prompt)))
+
+def find_banned_word(prompt):
+    """
+    The banned word prompt uses, spelled exactly or within
+    MODERATION_FUZZY_DISTANCE edits, or None.
+
+    Every reading from normalized_forms is matched. Verdicts are memoized
+    per banned-list version under the prompt as typed and under its
+    normalized forms. A repeated prompt (a regenerate, or an enhancement
+    that changed nothing) is a digest and a dict lookup, and spellings
+    that normalize the same skip matching.
+    """
+    _, matcher, fuzzy, version = _banned_matchers()
+    raw_key = (version, 'raw', _digest(prompt))
+    word = _cached_verdict(raw_key)
+    if word is not UNCHECKED:
+        return word
+
+    forms = normalized_forms(prompt)
+    normalized_key = (version, 'normalized', _digest('\n'.join(forms)))
+    word = _cached_verdict(normalized_key)
+    if word is UNCHECKED:
+        word = match_banned_word(matcher, fuzzy, forms)
+    _cache_verdict((raw_key, normalized_key), word)
+    return word
+
+def match_banned_word(matcher: WordMatcher, fuzzy: FuzzyMatcher, forms) -> Optional[str]:
+    """The first banned word in any of forms (from normalized_forms), exact matches before typos."""
+    for form in forms:
+        for _, found in matcher.finditer(form):
+            return matcher.originals[found]
+    for form in forms:
+        word = fuzzy.search_normalized(form)
+        if word:
+            return word
+    return None
+
+def match_banned_words(matcher: WordMatcher, fuzzy: FuzzyMatcher, forms) -> Set[str]:
+    """Every banned word in any of forms, matched exactly or as a typo."""
+    words = set()
+    for form in forms:
+        words.update(matcher.originals[found] for _, found in matcher.finditer(form))
+        words.update(fuzzy.find_all_normalized(form))
     return words
 
+def find_banned_words(prompt) -> FrozenSet[str]:
+    """
+    Every banned word prompt uses, where find_banned_word stops at the
+    first. Not memoized: only the enhanced-prompt check needs the full set,
+    and only once a prompt is known to contain something.
+    """
+    _, matcher, fuzzy, _ = _banned_matchers()
+    return frozenset(match_banned_words(matcher, fuzzy, normalized_forms(prompt)))
+
 def add_banned_word(word: str):
     """Add a new banned word to both database and JSON file"""
     # Normalize the word before storing
     normalized_word = normalize_text(word)
     
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO banned_words (word) VALUES (?)", (normalized_word,))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO banned_words (word) VALUES (?)", (normalized_word,))
+    _rebuild_banned_matcher()
     
     # Update JSON file
     current_words = get_banned_words()
@@ -209,60 +675,90 @@ def remove_banned_word(word: str):
     # Normalize the word before removing
     normalized_word = normalize_text(word)
     
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM banned_words WHERE word = ?", (normalized_word,))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM banned_words WHERE word = ?", (normalized_word,))
+    _rebuild_banned_matcher()
     
     # Update JSON file
     current_words = get_banned_words()
     save_banned_words_to_json(current_words)
     logger.debug(f"Removed banned word and updated JSON: {word}")
 
+def _rebuild_image_blocklist() -> ImageBlocklist:
+    global _image_blocklist
+    rows = get_connection().execute("SELECT id, phash, dhash, reason FROM image_blocklist").fetchall()
+    blocklist = ImageBlocklist(
+        (BlockedImage(row[0], to_unsigned(row[1]), to_unsigned(row[2]), row[3]) for row in rows),
+        IMAGE_BLOCKLIST_DISTANCE
+    )
+    _image_blocklist = (DB_NAME, blocklist)
+    return blocklist
+
+def get_image_blocklist() -> ImageBlocklist:
+    """The index over blocklisted image hashes, built on first use and after each change."""
+    current = _image_blocklist
+    if current is None or current[0] != DB_NAME:
+        return _rebuild_image_blocklist()
+    return current[1]
+
+def add_blocked_image(phash: int, dhash: int, sha256: str, reason: str, added_by: str):
+    """Blocklist an image by its hashes. Returns the new entry's id, or None if these bytes are already listed."""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO image_blocklist (phash, dhash, sha256, reason, added_by) VALUES (?, ?, ?, ?, ?)",
+            (to_signed(phash), to_signed(dhash), sha256, reason, added_by)
+        )
+    if cursor.rowcount == 0:
+        return None
+    _rebuild_image_blocklist()
+    logger.info(f"Blocklisted image {cursor.lastrowid}: {reason}")
+    return cursor.lastrowid
+
+def remove_blocked_image(entry_id: int) -> bool:
+    conn = get_connection()
+    with conn:
+        deleted = conn.execute("DELETE FROM image_blocklist WHERE id = ?", (entry_id,)).rowcount > 0
+    if deleted:
+        _rebuild_image_blocklist()
+    return deleted
+
+def get_blocked_images():
+    c = get_connection().cursor()
+    c.execute("SELECT id, reason, added_by, added_at FROM image_blocklist ORDER BY added_at DESC")
+    return [{"id": row[0], "reason": row[1], "added_by": row[2], "added_at": row[3]} for row in c.fetchall()]
+
 def add_user_warning(user_id: str, prompt: str, word: str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO user_warnings (user_id, prompt, word) VALUES (?, ?, ?)",
-              (user_id, prompt, word))
-    conn.commit()
-    conn.close()
+    write_batch([('warning', (user_id, prompt, word))])
 
 def remove_user_warnings(user_id: str):
     """Remove all warnings for a specific user"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    conn = get_connection()
     
     try:
-        # Check if user has warnings
-        c.execute("SELECT COUNT(*) FROM user_warnings WHERE user_id = ?", (user_id,))
-        warning_count = c.fetchone()[0]
-        
-        if warning_count == 0:
-            conn.close()
-            return False, "User has no warnings to remove"
+        with conn:
+            c = conn.cursor()
+            # Check if user has warnings
+            c.execute("SELECT COUNT(*) FROM user_warnings WHERE user_id = ?", (user_id,))
+            warning_count = c.fetchone()[0]
             
-        # Delete all warnings for the user
-        c.execute("DELETE FROM user_warnings WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
+            if warning_count == 0:
+                return False, "User has no warnings to remove"
+                
+            # Delete all warnings for the user
+            c.execute("DELETE FROM user_warnings WHERE user_id = ?", (user_id,))
+        _moderation_state().warnings.pop(str(user_id), None)
         return True, f"Removed {warning_count} warning(s)"
     except Exception as e:
-        conn.close()
         return False, f"Error removing warnings: {str(e)}"
 
 def get_user_warnings(user_id: str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM user_warnings WHERE user_id = ?", (user_id,))
-    warning_count = c.fetchone()[0]
-    conn.close()
-    return warning_count
+    return _moderation_state().warnings.get(str(user_id), 0)
 
 def get_all_warnings():
     """Get all warnings from the database, grouped by user"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    c = get_connection().cursor()
     
     try:
         # Get all warnings with user info
@@ -274,7 +770,6 @@ def get_all_warnings():
         warnings = c.fetchall()
         
         if not warnings:
-            conn.close()
             return False, "No warnings found in the database"
         
         # Group warnings by user
@@ -285,19 +780,14 @@ def get_all_warnings():
                 warning_dict[user_id] = []
             warning_dict[user_id].append((prompt, word, warned_at))
         
-        conn.close()
         return True, warning_dict
     except Exception as e:
-        conn.close()
         return False, f"Error retrieving warnings: {str(e)}"
 
 def delete_image_info(image_filename):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM image_history WHERE image_filename = ?", (image_filename,))
-    deleted_count = c.rowcount
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        deleted_count = conn.execute("DELETE FROM image_history WHERE image_filename = ?", (image_filename,)).rowcount
     
     if deleted_count > 0:
         logger.debug(f"Deleted image info for {image_filename}")
@@ -307,20 +797,17 @@ def delete_image_info(image_filename):
     return deleted_count > 0
 
 def ban_user(user_id, reason):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO banned_users (user_id, reason) VALUES (?, ?)", (user_id, reason))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO banned_users (user_id, reason) VALUES (?, ?)", (user_id, reason))
+    _moderation_state().banned.add(str(user_id))
     logger.info(f"Banned user {user_id} for reason: {reason}")
 
 def unban_user(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
-    deleted = c.rowcount > 0
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        deleted = conn.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,)).rowcount > 0
+    _moderation_state().banned.discard(str(user_id))
     if deleted:
         logger.info(f"Unbanned user {user_id}")
     else:
@@ -328,11 +815,9 @@ def unban_user(user_id):
     return deleted
 
 def get_ban_info(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT reason, banned_at FROM banned_users WHERE user_id = ?", (user_id,))
     info = c.fetchone()
-    conn.close()
     if info:
         logger.debug(f"Retrieved ban info for user {user_id}")
         return {"reason": info[0], "banned_at": info[1]}
@@ -341,24 +826,16 @@ def get_ban_info(user_id):
         return None
 
 def is_user_banned(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM banned_users WHERE user_id = ?", (user_id,))
-    is_banned = c.fetchone() is not None
-    conn.close()
-    return is_banned
+    return str(user_id) in _moderation_state().banned
 
 def get_all_banned_users():
     """
     Get all banned users from the database with their ban information.
     Returns a list of dictionaries containing user_id, reason, and banned_at.
     """
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT user_id, reason, banned_at FROM banned_users ORDER BY banned_at DESC")
-    banned_users = [{"user_id": row[0], "reason": row[1], "banned_at": row[2]} for row in c.fetchall()]
-    conn.close()
-    return banned_users
+    return [{"user_id": row[0], "reason": row[1], "banned_at": row[2]} for row in c.fetchall()]
 
 # Function to load LoRA information from lora.json
 def load_lora_info():
@@ -391,20 +868,5 @@ def contains_banned_word(text: str) -> tuple[bool, list[str]]:
     Check if text contains any banned words, accounting for obfuscation attempts.
     Returns a tuple of (bool, list of matched words)
     """
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT word FROM banned_words")
-    banned_words = [row[0] for row in c.fetchall()]
-    conn.close()
-
-    # Normalize the input text
-    normalized_text = normalize_text(text)
-    found_words = []
-
-    # Check each word in the normalized text against normalized banned words
-    for banned_word in banned_words:
-        normalized_banned = normalize_text(banned_word)
-        if normalized_banned in normalized_text:
-            found_words.append(banned_word)
-
+    found_words = get_banned_word_matcher().find_all(text)
     return bool(found_words), found_words
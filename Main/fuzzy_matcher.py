@@ -0,0 +1,132 @@
+"""
+Approximate banned-word matching, to catch one-character typos.
+
+A prompt token matches a banned term when their Levenshtein distance is
+at most max_distance. Terms are indexed by their deletion neighbourhood
+(every string reachable by deleting up to max_distance characters), the
+approach SymSpell uses. Two strings within distance d always share a
+string in their d-deletion neighbourhoods, so a token's candidates are a
+few dict lookups away and only those candidates get a real distance
+check. A BK-tree over 10,000 terms still computes the distance to about
+15% of them per token at distance 1, which comes to milliseconds per
+token in Python.
+
+Per-prompt work is bounded. Only MAX_TOKENS distinct tokens are checked,
+and each costs O(len(token) ** max_distance) lookups. Tokens and terms
+shorter than min_length are skipped, because short words sit within one
+edit of too many ordinary ones ("boy", "toy", "bay"). Multi-word terms are
+left to the exact matcher.
+"""
+import re
+from itertools import combinations
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+# Distinct tokens checked per prompt; the rest of a very long prompt is only matched exactly
+MAX_TOKENS = 512
+# Per-matcher memo of token -> matched term (or None); prompts repeat a lot of vocabulary
+TOKEN_CACHE_SIZE = 8192
+
+_TOKEN = re.compile(r'\w+')
+
+def deletions(word: str, max_distance: int) -> Set[str]:
+    """word and every string made by deleting up to max_distance of its characters."""
+    variants = {word}
+    for count in range(1, min(max_distance, len(word)) + 1):
+        for positions in combinations(range(len(word)), count):
+            variants.add(''.join(char for index, char in enumerate(word) if index not in positions))
+    return variants
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """Edit distance between a and b, or limit + 1 as soon as it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class FuzzyMatcher:
+    def __init__(self, words: Iterable[str], max_distance: int = 1, min_length: int = 6,
+                 normalize: Callable[[str], str] = str.lower):
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.normalize = normalize
+        # Normalized term -> the word as given
+        self.originals: Dict[str, str] = {}
+        # Deletion variant -> normalized terms it came from
+        self.index: Dict[str, List[str]] = {}
+        self.cache: Dict[str, Optional[str]] = {}
+
+        if max_distance <= 0:
+            return
+        for word in words:
+            term = normalize(word)
+            if len(term) < min_length or not term.isalnum() or term in self.originals:
+                continue
+            self.originals[term] = word
+            for variant in deletions(term, max_distance):
+                self.index.setdefault(variant, []).append(term)
+
+    def __len__(self) -> int:
+        return len(self.originals)
+
+    def match_token(self, token: str) -> Optional[str]:
+        """The normalized term within max_distance of token, or None."""
+        if token in self.cache:
+            return self.cache[token]
+        found = None
+        seen = set()
+        for variant in deletions(token, self.max_distance):
+            for term in self.index.get(variant, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                if levenshtein(token, term, self.max_distance) <= self.max_distance:
+                    found = term
+                    break
+            if found:
+                break
+        if len(self.cache) >= TOKEN_CACHE_SIZE:
+            self.cache.clear()
+        self.cache[token] = found
+        return found
+
+    def search(self, text: str) -> Optional[str]:
+        """The first banned word that a token of text is a near miss for, as given, or None."""
+        if not self.index:
+            return None
+        return self.search_normalized(self.normalize(text))
+
+    def search_normalized(self, text: str) -> Optional[str]:
+        """search for text that has already been through normalize."""
+        for term in self._near_misses(text):
+            return self.originals[term]
+        return None
+
+    def find_all_normalized(self, text: str) -> List[str]:
+        """Every banned word a token of already-normalized text is a near miss for, in order of first appearance."""
+        found = []
+        for term in self._near_misses(text):
+            if self.originals[term] not in found:
+                found.append(self.originals[term])
+        return found
+
+    def _near_misses(self, text: str):
+        if not self.index:
+            return
+        checked = set()
+        for match in _TOKEN.finditer(text):
+            token = match.group()
+            if len(token) + self.max_distance < self.min_length or token in checked:
+                continue
+            if len(checked) >= MAX_TOKENS:
+                break
+            checked.add(token)
+            term = self.match_token(token)
+            if term:
+                yield term
@@ -0,0 +1,97 @@
+"""
+Export image history for analytics as JSON Lines or CSV, optionally gzipped.
+
+Rows are streamed from iter_image_history and written as they are read,
+so exporting millions of rows uses the same memory as exporting ten.
+
+    python -m Main.history_export history.jsonl.gz
+    python -m Main.history_export history.csv --format csv --since 2024-01-01
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+from typing import Iterable, Optional, TextIO
+
+from Main.database import iter_image_history, DEFAULT_HISTORY_COLUMNS, HISTORY_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+def _open_output(path: str, compress: bool) -> TextIO:
+    if compress:
+        return io.TextIOWrapper(gzip.open(path, 'wb', compresslevel=6), encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def _write_jsonl(rows: Iterable[dict], out: TextIO) -> int:
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+        out.write('\n')
+        count += 1
+    return count
+
+def _write_csv(rows: Iterable[dict], out: TextIO, columns) -> int:
+    writer = csv.DictWriter(out, fieldnames=list(columns))
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        # Lists and workflows don't fit a CSV cell, so they are stored as JSON
+        writer.writerow({
+            key: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+            for key, value in row.items()
+        })
+        count += 1
+    return count
+
+def export_history(path: str, fmt: str = 'jsonl', compress: Optional[bool] = None,
+                   columns=DEFAULT_HISTORY_COLUMNS, user_id: Optional[str] = None,
+                   since: Optional[str] = None, until: Optional[str] = None) -> int:
+    """
+    Write matching history rows to path and return how many were written.
+    compress defaults to whether path ends in .gz. The file is written
+    under a temporary name and renamed, so readers never see a partial export.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Export format must be one of {EXPORT_FORMATS}, not {fmt!r}")
+    if compress is None:
+        compress = path.endswith('.gz')
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial = f"{path}.partial"
+    rows = iter_image_history(columns, user_id=user_id, since=since, until=until)
+    try:
+        with _open_output(partial, compress) as out:
+            count = _write_jsonl(rows, out) if fmt == 'jsonl' else _write_csv(rows, out, columns)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    logger.info(f"Exported {count} history rows to {path}")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Export image history as JSON Lines or CSV')
+    parser.add_argument('path', help='Output file; a .gz suffix enables gzip')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl')
+    parser.add_argument('--columns', default=','.join(DEFAULT_HISTORY_COLUMNS),
+                        help=f"Comma-separated columns from: {', '.join(HISTORY_COLUMNS)}")
+    parser.add_argument('--user-id', help='Only this user\'s images')
+    parser.add_argument('--since', help='Earliest timestamp, e.g. 2024-01-01')
+    parser.add_argument('--until', help='Timestamp to stop before')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    columns = tuple(column.strip() for column in args.columns.split(',') if column.strip())
+    export_history(args.path, args.format, columns=columns, user_id=args.user_id,
+                   since=args.since, until=args.until)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Write-behind queue for history, warning and audit rows.
+
+Rows are buffered and written by Main.database.write_batch in one
+transaction per flush, either every flush_interval seconds or as soon as
+batch_size rows are waiting. The durability setting decides what callers
+wait for:
+
+    buffered  return as soon as the row is queued; a crash can lose up to
+              one flush interval of rows
+    commit    async callers wait until their row's batch has committed
+
+Warnings are read back by the three-strike check before they are flushed,
+so the writer counts queued warnings per user (pending_warnings) and the
+check adds them to what is already in the database.
+"""
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from Main.database import (
+    write_batch, run_db, add_to_history, add_user_warning, add_audit_entry
+)
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ('buffered', 'commit')
+
+# (kind, args, future resolved once the row is committed)
+Entry = Tuple[str, tuple, Optional[asyncio.Future]]
+
+_active: Optional['HistoryWriter'] = None
+
+class HistoryWriter:
+    def __init__(self, flush_interval: float = 0.5, batch_size: int = 100, durability: str = 'buffered'):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {DURABILITY_MODES}, not {durability!r}")
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.durability = durability
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional[asyncio.Task] = None
+        # Entries can be queued from the database thread, so the buffer has its own lock
+        self.lock = threading.Lock()
+        self.buffer: List[Entry] = []
+        self.warning_counts = Counter()
+        self.wakeup = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.stopping = False
+
+    def start(self):
+        """Start flushing on the running loop and make this the writer record_* functions use."""
+        global _active
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.create_task(self.run())
+        _active = self
+        logger.info(f"History writer started ({self.durability}, every {self.flush_interval}s or {self.batch_size} rows)")
+
+    async def stop(self):
+        """Stop the flush loop and write everything still queued."""
+        global _active
+        if _active is self:
+            _active = None
+        if self.task:
+            # Let an in-progress flush finish rather than cancelling it mid-write
+            self.stopping = True
+            self.wakeup.set()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    def enqueue(self, kind: str, args: tuple, future: Optional[asyncio.Future] = None):
+        """Queue a row; safe to call from any thread."""
+        with self.lock:
+            self.buffer.append((kind, args, future))
+            if kind == 'warning':
+                self.warning_counts[args[0]] += 1
+            full = len(self.buffer) >= self.batch_size
+        if full and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def write(self, kind: str, args: tuple):
+        """Queue a row from the event loop, waiting for its commit in commit mode."""
+        if self.durability != 'commit':
+            self.enqueue(kind, args)
+            return None
+        future = self.loop.create_future()
+        self.enqueue(kind, args, future)
+        return await future
+
+    def pending_warnings(self, user_id: str) -> int:
+        with self.lock:
+            return self.warning_counts[user_id]
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"History writer flush failed: {str(e)}")
+
+    async def flush(self):
+        """Write every queued row now."""
+        async with self.flush_lock:
+            while True:
+                with self.lock:
+                    batch, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+                if not batch:
+                    return
+                try:
+                    results = await run_db(self.commit, batch)
+                except Exception as e:
+                    for _, _, future in batch:
+                        if future is not None and not future.done():
+                            future.set_exception(e)
+                    raise
+                for (kind, args, future), result in zip(batch, results):
+                    if future is None or future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    def commit(self, batch: List[Entry]) -> list:
+        """
+        Runs on the database thread. Warning counts are released in the
+        same step as the commit, so a reader on that thread never sees a
+        warning both queued and stored, or neither.
+        """
+        entries = [(kind, args) for kind, args, _ in batch]
+        try:
+            results = write_batch(entries)
+        except Exception as e:
+            logger.warning(f"Batch of {len(entries)} rows failed ({str(e)}); retrying one by one")
+            results = []
+            for entry in entries:
+                try:
+                    results.extend(write_batch([entry]))
+                except Exception as row_error:
+                    logger.error(f"Dropped {entry[0]} row: {str(row_error)}")
+                    results.append(row_error)
+        with self.lock:
+            for kind, args in entries:
+                if kind == 'warning':
+                    self.warning_counts[args[0]] -= 1
+                    if self.warning_counts[args[0]] <= 0:
+                        del self.warning_counts[args[0]]
+        return results
+
+def get_history_writer() -> Optional[HistoryWriter]:
+    return _active
+
+async def record_history(user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor, request_id=None):
+    """Queue a history row, or write it directly when no writer is running."""
+    args = (user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor, request_id)
+    if _active is None:
+        return await run_db(add_to_history, *args)
+    return await _active.write('history', args)
+
+async def record_audit(actor_id, action, target=None, details=None):
+    args = (actor_id, action, target, details)
+    if _active is None:
+        return await run_db(add_audit_entry, *args)
+    return await _active.write('audit', args)
+
+def queue_warning(user_id, prompt, word):
+    """Record a warning from any thread; written directly when no writer is running."""
+    if _active is None:
+        add_user_warning(user_id, prompt, word)
+    else:
+        _active.enqueue('warning', (user_id, prompt, word))
+
+def queue_audit(actor_id, action, target=None, details=None):
+    """record_audit for code on the database thread, which can't await."""
+    if _active is None:
+        add_audit_entry(actor_id, action, target, details)
+    else:
+        _active.enqueue('audit', (actor_id, action, target, details))
+
+def pending_warnings(user_id) -> int:
+    return _active.pending_warnings(user_id) if _active is not None else 0
+
+async def flush_pending():
+    """Write queued rows now, e.g. before reading or deleting warnings."""
+    if _active is not None:
+        await _active.flush()
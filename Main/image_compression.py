@@ -0,0 +1,169 @@
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Encoder settings tried in order until the output fits the byte budget.
+# Lossless WebP first so the image is untouched when it is enough,
+# then progressively lossier WebP and JPEG.
+COMPRESSION_LADDER = [
+    ('WEBP', {'lossless': True, 'quality': 80, 'method': 4}),
+    ('WEBP', {'quality': 95, 'method': 4}),
+    ('WEBP', {'quality': 90, 'method': 4}),
+    ('WEBP', {'quality': 80, 'method': 4}),
+    ('JPEG', {'quality': 90, 'optimize': True, 'progressive': True}),
+    ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+    ('JPEG', {'quality': 70, 'optimize': True, 'progressive': True}),
+]
+
+# Last resort once the ladder is exhausted: shrink the image and retry
+DOWNSCALE_STEP = 0.75
+MAX_DOWNSCALE_STEPS = 4
+
+FORMAT_EXTENSIONS = {
+    'WEBP': 'webp',
+    'JPEG': 'jpg',
+    'PNG': 'png'
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 2
+
+@dataclass
+class CompressionResult:
+    """Outcome of fitting an image into a byte budget"""
+    data: Optional[bytes]  # None when the original already fits
+    format: str
+    original_size: int
+    final_size: int
+
+    @property
+    def extension(self) -> str:
+        return FORMAT_EXTENSIONS.get(self.format, 'png')
+
+    @property
+    def compressed(self) -> bool:
+        return self.data is not None
+
+def format_size(num_bytes: int) -> str:
+    """Format a byte count as a short human-readable string."""
+    if num_bytes < 1024 * 1024:
+        return f"{num_bytes / 1024:.0f} KB"
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+def _encode(image, fmt: str, options: dict) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+def compress_image(image_data: bytes, budget: int) -> CompressionResult:
+    """
+    Re-encode image_data until it is at most budget bytes.
+    Runs in a worker process, so it only depends on Pillow.
+    """
+    return _compress(io.BytesIO(image_data), len(image_data), budget)
+
+def compress_file(image_path: str, budget: int) -> CompressionResult:
+    """compress_image for an image on disk, read by the worker rather than sent to it."""
+    return _compress(image_path, os.path.getsize(image_path), budget)
+
+def _compress(image_source, original_size: int, budget: int) -> CompressionResult:
+    from PIL import Image
+
+    if original_size <= budget:
+        return CompressionResult(None, 'PNG', original_size, original_size)
+
+    with Image.open(image_source) as source:
+        source.load()
+        image = source
+        smallest = None
+
+        for step in range(MAX_DOWNSCALE_STEPS + 1):
+            if step:
+                width = max(1, int(image.width * DOWNSCALE_STEP))
+                height = max(1, int(image.height * DOWNSCALE_STEP))
+                image = image.resize((width, height), Image.LANCZOS)
+                ladder = COMPRESSION_LADDER[-3:]  # Lossless is pointless once resized
+            else:
+                ladder = COMPRESSION_LADDER
+
+            for fmt, options in ladder:
+                encoded = _encode(image, fmt, options)
+                if smallest is None or len(encoded) < len(smallest[1]):
+                    smallest = (fmt, encoded)
+                if len(encoded) <= budget:
+                    return CompressionResult(encoded, fmt, original_size, len(encoded))
+
+    # Nothing fit; hand back the smallest attempt and let the upload decide
+    fmt, encoded = smallest
+    return CompressionResult(encoded, fmt, original_size, len(encoded))
+
+def create_preview(image_path: str, max_edge: int, budget: int) -> CompressionResult:
+    """
+    Build a downscaled WebP preview of a stored image.
+    Returns an uncompressed result when the original is already small enough.
+    """
+    from PIL import Image
+
+    original_size = os.path.getsize(image_path)
+    with Image.open(image_path) as image:
+        if max(image.size) <= max_edge and original_size <= budget:
+            return CompressionResult(None, 'PNG', original_size, original_size)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        encoded = _encode(image, 'WEBP', {'quality': 85, 'method': 4})
+
+    if len(encoded) > budget:
+        result = compress_image(encoded, budget)
+        return CompressionResult(result.data, result.format, original_size, result.final_size)
+    return CompressionResult(encoded, 'WEBP', original_size, len(encoded))
+
+def configure_compression_pool(max_workers: int):
+    """Set the worker count used when the pool is first created."""
+    global _executor_workers
+    _executor_workers = max(1, max_workers)
+
+def get_compression_pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=_executor_workers)
+        logger.info(f"Started image compression pool with {_executor_workers} workers")
+    return _executor
+
+def shutdown_compression_pool():
+    """Stop the worker processes; called when the bot closes."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def compress_file_to_budget(image_path: str, budget: int) -> CompressionResult:
+    """Run compress_file in the process pool; only the path crosses to the worker."""
+    size = os.path.getsize(image_path)
+    if size <= budget:
+        return CompressionResult(None, 'PNG', size, size)
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(get_compression_pool(), compress_file, image_path, budget)
+    logger.info(
+        f"Recompressed image {format_size(result.original_size)} -> "
+        f"{format_size(result.final_size)} as {result.format} (budget {format_size(budget)})"
+    )
+    return result
+
+async def preview_from_file(image_path: str, max_edge: int, budget: int) -> CompressionResult:
+    """Run create_preview in the process pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(get_compression_pool(), create_preview, image_path, max_edge, budget)
+    if result.compressed:
+        logger.info(
+            f"Created preview {format_size(result.final_size)} for "
+            f"{format_size(result.original_size)} image as {result.format}"
+        )
+    return result
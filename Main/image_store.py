@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+# Stored names are "<sha256>.<ext>", which is also what the web route accepts
+STORED_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.(png|webp|jpg)$')
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'jpg': 'image/jpeg'
+}
+
+@dataclass
+class StoredImage:
+    """A full-resolution image saved in the local store"""
+    digest: str
+    extension: str
+    path: str
+    size: int
+
+    @property
+    def filename(self) -> str:
+        return f"{self.digest}.{self.extension}"
+
+def detect_extension(header: bytes) -> str:
+    """Guess the file extension from the first bytes of an image."""
+    if header.startswith(b'\x89PNG'):
+        return 'png'
+    if header.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return 'png'
+
+class ImageStore:
+    """
+    Content-addressed store for delivered images.
+    Files live at <root>/<first two hex chars>/<sha256>.<ext>, so identical
+    images are stored once and a name never changes meaning.
+    """
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, filename: str) -> Optional[str]:
+        """Map a stored filename to its path, or None if the name is invalid."""
+        if not STORED_NAME_PATTERN.match(filename):
+            return None
+        return os.path.join(self.root, filename[:2], filename)
+
+    def save(self, fileobj: BinaryIO) -> StoredImage:
+        """Copy fileobj into the store while hashing it, then rewind fileobj."""
+        digest = hashlib.sha256()
+        size = 0
+        header = b''
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if not header:
+                        header = chunk[:16]
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            stored = StoredImage(digest.hexdigest(), detect_extension(header), '', size)
+            stored.path = self.path_for(stored.filename)
+            if os.path.exists(stored.path):
+                os.remove(temp_path)
+                logger.debug(f"Image already stored: {stored.filename}")
+            else:
+                os.makedirs(os.path.dirname(stored.path), exist_ok=True)
+                os.replace(temp_path, stored.path)
+                logger.debug(f"Stored image {stored.filename} ({size} bytes)")
+            return stored
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        finally:
+            fileobj.seek(0)
@@ -12,6 +12,7 @@ import time
 from typing import Optional, Dict, List
 from pathlib import Path
 from threading import Lock, Timer
+from Main.utils import invalidate_json
 
 logger = logging.getLogger(__name__)
 
@@ -131,7 +132,8 @@ class LoraFileHandler(FileSystemEventHandler):
                         return False
                     
             self.last_valid_config = new_config
-            self.bot.lora_options = new_config.get('available_loras', [])
+            # Runs on the watchdog thread, so reading usage here doesn't block the event loop
+            self.bot.lora_options = self.bot.order_lora_options(new_config.get('available_loras', []))
             logger.info(f"Reloaded LoRA config with {len(self.bot.lora_options)} entries")
             return True
 
@@ -147,6 +149,8 @@ class LoraFileHandler(FileSystemEventHandler):
             return False
             
         finally:
+            # Whatever ended up on disk (the edit or the restored config) is what load_json should see next
+            invalidate_json('lora.json')
             self.processing = False
 
     def on_modified(self, event):
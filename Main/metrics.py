@@ -0,0 +1,235 @@
+import bisect
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, sized for anything from a SQLite lookup
+# to a multi-minute 4x upscale
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric(ABC):
+    """Base class for metrics rendered in the Prometheus text format"""
+    type_name = 'untyped'
+
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """The metric's sample lines, without the HELP and TYPE header."""
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = ()):
+        super().__init__(name, description, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Metric):
+    """Gauge whose samples are computed by a callback at scrape time"""
+    type_name = 'gauge'
+
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, description, label_names)
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        values = self.callback() if self.callback else {}
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+class _Timer:
+    def __init__(self, histogram: 'Histogram', labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # One slot per bucket plus +Inf, then sum
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, **labels) -> _Timer:
+        """Context manager that observes the elapsed wall time of its block."""
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {state[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+REGISTRY = Registry()
+
+# Request pipeline phases: moderation, prompt_enhancement, queue_wait,
+# comfyui_execution, image_download, discord_upload
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    'fluxbot_phase_seconds',
+    'Time spent in each phase of an image request',
+    ('phase', 'backend')
+))
+
+DISCORD_API_SECONDS = REGISTRY.register(Histogram(
+    'fluxbot_discord_api_seconds',
+    'Latency of Discord REST calls by route',
+    ('method', 'route')
+))
+
+DISCORD_API_CALLS = REGISTRY.register(Counter(
+    'fluxbot_discord_api_calls_total',
+    'Discord REST calls by route and outcome',
+    ('method', 'route', 'outcome')
+))
+
+PROGRESS_EDITS = REGISTRY.register(Counter(
+    'fluxbot_progress_edits_total',
+    'Progress message edits by status',
+    ('status',)
+))
+
+JOBS_COMPLETED = REGISTRY.register(Counter(
+    'fluxbot_jobs_completed_total',
+    'Finished image requests by backend and outcome',
+    ('backend', 'outcome')
+))
+
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'fluxbot_queue_depth',
+    'Requests waiting for a runner by backend',
+    ('backend',)
+))
+
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'fluxbot_jobs_in_flight',
+    'Requests handed to a runner and awaiting their image by backend',
+    ('backend',)
+))
+
+QUOTA_DECISIONS = REGISTRY.register(Counter(
+    'fluxbot_quota_decisions_total',
+    'GPU quota admission checks by request kind and outcome',
+    ('kind', 'outcome')
+))
+
+def observe_phase(phase: str, seconds: float, backend: str = 'any'):
+    PHASE_SECONDS.observe(seconds, phase=phase, backend=backend)
+
+def time_phase(phase: str, backend: str = 'any') -> _Timer:
+    return PHASE_SECONDS.time(phase=phase, backend=backend)
+
+def bind_bot(bot):
+    """Compute queue and in-flight gauges from the bot's live state at scrape time."""
+    def queue_depth():
+        return {(backend,): count for backend, count in bot.subprocess_queue.depth_by_backend().items()}
+
+    def in_flight():
+        counts: Dict[Tuple[str, ...], float] = {}
+        for item in list(bot.pending_requests.values()):
+            key = (getattr(item, 'backend', 'unknown'),)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    QUEUE_DEPTH.callback = queue_depth
+    IN_FLIGHT.callback = in_flight
+
+def instrument_discord_http(http_client):
+    """Wrap discord.py's HTTPClient.request to time and count every REST call."""
+    original_request = http_client.request
+
+    async def timed_request(route, **kwargs):
+        method = getattr(route, 'method', 'UNKNOWN')
+        path = getattr(route, 'path', 'unknown')
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return await original_request(route, **kwargs)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            DISCORD_API_SECONDS.observe(time.perf_counter() - start, method=method, route=path)
+            DISCORD_API_CALLS.inc(method=method, route=path, outcome=outcome)
+
+    http_client.request = timed_request
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,250 @@
+"""
+Versioned schema migrations for the image history database.
+
+The schema version is kept in SQLite's `PRAGMA user_version`. Each
+migration runs in its own write transaction together with the version
+bump, so a crash or a concurrent runner (comfygen.py also opens the
+database) never leaves a half-applied step behind. Migrations must only
+use changes SQLite can make without rewriting a table (CREATE ... IF NOT
+EXISTS, CREATE INDEX, ALTER TABLE ADD COLUMN) or use rebuild_table.
+
+To change the schema, append a Migration with the next version number;
+never edit one that has shipped.
+"""
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """ALTER TABLE ADD COLUMN, skipped when the column already exists."""
+    if column not in table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def rebuild_table(conn: sqlite3.Connection, table: str, create_sql: str, columns: List[str]):
+    """
+    Rewrite a table with a new definition, for changes ALTER TABLE can't make.
+    create_sql must create a table named `{table}_new`; columns are copied by name.
+    Indexes and triggers on the old table are dropped with it and must be recreated.
+    """
+    column_list = ', '.join(columns)
+    conn.execute(create_sql)
+    conn.execute(f"INSERT INTO {table}_new ({column_list}) SELECT {column_list} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _initial_schema(conn: sqlite3.Connection):
+    # The tables init_db used to create; IF NOT EXISTS adopts databases made before versioning
+    conn.execute('''CREATE TABLE IF NOT EXISTS image_history
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id TEXT,
+                     prompt TEXT,
+                     workflow JSON,
+                     image_filename TEXT,
+                     resolution TEXT,
+                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                     loras JSON,
+                     upscale_factor INTEGER)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS banned_users
+                    (user_id TEXT PRIMARY KEY,
+                     reason TEXT,
+                     banned_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS banned_words
+                    (word TEXT PRIMARY KEY,
+                     added_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_warnings
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id TEXT,
+                     prompt TEXT,
+                     word TEXT,
+                     warned_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+def _lookup_indexes(conn: sqlite3.Connection):
+    # get_user_history: WHERE user_id = ? ORDER BY timestamp DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_history_user_time ON image_history (user_id, timestamp DESC)")
+    # get_image_info, update_image_info, delete_image_info
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_history_filename ON image_history (image_filename)")
+    # Time-range scans over all users
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_history_time ON image_history (timestamp)")
+    # get_user_warnings counts from the index alone; warned_at serves the ordered listing
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_warnings_user ON user_warnings (user_id, warned_at)")
+    # get_all_banned_users: ORDER BY banned_at DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_banned_users_time ON banned_users (banned_at)")
+
+def _history_request_id(conn: sqlite3.Connection):
+    # One row per job; older rows keep NULL, which never conflicts
+    add_column(conn, 'image_history', 'request_id', 'TEXT')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_image_history_request ON image_history (request_id)")
+
+def _workflow_templates(conn: sqlite3.Connection):
+    # Executed workflows are stored as a shared template plus a per-row delta (see workflow_store)
+    conn.execute('''CREATE TABLE IF NOT EXISTS workflow_templates
+                    (hash TEXT PRIMARY KEY,
+                     shape TEXT NOT NULL,
+                     body BLOB NOT NULL,
+                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_workflow_templates_shape ON workflow_templates (shape)")
+    add_column(conn, 'image_history', 'workflow_template', 'TEXT REFERENCES workflow_templates (hash)')
+    add_column(conn, 'image_history', 'workflow_delta', 'BLOB')
+
+def _audit_log(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS audit_log
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     actor_id TEXT,
+                     action TEXT NOT NULL,
+                     target TEXT,
+                     details TEXT,
+                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_target ON audit_log (target, created_at)")
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    return any(row[0] == 'ENABLE_FTS5' for row in conn.execute("PRAGMA compile_options"))
+
+def _prompt_search(conn: sqlite3.Connection):
+    if not fts5_available(conn):
+        logger.warning("SQLite was built without FTS5; /history search will fall back to LIKE scans")
+        return
+    # External-content index: the prompt text is stored once, in image_history
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS image_history_fts
+                    USING fts5 (prompt, content='image_history', content_rowid='id')''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS image_history_fts_insert AFTER INSERT ON image_history BEGIN
+                        INSERT INTO image_history_fts (rowid, prompt) VALUES (new.id, new.prompt);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS image_history_fts_delete AFTER DELETE ON image_history BEGIN
+                        INSERT INTO image_history_fts (image_history_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS image_history_fts_update AFTER UPDATE OF prompt ON image_history BEGIN
+                        INSERT INTO image_history_fts (image_history_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+                        INSERT INTO image_history_fts (rowid, prompt) VALUES (new.id, new.prompt);
+                    END''')
+    # Index the rows written before the triggers existed
+    conn.execute("INSERT INTO image_history_fts (image_history_fts) VALUES ('rebuild')")
+
+def _usage_rollups(conn: sqlite3.Connection):
+    # All-time usage counters, bumped as history rows are inserted. Deleting or
+    # archiving history doesn't lower them, so quotas can't be reset by deleting images.
+    conn.execute('''CREATE TABLE IF NOT EXISTS usage_user_daily
+                    (user_id TEXT NOT NULL,
+                     day TEXT NOT NULL,
+                     images INTEGER NOT NULL DEFAULT 0,
+                     PRIMARY KEY (user_id, day)) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_daily_day ON usage_user_daily (day, images)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS usage_lora
+                    (lora TEXT PRIMARY KEY,
+                     uses INTEGER NOT NULL DEFAULT 0,
+                     last_used DATETIME) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_lora_uses ON usage_lora (uses)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS usage_resolution
+                    (resolution TEXT PRIMARY KEY,
+                     images INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID''')
+
+    # An upsert from a SELECT needs a WHERE clause, or ON CONFLICT parses as a join constraint
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS image_history_usage AFTER INSERT ON image_history BEGIN
+                        INSERT INTO usage_user_daily (user_id, day, images)
+                        SELECT new.user_id, coalesce(date(new.timestamp), date('now')), 1
+                        WHERE new.user_id IS NOT NULL
+                        ON CONFLICT (user_id, day) DO UPDATE SET images = images + 1;
+                        INSERT INTO usage_resolution (resolution, images)
+                        SELECT new.resolution, 1 WHERE new.resolution IS NOT NULL
+                        ON CONFLICT (resolution) DO UPDATE SET images = images + 1;
+                        INSERT INTO usage_lora (lora, uses, last_used)
+                        SELECT value, 1, new.timestamp
+                        FROM json_each(CASE WHEN json_valid(new.loras) THEN new.loras ELSE '[]' END)
+                        WHERE type = 'text'
+                        ON CONFLICT (lora) DO UPDATE SET uses = uses + 1, last_used = excluded.last_used;
+                    END''')
+
+    # Count the history written before the trigger existed
+    conn.execute('''INSERT INTO usage_user_daily (user_id, day, images)
+                    SELECT user_id, date(timestamp), COUNT(*) FROM image_history
+                    WHERE user_id IS NOT NULL AND timestamp IS NOT NULL GROUP BY user_id, date(timestamp)''')
+    conn.execute('''INSERT INTO usage_resolution (resolution, images)
+                    SELECT resolution, COUNT(*) FROM image_history
+                    WHERE resolution IS NOT NULL GROUP BY resolution''')
+    conn.execute('''INSERT INTO usage_lora (lora, uses, last_used)
+                    SELECT j.value, COUNT(*), MAX(h.timestamp) FROM image_history h,
+                           json_each(CASE WHEN json_valid(h.loras) THEN h.loras ELSE '[]' END) j
+                    WHERE j.type = 'text' GROUP BY j.value''')
+
+def _quota_buckets(conn: sqlite3.Connection):
+    # Checkpointed GPU-time token buckets; updated_at is a Unix timestamp
+    conn.execute('''CREATE TABLE IF NOT EXISTS quota_buckets
+                    (user_id TEXT PRIMARY KEY,
+                     tokens REAL NOT NULL,
+                     updated_at REAL NOT NULL) WITHOUT ROWID''')
+
+def _image_blocklist(conn: sqlite3.Connection):
+    # Perceptual hashes of known-bad reference images, stored as signed 64-bit integers
+    conn.execute('''CREATE TABLE IF NOT EXISTS image_blocklist
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     phash INTEGER NOT NULL,
+                     dhash INTEGER NOT NULL,
+                     sha256 TEXT UNIQUE,
+                     reason TEXT,
+                     added_by TEXT,
+                     added_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'initial schema', _initial_schema),
+    Migration(2, 'lookup indexes for history, warnings and bans', _lookup_indexes),
+    Migration(3, 'unique request_id on image_history', _history_request_id),
+    Migration(4, 'deduplicated workflow templates for history', _workflow_templates),
+    Migration(5, 'audit log for moderation and admin actions', _audit_log),
+    Migration(6, 'full-text index over history prompts', _prompt_search),
+    Migration(7, 'per-user, per-LoRA and per-resolution usage rollups', _usage_rollups),
+    Migration(8, 'GPU-time quota buckets', _quota_buckets),
+    Migration(9, 'perceptual-hash blocklist for reference images', _image_blocklist),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply every pending migration in order and return the resulting version."""
+    current = get_schema_version(conn)
+    if current > LATEST_VERSION:
+        logger.warning(f"Database schema version {current} is newer than this bot ({LATEST_VERSION}); not migrating")
+        return current
+
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the write lock
+            if get_schema_version(conn) >= migration.version:
+                conn.rollback()
+                current = get_schema_version(conn)
+                continue
+            migration.apply(conn)
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Database migration {migration.version} ({migration.description}) failed")
+            raise
+        current = migration.version
+        logger.info(f"Applied database migration {migration.version}: {migration.description} "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    # Refresh planner statistics for any new indexes
+    conn.execute("PRAGMA optimize")
+    return current
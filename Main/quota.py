@@ -0,0 +1,188 @@
+"""
+GPU-time quotas enforced with per-user token buckets.
+
+Each request is priced in estimated GPU-seconds from its workflow
+template, output size and upscale factor. Every user has a bucket of
+`capacity` GPU-seconds that refills at capacity per `window` seconds,
+and a request is admitted when the bucket holds enough for it. A
+request larger than the whole bucket is admitted once the bucket is
+full and leaves it in debt, so big upscales are slowed rather than
+refused outright.
+
+Commands check would_admit when invoked and charge with try_consume
+only when the request is put on the queue, so a request abandoned in a
+modal or the LoRA picker costs nothing.
+
+Buckets live in memory and are checkpointed to the quota_buckets table
+every checkpoint_interval seconds and at shutdown, so a restart doesn't
+hand everyone a full bucket. Full buckets are dropped rather than stored.
+"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from Main.database import run_db, load_quota_buckets, save_quota_buckets
+
+logger = logging.getLogger(__name__)
+
+# GPU-seconds per output megapixel before upscaling, by workflow template
+TEMPLATE_SECONDS = {
+    'flux': 20.0,
+    'flux_4step': 6.0,
+    'pulid': 30.0,
+    'redux': 25.0,
+    'reduxprompt': 25.0,
+}
+# GPU-seconds per megapixel the upscaler adds; upscaling cost grows with output area
+UPSCALE_SECONDS = 2.0
+
+def template_kind(workflow_filename: Optional[str]) -> str:
+    """Map a text-to-image workflow file (config.fluxversion) to its TEMPLATE_SECONDS key."""
+    return 'flux_4step' if workflow_filename and '4step' in workflow_filename.lower() else 'flux'
+
+def estimate_gpu_seconds(kind: str, width: int, height: int, upscale_factor: int = 1) -> float:
+    megapixels = width * height / 1_000_000
+    upscale_factor = max(1, upscale_factor or 1)
+    base = TEMPLATE_SECONDS.get(kind, TEMPLATE_SECONDS['flux']) * megapixels
+    return base + UPSCALE_SECONDS * megapixels * (upscale_factor ** 2 - 1)
+
+def parse_role_limits(value: str) -> Dict[int, Optional[float]]:
+    """'role_id:seconds,role_id:unlimited' -> {role_id: seconds or None for unlimited}."""
+    limits: Dict[int, Optional[float]] = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        role_id, _, limit = item.partition(':')
+        limit = limit.strip().lower()
+        limits[int(role_id)] = None if limit == 'unlimited' else float(limit)
+    return limits
+
+@dataclass
+class Bucket:
+    tokens: float
+    updated: float
+    # The limit the bucket last refilled against; a user's roles can change it
+    capacity: float
+
+class QuotaManager:
+    def __init__(self, capacity: float, window: float = 3600, role_limits: Optional[Dict[int, Optional[float]]] = None,
+                 checkpoint_interval: float = 60):
+        self.capacity = capacity
+        self.window = window
+        self.role_limits = role_limits or {}
+        self.checkpoint_interval = checkpoint_interval
+        self.buckets: Dict[str, Bucket] = {}
+        self.dirty: Set[str] = set()
+        self.lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Restore checkpointed buckets and start checkpointing."""
+        now = time.time()
+        for user_id, tokens, updated in await run_db(load_quota_buckets):
+            self.buckets[user_id] = Bucket(tokens, min(updated, now), self.capacity)
+        self.task = asyncio.create_task(self.run())
+        logger.info(f"GPU quota started: {self.capacity:.0f} GPU-seconds per {self.window / 3600:g}h, "
+                    f"{len(self.buckets)} buckets restored")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.checkpoint()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logger.error(f"Quota checkpoint failed: {str(e)}")
+
+    def capacity_for(self, role_ids: Iterable[int]) -> Optional[float]:
+        """The most generous limit among the user's roles, or the default; None means unlimited."""
+        capacity = self.capacity
+        for role_id in role_ids:
+            if role_id in self.role_limits:
+                limit = self.role_limits[role_id]
+                if limit is None:
+                    return None
+                capacity = max(capacity, limit)
+        return capacity
+
+    def _refill(self, bucket: Bucket, capacity: float, now: float):
+        bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * capacity / self.window)
+        bucket.updated = now
+        bucket.capacity = capacity
+
+    def try_consume(self, user_id: str, role_ids: Iterable[int], cost: float,
+                    now: Optional[float] = None) -> Tuple[bool, float]:
+        """Charge cost GPU-seconds if the bucket allows it. Returns (admitted, retry_after_seconds)."""
+        return self._admit(user_id, role_ids, cost, now, charge=True)
+
+    def would_admit(self, user_id: str, role_ids: Iterable[int], cost: float,
+                    now: Optional[float] = None) -> Tuple[bool, float]:
+        """try_consume's answer without charging anything."""
+        return self._admit(user_id, role_ids, cost, now, charge=False)
+
+    def _admit(self, user_id: str, role_ids: Iterable[int], cost: float, now: Optional[float],
+               charge: bool) -> Tuple[bool, float]:
+        capacity = self.capacity_for(role_ids)
+        if capacity is None:
+            return True, 0.0
+        now = now or time.time()
+        with self.lock:
+            bucket = self.buckets.get(user_id)
+            if bucket is None:
+                if not charge:
+                    return True, 0.0
+                bucket = self.buckets[user_id] = Bucket(capacity, now, capacity)
+            self._refill(bucket, capacity, now)
+            needed = min(cost, capacity)
+            if bucket.tokens < needed:
+                return False, (needed - bucket.tokens) / (capacity / self.window)
+            if charge:
+                bucket.tokens -= cost
+                self.dirty.add(user_id)
+            return True, 0.0
+
+    def remaining(self, user_id: str, role_ids: Iterable[int], now: Optional[float] = None) -> Optional[float]:
+        capacity = self.capacity_for(role_ids)
+        if capacity is None:
+            return None
+        now = now or time.time()
+        with self.lock:
+            bucket = self.buckets.get(user_id)
+            if bucket is None:
+                return capacity
+            self._refill(bucket, capacity, now)
+            return bucket.tokens
+
+    async def checkpoint(self):
+        """
+        Write buckets changed since the last checkpoint and drop full ones,
+        since a missing bucket starts full. A stored bucket refills from its
+        timestamp, so a row left behind by a failed checkpoint is still correct.
+        """
+        now = time.time()
+        with self.lock:
+            changed, self.dirty = self.dirty, set()
+            saved, dropped = [], []
+            for user_id, bucket in list(self.buckets.items()):
+                if bucket.tokens + (now - bucket.updated) * bucket.capacity / self.window >= bucket.capacity:
+                    del self.buckets[user_id]
+                    dropped.append(user_id)
+                elif user_id in changed:
+                    saved.append((user_id, bucket.tokens, bucket.updated))
+        if not saved and not dropped:
+            return
+        try:
+            await run_db(save_quota_buckets, saved, dropped)
+        except Exception:
+            with self.lock:
+                self.dirty.update(row[0] for row in saved)
+            raise
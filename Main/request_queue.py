@@ -0,0 +1,24 @@
+import asyncio
+from collections import Counter
+from typing import Dict
+
+class RequestQueue(asyncio.Queue):
+    """
+    asyncio.Queue that keeps a per-backend count of waiting requests,
+    so queue depth can be reported without walking the queue.
+    """
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._backend_counts = Counter()
+
+    def _put(self, item):
+        super()._put(item)
+        self._backend_counts[getattr(item, 'backend', 'unknown')] += 1
+
+    def _get(self):
+        item = super()._get()
+        self._backend_counts[getattr(item, 'backend', 'unknown')] -= 1
+        return item
+
+    def depth_by_backend(self) -> Dict[str, int]:
+        return {backend: count for backend, count in self._backend_counts.items() if count > 0}
@@ -0,0 +1,174 @@
+"""
+Retention for image history: archive old rows, delete them, reclaim space.
+
+Rows older than retention_days are appended to gzipped JSON Lines files,
+one per month (history-YYYY-MM.jsonl.gz), and then deleted from
+image_history. Each batch is appended as its own gzip member, which
+gzip, zcat and gzip.open all read as one stream. A batch is deleted only
+after its archive write is flushed to disk. A crash between the two can
+archive a batch twice, but it never loses one. Archived rows keep their
+id and request_id, so duplicates are easy to drop.
+
+Freed pages are returned with PRAGMA incremental_vacuum in small steps,
+so the database thread is never held for long. New databases are created
+with auto_vacuum=INCREMENTAL (see database.get_connection). Older ones
+only shrink after a one-time full VACUUM, which holds the database
+thread for as long as it takes to rewrite the file, so it runs only when
+HISTORY_VACUUM_CONVERT is set.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from Main.database import get_connection, run_db, decode_history_workflow
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_INCREMENTAL = 2
+# Pages returned to the OS per incremental_vacuum step
+VACUUM_STEP_PAGES = 2000
+
+ARCHIVE_COLUMNS = (
+    'id', 'request_id', 'user_id', 'prompt', 'workflow', 'workflow_template', 'workflow_delta',
+    'image_filename', 'resolution', 'timestamp', 'loras', 'upscale_factor'
+)
+
+def cutoff_timestamp(retention_days: float, now: Optional[float] = None) -> str:
+    """History timestamps are UTC text from CURRENT_TIMESTAMP."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime((now or time.time()) - retention_days * 86400))
+
+def _fetch_expired(cutoff: str, batch_size: int) -> List[dict]:
+    rows = get_connection().execute(
+        f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM image_history "
+        "WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+        (cutoff, batch_size)
+    ).fetchall()
+    records = []
+    for row in rows:
+        record = dict(zip(ARCHIVE_COLUMNS, row))
+        # Archives must stand alone, so store the full workflow rather than a template reference
+        record['workflow'] = decode_history_workflow(
+            record['workflow'], record.pop('workflow_template'), record.pop('workflow_delta')
+        )
+        record['loras'] = json.loads(record['loras']) if record['loras'] else []
+        records.append(record)
+    return records
+
+def _delete_rows(ids: List[int]) -> int:
+    conn = get_connection()
+    with conn:
+        return conn.executemany("DELETE FROM image_history WHERE id = ?", ((row_id,) for row_id in ids)).rowcount
+
+def archive_path(archive_dir: str, timestamp: str) -> str:
+    return os.path.join(archive_dir, f"history-{timestamp[:7]}.jsonl.gz")
+
+def write_archive(archive_dir: str, records: List[dict]):
+    """Append records to their monthly archives and flush them to disk."""
+    by_month: Dict[str, List[dict]] = defaultdict(list)
+    for record in records:
+        by_month[archive_path(archive_dir, record['timestamp'] or '0000-00')].append(record)
+    os.makedirs(archive_dir, exist_ok=True)
+    for path, month_records in by_month.items():
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab', compresslevel=6) as out:
+                for record in month_records:
+                    out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+                    out.write(b'\n')
+            raw.flush()
+            os.fsync(raw.fileno())
+
+def _freelist_pages() -> Tuple[int, int]:
+    conn = get_connection()
+    return (conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+            conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+def _vacuum_step(pages: int) -> int:
+    conn = get_connection()
+    conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def _convert_to_incremental():
+    conn = get_connection()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Changing auto_vacuum on an existing database only takes effect after a full VACUUM
+    conn.execute("VACUUM")
+
+def _checkpoint():
+    get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+class RetentionManager:
+    def __init__(self, retention_days: float, archive_dir: str, interval: float = 24 * 3600,
+                 batch_size: int = 2000, convert_vacuum: bool = False):
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.convert_vacuum = convert_vacuum
+        self.conversion_noted = False
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        logger.info(f"History retention started: keeping {self.retention_days} days, archiving to {self.archive_dir}")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"History retention run failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Archive and delete expired rows, then reclaim free pages. Returns rows archived."""
+        started = time.perf_counter()
+        archived = await self.archive_expired()
+        await self.vacuum()
+        if archived:
+            logger.info(f"Archived {archived} history rows older than {self.retention_days} days "
+                        f"in {time.perf_counter() - started:.1f}s")
+        return archived
+
+    async def archive_expired(self) -> int:
+        cutoff = cutoff_timestamp(self.retention_days)
+        archived = 0
+        while True:
+            records = await run_db(_fetch_expired, cutoff, self.batch_size)
+            if not records:
+                return archived
+            # File writes stay off the database thread
+            await asyncio.to_thread(write_archive, self.archive_dir, records)
+            await run_db(_delete_rows, [record['id'] for record in records])
+            archived += len(records)
+            if len(records) < self.batch_size:
+                return archived
+
+    async def vacuum(self):
+        mode, free_pages = await run_db(_freelist_pages)
+        if mode != AUTO_VACUUM_INCREMENTAL:
+            if not self.convert_vacuum:
+                if not self.conversion_noted:
+                    logger.info("History database predates incremental auto-vacuum, so deleted rows won't "
+                                "shrink the file; set HISTORY_VACUUM_CONVERT=true to convert it with a one-time full VACUUM")
+                    self.conversion_noted = True
+                return
+            logger.info("Converting history database to incremental auto-vacuum (one-time full VACUUM)")
+            await run_db(_convert_to_incremental)
+            free_pages = 0
+        # Each step is its own job on the database thread, so queries queued meanwhile run in between
+        while free_pages > 0:
+            free_pages = await run_db(_vacuum_step, VACUUM_STEP_PAGES)
+        await run_db(_checkpoint)
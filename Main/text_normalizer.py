@@ -0,0 +1,171 @@
+"""
+Obfuscation-resistant text normalization for moderation.
+
+normalize() folds the tricks used to sneak a banned word past a plain
+lowercase match. Prompts and banned words go through the same function,
+so "Ch!ld", "ⅽհіⅼⅾ" and "child" with a zero-width space inside all
+normalize to what "child" normalizes to:
+
+    case            lowercased, including fullwidth and other NFKC forms
+    diacritics      decomposed and the combining marks dropped
+    confusables     Cyrillic and Greek lookalikes mapped to Latin
+    leetspeak       0 1 3 4 5 7 8 9 read as letters; @ $ ! | + only
+                    between letters, elsewhere they break words like
+                    other punctuation ("sh!t" but "nude!")
+    zero-width      joiners, soft hyphens and variation selectors deleted
+    punctuation     becomes a space, so "nude,woman" is two words
+    whitespace      every kind of space becomes ' '
+    repeats         runs of three or more of a character collapse to two
+
+A single reading can't catch everything: "$lut" needs its leading symbol
+read as a letter, and "C.h.i.l.d" needs its punctuation deleted rather
+than turned into spaces. normalized_forms() returns those readings too,
+and the banned-word check matches each of them.
+
+The folding is a str.translate table, so it is one C-level pass over
+the prompt followed by regex passes for leet symbols and repeats. Every
+ASCII and Latin-1 character, plus the confusables, is in the table from
+the start. Anything else is worked out the first time it is seen and
+cached. The output is only for matching. It is never stored or shown to
+anyone.
+
+Repeats stop at two because English doubles letters: collapsing to one
+would turn "teen" into "ten", and "ten apples" would match 'teen'. A
+stretched "teeeen" still reaches "teen", but "chiiild" stops at "chiild"
+and no longer matches 'child' exactly. The moderation checks in
+benchmarks/micro.py pin both sides of these trades.
+"""
+import re
+import unicodedata
+from typing import Dict, Optional, Tuple
+
+LEETSPEAK = {
+    '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g',
+    '@': 'a', '$': 's', '!': 'i', '|': 'l', '+': 't',
+}
+# Leet symbols double as punctuation, so the table keeps them and context decides afterwards
+LEET_SYMBOLS = frozenset(char for char in LEETSPEAK if not char.isalnum())
+_SYMBOL_LETTERS = str.maketrans({char: LEETSPEAK[char] for char in LEET_SYMBOLS})
+
+# Lookalikes NFKC leaves alone: Cyrillic, Greek and a few Latin letters
+CONFUSABLES = {
+    # Cyrillic
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o',
+    'р': 'p', 'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'ѕ': 's', 'і': 'i', 'ї': 'i',
+    'ј': 'j', 'һ': 'h', 'ԁ': 'd', 'ԛ': 'q', 'ԝ': 'w', 'ɡ': 'g', 'ӏ': 'l', 'ո': 'n',
+    'հ': 'h', 'ս': 'u', 'ց': 'g', 'օ': 'o',
+    # Greek
+    'α': 'a', 'β': 'b', 'γ': 'y', 'δ': 'd', 'ε': 'e', 'η': 'n', 'ι': 'i', 'κ': 'k',
+    'μ': 'u', 'ν': 'v', 'ο': 'o', 'ρ': 'p', 'σ': 'o', 'ς': 's', 'τ': 't', 'υ': 'u',
+    'χ': 'x', 'ω': 'w',
+    # Latin
+    'ı': 'i', 'ł': 'l', 'ø': 'o', 'đ': 'd', 'ħ': 'h', 'ŧ': 't', 'ß': 'ss', 'æ': 'ae',
+    'œ': 'oe', 'þ': 'th', 'ð': 'd',
+}
+
+# Characters with no visible width, used to split a word without showing it
+ZERO_WIDTH = frozenset(
+    '\u00ad\u034f\u061c\u115f\u1160\u17b4\u17b5\u180e\u200b\u200c\u200d\u200e\u200f'
+    '\u202a\u202b\u202c\u202d\u202e\u2060\u2061\u2062\u2063\u2064\u206a\u206b\u206c'
+    '\u206d\u206e\u206f\u3164\ufeff\uffa0'
+)
+
+# Same as (.)\1{2,}, which the regex engine runs about half as fast
+_REPEATS = re.compile(r'(.)\1\1+', re.DOTALL)
+# A character class scan is far faster than a lookbehind tried at every position
+_SYMBOLS = re.compile('[' + re.escape(''.join(sorted(LEET_SYMBOLS))) + ']+')
+
+def _two_chars(match: re.Match) -> str:
+    return match.group(1) * 2
+
+def _has_symbols(text: str) -> bool:
+    # A few substring scans in C; most prompts have no leet symbols at all
+    return any(char in text for char in LEET_SYMBOLS)
+
+def _resolve_symbols(match: re.Match) -> str:
+    # Letters when the run sits inside a word, as in "sh!t"; otherwise a word break
+    text, start, end = match.string, match.start(), match.end()
+    if start and end < len(text) and text[start - 1].isalnum() and text[end].isalnum():
+        return match.group().translate(_SYMBOL_LETTERS)
+    return ' ' * (end - start)
+
+def _fold_char(char: str, punctuation: Optional[str]) -> Optional[str]:
+    """What one character becomes; None deletes it. punctuation is what punctuation becomes."""
+    if char in ZERO_WIDTH or unicodedata.category(char) == 'Mn' or 0xFE00 <= ord(char) <= 0xFE0F:
+        return None
+    if char.isspace():
+        return ' '
+    # Uppercase lookalikes fold once lowered (e.g. Cyrillic 'А' -> 'а' -> 'a')
+    lowered = char.lower()
+    if lowered in CONFUSABLES:
+        return CONFUSABLES[lowered]
+    if char in LEET_SYMBOLS:
+        return char
+    if char in LEETSPEAK:
+        return LEETSPEAK[char]
+
+    folded = []
+    # NFKD both splits off diacritics and maps compatibility forms (fullwidth, circled, math letters)
+    for part in unicodedata.normalize('NFKD', char):
+        if unicodedata.combining(part):
+            continue
+        part = part.lower()
+        if part in LEET_SYMBOLS:
+            folded.append(part)
+            continue
+        part = CONFUSABLES.get(part, LEETSPEAK.get(part, part))
+        if part.isalnum() or part == ' ':
+            folded.append(part)
+        elif punctuation:
+            folded.append(punctuation)
+    return ''.join(folded) or None
+
+class _FoldTable(dict):
+    """str.translate table that fills in characters outside the precomputed range on first sight."""
+    def __init__(self, punctuation: Optional[str]):
+        super().__init__()
+        self.punctuation = punctuation
+
+    def __missing__(self, codepoint: int) -> Optional[str]:
+        folded = _fold_char(chr(codepoint), self.punctuation)
+        self[codepoint] = folded
+        return folded
+
+def _build_table(punctuation: Optional[str]) -> _FoldTable:
+    table = _FoldTable(punctuation)
+    for codepoint in range(0x100):
+        table[codepoint] = _fold_char(chr(codepoint), punctuation)
+    for char in list(CONFUSABLES) + [char.upper() for char in CONFUSABLES] + list(ZERO_WIDTH):
+        for single in char:
+            table[ord(single)] = _fold_char(single, punctuation)
+    return table
+
+# Punctuation breaks words
+FOLD_TABLE: Dict[int, Optional[str]] = _build_table(' ')
+# Punctuation is deleted, joining "C.h.i.l.d" back into a word
+JOINED_TABLE: Dict[int, Optional[str]] = _build_table(None)
+
+def _finish(folded: str) -> str:
+    resolved = _SYMBOLS.sub(_resolve_symbols, folded) if _has_symbols(folded) else folded
+    # A function replacement is measurably faster than the r'\1\1' template
+    return _REPEATS.sub(_two_chars, resolved).strip()
+
+def normalize(text: str) -> str:
+    """Fold text for banned-word matching; see the module docstring for what is folded."""
+    return _finish(text.translate(FOLD_TABLE))
+
+def normalized_forms(text: str) -> Tuple[str, ...]:
+    """
+    normalize(text), then the same text with every leet symbol read as a
+    letter, then with punctuation deleted instead of breaking words.
+    Readings that come out the same are only returned once.
+    """
+    folded = text.translate(FOLD_TABLE)
+    forms = [_finish(folded)]
+    if _has_symbols(folded):
+        forms.append(_REPEATS.sub(_two_chars, folded.translate(_SYMBOL_LETTERS)).strip())
+    joined = text.translate(JOINED_TABLE)
+    # Without punctuation the joined reading is the first one again
+    if len(joined) != len(folded):
+        forms.append(_finish(joined))
+    return tuple(dict.fromkeys(forms))
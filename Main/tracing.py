@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from Main.metrics import observe_phase
+
+logger = logging.getLogger(__name__)
+
+# Every span of one image request shares a trace id, which is also the
+# request_id the bot hands to the runner and gets back in its callbacks
+_current_trace: ContextVar[Optional[str]] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar('current_span', default=None)
+
+_exporter: Optional[Callable[[Dict[str, Any]], None]] = None
+_process_name = 'bot'
+
+class JsonlExporter:
+    """Append span records to a JSON Lines file, one span per line"""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, record: Dict[str, Any]):
+        line = json.dumps(record, default=str) + '\n'
+        try:
+            with self._lock:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        except OSError as e:
+            logger.error(f"Error writing trace span: {str(e)}")
+
+def configure_tracing(exporter: Optional[Callable[[Dict[str, Any]], None]], process_name: str = 'bot'):
+    """Set where finished spans go; None disables export."""
+    global _exporter, _process_name
+    _exporter = exporter
+    _process_name = process_name
+
+def new_trace_id() -> str:
+    return str(uuid.uuid4())
+
+def current_trace_id() -> Optional[str]:
+    return _current_trace.get()
+
+def start_trace(trace_id: Optional[str] = None) -> str:
+    """
+    Make trace_id (or a fresh one) current for the running task.
+    Discord callbacks and aiohttp handlers each run in their own task,
+    so this does not leak into other requests.
+    """
+    trace_id = trace_id or new_trace_id()
+    _current_trace.set(trace_id)
+    _current_span.set(None)
+    return trace_id
+
+def trace_id_for_request() -> str:
+    """Default request_id for new request items: the current trace, or a new id."""
+    return current_trace_id() or new_trace_id()
+
+def _export(record: Dict[str, Any]):
+    if _exporter is None:
+        return
+    try:
+        _exporter(record)
+    except Exception as e:
+        logger.error(f"Error exporting trace span: {str(e)}")
+
+def record_span(name: str, duration: float, trace_id: Optional[str] = None, start: Optional[float] = None,
+                phase: Optional[str] = None, backend: str = 'any', status: str = 'ok', **attrs):
+    """Record a span that was timed elsewhere, e.g. queue wait."""
+    trace_id = trace_id or current_trace_id() or new_trace_id()
+    if phase:
+        observe_phase(phase, duration, backend)
+    _export({
+        'trace_id': trace_id,
+        'span_id': uuid.uuid4().hex[:16],
+        'parent_id': _current_span.get() if trace_id == current_trace_id() else None,
+        'name': name,
+        'process': _process_name,
+        'start': start if start is not None else time.time() - duration,
+        'duration_ms': round(duration * 1000, 3),
+        'status': status,
+        'phase': phase,
+        'attrs': attrs
+    })
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, phase: Optional[str] = None, backend: str = 'any', **attrs):
+    """
+    Time a block as a span of the current (or given) trace.
+    If phase is set, the duration also feeds the phase latency histogram.
+    """
+    trace_id = trace_id or current_trace_id() or new_trace_id()
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _current_span.get() if trace_id == current_trace_id() else None
+    trace_token = _current_trace.set(trace_id)
+    span_token = _current_span.set(span_id)
+    start = time.time()
+    start_perf = time.perf_counter()
+    status = 'ok'
+    try:
+        yield attrs
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start_perf
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if phase:
+            observe_phase(phase, duration, backend)
+        _export({
+            'trace_id': trace_id,
+            'span_id': span_id,
+            'parent_id': parent_id,
+            'name': name,
+            'process': _process_name,
+            'start': start,
+            'duration_ms': round(duration * 1000, 3),
+            'status': status,
+            'phase': phase,
+            'attrs': attrs
+        })
+
+def import_spans(records: Iterable[Dict[str, Any]], backend: str = 'any'):
+    """
+    Export spans reported by the runner process in a callback payload and
+    feed their phases into the local metrics.
+    """
+    for record in records:
+        if not isinstance(record, dict) or 'name' not in record:
+            continue
+        duration_ms = record.get('duration_ms')
+        if record.get('phase') and isinstance(duration_ms, (int, float)):
+            observe_phase(record['phase'], duration_ms / 1000, backend)
+        _export(record)
@@ -1,13 +1,72 @@
 import json
 import logging
+import marshal
 import random
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Any, Dict, Union, Optional
 
 logger = logging.getLogger(__name__)
 
-def load_json(filename):
-    """Load JSON file with error handling and encoding fallback"""
+# A cached file is re-stat'ed at most this often; save_json and invalidate_json drop it at once
+JSON_CACHE_CHECK_SECONDS = 1.0
+# Parsed files kept, least recently used first; the bot reads about a dozen
+JSON_CACHE_SIZE = 64
+
+class FrozenDict(dict):
+    """A dict that refuses changes, for snapshots shared between callers. json.dumps still accepts it."""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("JSON snapshots are read-only; use load_json for a copy you can change")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+def freeze(value):
+    """Read-only copy of parsed JSON: dicts become FrozenDicts and lists become tuples."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value):
+    """Mutable copy of a snapshot (or any parsed JSON)."""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+class _CachedJson:
+    __slots__ = ('path', 'mtime_ns', 'size', 'checked', 'snapshot', 'blob')
+
+    def __init__(self, path, mtime_ns, size, checked, parsed):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.checked = checked
+        self.snapshot = freeze(parsed)
+        # marshal.loads rebuilds a mutable copy about 3x faster than json.loads or thaw
+        self.blob = marshal.dumps(parsed)
+
+# Absolute path of the file -> _CachedJson, so every name for one file shares an entry
+_json_cache: 'OrderedDict[str, _CachedJson]' = OrderedDict()
+# (working directory, filename as passed) -> the absolute path it resolved to
+_json_paths: Dict[tuple, str] = {}
+_json_cache_lock = threading.Lock()
+
+def _find_json(filename):
     # Try both case variations of the directory name
     possible_paths = [
         os.path.join('Main', 'Datasets', filename),
@@ -15,33 +74,94 @@ def load_json(filename):
         filename  # Also try the direct path if provided
     ]
     
-    filepath = None
     for path in possible_paths:
         if os.path.exists(path):
-            filepath = path
-            break
+            return os.path.abspath(path)
             
-    if not filepath:
-        logger.error(f"File not found: {filename} (tried paths: {', '.join(possible_paths)})")
-        raise FileNotFoundError(f"JSON file not found: {filename}")
-        
+    logger.error(f"File not found: {filename} (tried paths: {', '.join(possible_paths)})")
+    raise FileNotFoundError(f"JSON file not found: {filename}")
+
+def _parse_json(filename, data: bytes):
     try:
         # First try UTF-8
-        with open(filepath, 'r', encoding='utf-8') as file:
-            try:
-                return json.load(file)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error in {filename}: {str(e)}")
-                raise ValueError(f"Invalid JSON format in {filename}: {str(e)}")
+        text = data.decode('utf-8')
     except UnicodeDecodeError:
         # Fallback to ISO-8859-1
         logger.warning(f"UTF-8 decode failed for {filename}, trying ISO-8859-1")
-        with open(filepath, 'r', encoding='iso-8859-1') as file:
-            try:
-                return json.load(file)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error in {filename}: {str(e)}")
-                raise ValueError(f"Invalid JSON format in {filename}: {str(e)}")
+        text = data.decode('iso-8859-1')
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error in {filename}: {str(e)}")
+        raise ValueError(f"Invalid JSON format in {filename}: {str(e)}")
+
+def _drop_cached(path):
+    # Caller holds _json_cache_lock
+    _json_cache.pop(path, None)
+    for name in [name for name, resolved in _json_paths.items() if resolved == path]:
+        del _json_paths[name]
+
+def _cached_json(filename) -> _CachedJson:
+    now = time.monotonic()
+    # Relative names resolve against the working directory, so it is part of the name
+    name = (os.getcwd(), filename)
+    with _json_cache_lock:
+        path = _json_paths.get(name)
+        entry = _json_cache.get(path) if path is not None else None
+        if entry is not None:
+            _json_cache.move_to_end(path)
+            if now - entry.checked < JSON_CACHE_CHECK_SECONDS:
+                return entry
+
+    # Resolved again on every check, since the file may since have appeared earlier on the search path
+    path = _find_json(filename)
+    # Stat before reading, so a write that lands mid-read is caught by the next check
+    stat = os.stat(path)
+    with _json_cache_lock:
+        _json_paths[name] = path
+        entry = _json_cache.get(path)
+    if entry is not None and stat.st_mtime_ns == entry.mtime_ns and stat.st_size == entry.size:
+        entry.checked = now
+        return entry
+
+    with open(path, 'rb') as file:
+        entry = _CachedJson(path, stat.st_mtime_ns, stat.st_size, now, _parse_json(filename, file.read()))
+
+    with _json_cache_lock:
+        _json_cache[path] = entry
+        _json_cache.move_to_end(path)
+        if len(_json_cache) > JSON_CACHE_SIZE:
+            _drop_cached(next(iter(_json_cache)))
+    return entry
+
+def load_json_snapshot(filename):
+    """
+    Load a JSON file as a shared, read-only snapshot.
+
+    Parsed files are cached by absolute path, so different names for one
+    file (e.g. 'lora.json' and 'Main/DataSets/lora.json') share an entry.
+    A cached file is checked against its mtime and size at most every
+    JSON_CACHE_CHECK_SECONDS, so repeated reads don't touch the filesystem.
+    Callers that modify the result should use load_json instead.
+    """
+    return _cached_json(filename).snapshot
+
+def load_json(filename):
+    """Load JSON file with error handling and encoding fallback; returns a copy the caller may change"""
+    return marshal.loads(_cached_json(filename).blob)
+
+def invalidate_json(filename=None):
+    """Drop a cached file (by name or path), or every cached file, so the next load re-reads it."""
+    with _json_cache_lock:
+        if filename is None:
+            _json_cache.clear()
+            _json_paths.clear()
+            return
+        path = os.path.abspath(filename)
+        resolved = _json_paths.get((os.getcwd(), filename))
+        for cached in [cached for cached in _json_cache
+                       if cached in (path, resolved) or os.path.basename(cached) == filename]:
+            _drop_cached(cached)
 
 def save_json(filename, data):
     """Save data to JSON file with error handling"""
@@ -64,6 +184,7 @@ def save_json(filename, data):
     try:
         with open(filepath, 'w', encoding='utf-8') as file:
             json.dump(data, file, indent=2, ensure_ascii=False)
+        invalidate_json(filepath)
         logger.debug(f"Successfully saved {filename}")
     except Exception as e:
         logger.error(f"Error saving {filename}: {str(e)}")
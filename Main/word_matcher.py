@@ -0,0 +1,108 @@
+"""
+Multi-word matcher for the banned-word check.
+
+An Aho-Corasick automaton finds every occurrence of every word in one
+pass over the text, so a check costs the same whether the list holds
+ten words or ten thousand. Matches follow the same rule as
+re.search(r'\\b' + re.escape(word) + r'\\b', text): the characters on
+either side of a match must not be word characters.
+
+Words and text can both be passed through a normalize function first
+(Main.text_normalizer.normalize for moderation), so obfuscated spellings
+match. Matches report the word as it was given, not its normalized form.
+
+A WordMatcher is immutable once built. Changing the word list means
+building a new one and replacing the reference, so a check already in
+progress keeps using the automaton it started with.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+def is_word_char(char: str) -> bool:
+    """What \\w matches in a str pattern."""
+    return char.isalnum() or char == '_'
+
+class WordMatcher:
+    def __init__(self, words: Iterable[str], normalize: Callable[[str], str] = str.lower):
+        # Node i: goto[i] maps a character to the next node, fail[i] is the
+        # longest proper suffix that is also a trie path, and out[i] holds
+        # the words ending at i (including those reached through fail links)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Tuple[str, ...]] = [()]
+        self.normalize = normalize
+        # Normalized form -> the first word given with that form
+        self.originals: Dict[str, str] = {}
+
+        given: Dict[str, None] = {}
+        for word in words:
+            key = normalize(word)
+            if not key:
+                continue
+            given[word] = None
+            if key not in self.originals:
+                self.originals[key] = word
+                self._add(key)
+        self.words: Tuple[str, ...] = tuple(given)
+        self._link()
+
+    def _add(self, key: str):
+        node = 0
+        for char in key:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = next_node
+        self.out[node] = self.out[node] + (key,)
+
+    def _link(self):
+        # Breadth-first, so every node's fail target is finished before its children
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def finditer(self, text: str):
+        """Yield (start, normalized word) for each whole-word match in already-normalized text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        length = len(text)
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if not out[node]:
+                continue
+            next_is_word = end + 1 < length and is_word_char(text[end + 1])
+            for word in out[node]:
+                start = end + 1 - len(word)
+                previous_is_word = start > 0 and is_word_char(text[start - 1])
+                # \b holds where a word character meets a non-word character or either end of the text
+                if previous_is_word != is_word_char(word[0]) and next_is_word != is_word_char(word[-1]):
+                    yield start, word
+
+    def search(self, text: str) -> Optional[str]:
+        """The first banned word found in text, or None."""
+        for _, key in self.finditer(self.normalize(text)):
+            return self.originals[key]
+        return None
+
+    def find_all(self, text: str) -> List[str]:
+        """Every distinct banned word in text, in order of first appearance."""
+        found = []
+        for _, key in self.finditer(self.normalize(text)):
+            if self.originals[key] not in found:
+                found.append(self.originals[key])
+        return found
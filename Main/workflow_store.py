@@ -0,0 +1,98 @@
+"""
+Compact encoding of executed workflows for image history.
+
+A ComfyUI workflow run by the bot differs from the previous one only in
+a handful of inputs (prompt, seed, LoRAs, resolution, upscale). History
+therefore stores each distinct workflow *shape* once as a template,
+keyed by content hash, and each row keeps only the inputs that differ
+from that template.
+
+Two workflows have the same shape when they have the same nodes and
+input names; input values are ignored. The first workflow seen with a
+shape becomes its template.
+"""
+import copy
+import hashlib
+import json
+import zlib
+from typing import Any, Dict, List, Tuple
+
+# Blob prefixes, so readers don't need to know how a blob was written
+RAW_PREFIX = b'j'
+ZLIB_PREFIX = b'z'
+
+# Blobs smaller than this aren't worth the zlib header
+COMPRESS_MIN_BYTES = 64
+
+Path = List[str]
+
+def canonical_json(value: Any) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def content_hash(workflow: dict) -> str:
+    return hashlib.sha256(canonical_json(workflow)).hexdigest()
+
+def _shape(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    # Lists are node links or literal values; either way they are leaves
+    return None
+
+def workflow_shape(workflow: dict) -> str:
+    """Hash of the workflow's node and input names, ignoring input values."""
+    return hashlib.sha256(canonical_json(_shape(workflow))).hexdigest()
+
+def diff_workflow(template: dict, workflow: dict) -> Dict[str, list]:
+    """
+    The changes that turn template into workflow: 'set' holds [path, value]
+    pairs for changed or added leaves and 'del' the paths of removed keys.
+    """
+    changes: List[Tuple[Path, Any]] = []
+    removed: List[Path] = []
+
+    def walk(before: dict, after: dict, path: Path):
+        for key, value in after.items():
+            if key not in before:
+                changes.append((path + [key], value))
+            elif isinstance(value, dict) and isinstance(before[key], dict):
+                walk(before[key], value, path + [key])
+            elif value != before[key]:
+                changes.append((path + [key], value))
+        for key in before:
+            if key not in after:
+                removed.append(path + [key])
+
+    walk(template, workflow, [])
+    delta: Dict[str, list] = {'set': [[path, value] for path, value in changes]}
+    if removed:
+        delta['del'] = removed
+    return delta
+
+def apply_delta(template: dict, delta: Dict[str, list]) -> dict:
+    """Rebuild a workflow from its template and diff_workflow's delta."""
+    workflow = copy.deepcopy(template)
+    for path in delta.get('del', []):
+        parent = workflow
+        for key in path[:-1]:
+            parent = parent[key]
+        parent.pop(path[-1], None)
+    for path, value in delta.get('set', []):
+        parent = workflow
+        for key in path[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[path[-1]] = value
+    return workflow
+
+def encode_blob(value: Any, compress: bool = True) -> bytes:
+    data = canonical_json(value)
+    if compress and len(data) >= COMPRESS_MIN_BYTES:
+        return ZLIB_PREFIX + zlib.compress(data, 6)
+    return RAW_PREFIX + data
+
+def decode_blob(blob: bytes) -> Any:
+    prefix, data = blob[:1], blob[1:]
+    if prefix == ZLIB_PREFIX:
+        data = zlib.decompress(data)
+    elif prefix != RAW_PREFIX:
+        raise ValueError(f"Unknown workflow blob format: {prefix!r}")
+    return json.loads(data)
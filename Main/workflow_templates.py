@@ -0,0 +1,155 @@
+"""
+ComfyUI workflow templates, compiled once and filled in per request.
+
+Each template the bot runs has a few inputs that change per request
+(prompt, seed, resolution, LoRAs...). A slot map names them, so node ids
+like '69' or '198:2' are written down here and nowhere else:
+
+    STANDARD_SLOTS['seed'] == Slot('198:2', 'noise_seed')
+
+compile_template validates a parsed template once and keeps the slots
+whose nodes it actually has. instantiate() then builds a request's
+workflow copy-on-write. It copies the top-level dict and the nodes a slot
+changes, and shares every other node with the template.
+
+get_template compiles from load_json_snapshot and recompiles when the
+file changes. Shared nodes are therefore read-only snapshots: writing to
+one raises TypeError rather than leaking into the next request.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+from Main.utils import load_json_snapshot
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Slot:
+    node: str
+    # Input set to the slot's value; None for a LoRA slot, whose lora_N inputs are replaced as a group
+    input: Optional[str]
+
+    @property
+    def is_loras(self) -> bool:
+        return self.input is None
+
+# Text-to-image (config.fluxversion: FluxDev*, fluxfusion*)
+STANDARD_SLOTS = {
+    'prompt': Slot('69', 'prompt'),
+    'resolution': Slot('258', 'ratio_selected'),
+    'loras': Slot('271', None),
+    'upscale_factor': Slot('279', 'rescale_factor'),
+    'seed': Slot('198:2', 'noise_seed'),
+    'guidance': Slot('198:4', 'guidance'),
+}
+STANDARD_REQUIRED = ('69', '258', '271')
+
+PULID_SLOTS = {
+    'image': Slot('54', 'image'),
+    'resolution': Slot('70', 'ratio_selected'),
+    'prompt': Slot('6', 'text'),
+    'loras': Slot('73', None),
+    'seed': Slot('25', 'noise_seed'),
+}
+
+REDUX_SLOTS = {
+    'image1': Slot('40', 'image'),
+    'image2': Slot('46', 'image'),
+    'strength1': Slot('53', 'conditioning_to_strength'),
+    'strength2': Slot('44', 'conditioning_to_strength'),
+    'resolution': Slot('49', 'ratio_selected'),
+    'seed': Slot('25', 'noise_seed'),
+}
+
+REDUXPROMPT_SLOTS = {
+    'image': Slot('40', 'image'),
+    'prompt': Slot('6', 'text'),
+    'strength': Slot('54', 'image_strength'),
+    'seed': Slot('25', 'noise_seed'),
+    'resolution': Slot('62', 'ratio_selected'),
+}
+REDUXPROMPT_REQUIRED = ('40',)
+
+def validate_nodes(workflow: Mapping, required_nodes: Iterable[str] = ()):
+    """Check that workflow is a ComfyUI API-format graph with the given nodes; raises ValueError."""
+    if not isinstance(workflow, Mapping):
+        raise ValueError("Workflow must be a dictionary")
+
+    missing_nodes = [node for node in required_nodes if node not in workflow]
+    if missing_nodes:
+        raise ValueError(f"Missing required nodes in workflow: {missing_nodes}")
+
+    for node_id, node in workflow.items():
+        if not isinstance(node, Mapping):
+            raise ValueError(f"Node {node_id} must be a dictionary")
+        if 'inputs' not in node:
+            raise ValueError(f"Node {node_id} is missing 'inputs' field")
+        if not isinstance(node.get('inputs'), Mapping):
+            raise ValueError(f"Node {node_id} 'inputs' must be a dictionary")
+        if 'class_type' not in node:
+            raise ValueError(f"Node {node_id} is missing 'class_type' field")
+
+class CompiledTemplate:
+    def __init__(self, name: str, nodes: Mapping, slots: Dict[str, Slot]):
+        self.name = name
+        self.nodes = nodes
+        self.slots = slots
+
+    def __contains__(self, slot_name: str) -> bool:
+        return slot_name in self.slots
+
+    def instantiate(self, **values: Any) -> dict:
+        """
+        A workflow with each named slot set to its value. Slots the
+        template doesn't have are skipped. A LoRA slot takes a list of
+        lora_N input dicts and replaces the node's existing ones.
+        """
+        workflow = dict(self.nodes)
+        copied: Dict[str, dict] = {}
+        for name, value in values.items():
+            slot = self.slots.get(name)
+            if slot is None:
+                continue
+            inputs = copied.get(slot.node)
+            if inputs is None:
+                node = dict(workflow[slot.node])
+                inputs = dict(node['inputs'])
+                node['inputs'] = inputs
+                workflow[slot.node] = node
+                copied[slot.node] = inputs
+            if slot.is_loras:
+                for key in [key for key in inputs if key.startswith('lora_')]:
+                    del inputs[key]
+                for index, entry in enumerate(value, start=1):
+                    inputs[f'lora_{index}'] = entry
+            else:
+                inputs[slot.input] = value
+        return workflow
+
+def compile_template(workflow: Mapping, slots: Dict[str, Slot], required_nodes: Iterable[str] = (),
+                     name: str = 'workflow') -> CompiledTemplate:
+    """Validate workflow once and keep the slots it has; missing optional nodes are logged here, not per request."""
+    validate_nodes(workflow, required_nodes)
+    present = {}
+    for slot_name, slot in slots.items():
+        if slot.node in workflow:
+            present[slot_name] = slot
+        else:
+            logger.warning(f"Node {slot.node} ({slot_name}) not found in {name}")
+    logger.debug(f"Compiled {name}: {len(workflow)} nodes, slots {', '.join(present)}")
+    return CompiledTemplate(name, workflow, present)
+
+# (filename, id of slot map) -> (snapshot it was compiled from, CompiledTemplate)
+_compiled: Dict[tuple, tuple] = {}
+
+def get_template(filename: str, slots: Dict[str, Slot], required_nodes: Iterable[str] = ()) -> CompiledTemplate:
+    """The compiled template for a workflow file, recompiled when load_json_snapshot sees the file change."""
+    snapshot = load_json_snapshot(filename)
+    key = (filename, id(slots))
+    cached = _compiled.get(key)
+    if cached is not None and cached[0] is snapshot:
+        return cached[1]
+    template = compile_template(snapshot, slots, required_nodes, filename)
+    _compiled[key] = (snapshot, template)
+    return template
@@ -0,0 +1,224 @@
+"""
+End-to-end throughput benchmark for the image pipeline.
+
+Starts the fake ComfyUI server and the bot's real web server, then has N
+simulated users submit /comfy requests through process_image_request.
+Each job goes through the real queue, a real comfygen.py runner process
+and the real /update_progress and /send_image handlers. Discord is
+replaced by benchmarks.fake_discord.
+
+Reports jobs per minute, p50/p95/p99 end-to-end latency and the bot
+process's CPU time and RSS. Run from the repository root:
+
+    python -m benchmarks.e2e_throughput --users 8 --jobs-per-user 5
+
+History, stored images and traces go to a temporary directory, not the
+bot's real database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks.fixtures import prepare_environment
+
+# The bot reads its settings at import time, so point everything at local,
+# throwaway resources before anything from the bot is imported
+WORK_DIR = tempfile.mkdtemp(prefix='fluxbot-bench-')
+prepare_environment(WORK_DIR, {'server_address': '127.0.0.1', 'BOT_SERVER': '127.0.0.1'})
+
+from benchmarks.fake_comfyui import FakeComfyUI, add_arguments, config_from_args
+from benchmarks.fake_discord import FakeBot, FakeDiscordConfig
+
+PROMPT = 'a lighthouse on a cliff at dusk, volumetric fog, 35mm photo'
+RESOLUTION = '1:1 [1024x1024 square]'
+
+@dataclass
+class JobResult:
+    user: int
+    latency: float
+    outcome: str  # image, error, timeout or rejected
+    edits: int = 0
+    attachment_bytes: int = 0
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of a list of floats."""
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def current_rss() -> Optional[int]:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def peak_rss(samples: List[int]) -> int:
+    if resource is None:
+        return max(samples, default=0)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class ResourceSampler:
+    """Samples the bot process's RSS while the benchmark runs."""
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.samples: List[int] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            rss = current_rss()
+            if rss is not None:
+                self.samples.append(rss)
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+async def run_job(bot: FakeBot, user_index: int, user, timeout: float) -> JobResult:
+    from Main.custom_commands.image_processing import process_image_request
+
+    interaction = bot.new_interaction(user)
+    started = time.perf_counter()
+    await process_image_request(interaction, PROMPT, RESOLUTION, upscale_factor=1)
+    message = interaction.status_message
+    if message is None:
+        return JobResult(user_index, time.perf_counter() - started, 'rejected')
+    try:
+        await asyncio.wait_for(message.finished.wait(), timeout)
+        outcome = message.outcome
+    except asyncio.TimeoutError:
+        outcome = 'timeout'
+    return JobResult(user_index, time.perf_counter() - started, outcome, message.edits, message.attachment_bytes)
+
+async def run_user(bot: FakeBot, user_index: int, jobs: int, timeout: float) -> List[JobResult]:
+    user = bot.add_user(f'bench-user-{user_index}')
+    return [await run_job(bot, user_index, user, timeout) for _ in range(jobs)]
+
+async def run_benchmark(args) -> dict:
+    from web_server import start_web_server
+    from Main.database import init_db
+
+    init_db()
+    comfy = None
+    if not args.external_comfyui:
+        comfy = FakeComfyUI(config_from_args(args))
+        await comfy.start(port=8188)
+
+    bot = FakeBot(FakeDiscordConfig(
+        api_latency=args.api_latency,
+        upload_bandwidth=args.upload_mbps * 1024 * 1024 / 8
+    ))
+    await start_web_server(bot)
+    dispatcher = asyncio.create_task(bot.process_subprocess_queue())
+
+    try:
+        if args.warmup:
+            await run_user(bot, -1, args.warmup, args.timeout)
+
+        sampler = ResourceSampler()
+        cpu_start = time.process_time()
+        sampler.start()
+        wall_start = time.perf_counter()
+
+        per_user = await asyncio.gather(*(
+            run_user(bot, index, args.jobs_per_user, args.timeout) for index in range(args.users)
+        ))
+
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        await sampler.stop()
+    finally:
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+        if comfy:
+            await comfy.stop()
+
+    results = [result for user_results in per_user for result in user_results]
+    latencies = [result.latency for result in results if result.outcome == 'image']
+    return {
+        'users': args.users,
+        'jobs': len(results),
+        'succeeded': len(latencies),
+        'failed': sum(1 for result in results if result.outcome == 'error'),
+        'timed_out': sum(1 for result in results if result.outcome == 'timeout'),
+        'rejected': sum(1 for result in results if result.outcome == 'rejected'),
+        'wall_seconds': round(wall, 3),
+        'jobs_per_minute': round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        'latency_p50': round(percentile(latencies, 50), 3),
+        'latency_p95': round(percentile(latencies, 95), 3),
+        'latency_p99': round(percentile(latencies, 99), 3),
+        'latency_mean': round(statistics.fmean(latencies), 3) if latencies else float('nan'),
+        'bot_cpu_seconds': round(cpu, 3),
+        'bot_cpu_percent': round(cpu / wall * 100, 1) if wall else 0.0,
+        'bot_rss_peak_mb': round(peak_rss(sampler.samples) / (1024 * 1024), 1),
+        'bot_rss_mean_mb': round(statistics.fmean(sampler.samples) / (1024 * 1024), 1) if sampler.samples else None,
+        'work_dir': WORK_DIR,
+        'jobs_detail': [asdict(result) for result in results] if args.detail else None
+    }
+
+def print_report(report: dict):
+    print(f"Users: {report['users']}  Jobs: {report['jobs']}  "
+          f"ok={report['succeeded']} error={report['failed']} "
+          f"timeout={report['timed_out']} rejected={report['rejected']}")
+    print(f"Wall time: {report['wall_seconds']}s  Throughput: {report['jobs_per_minute']} jobs/min")
+    print(f"Latency p50={report['latency_p50']}s p95={report['latency_p95']}s "
+          f"p99={report['latency_p99']}s mean={report['latency_mean']}s")
+    print(f"Bot CPU: {report['bot_cpu_seconds']}s ({report['bot_cpu_percent']}% of one core)")
+    print(f"Bot RSS: peak {report['bot_rss_peak_mb']} MB, mean {report['bot_rss_mean_mb']} MB"
+          + ('' if psutil else ' (psutil not installed, sampled from /proc)'))
+    print(f"Artifacts: {report['work_dir']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end throughput benchmark against fake ComfyUI and Discord')
+    parser.add_argument('--users', type=int, default=4, help='Concurrent simulated users')
+    parser.add_argument('--jobs-per-user', type=int, default=5, help='Sequential jobs each user submits')
+    parser.add_argument('--warmup', type=int, default=1, help='Jobs run before measuring')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Seconds before a job counts as timed out')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='Simulated Discord REST latency in seconds')
+    parser.add_argument('--upload-mbps', type=float, default=100.0, help='Simulated Discord upload bandwidth')
+    parser.add_argument('--external-comfyui', action='store_true',
+                        help='Use a fake ComfyUI already listening on 127.0.0.1:8188')
+    parser.add_argument('--json', help='Also write the report to this file')
+    parser.add_argument('--detail', action='store_true', help='Include per-job results in the JSON report')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+Local stand-in for a ComfyUI server, for load-testing the bot without a GPU.
+
+Implements the parts of the ComfyUI API that comfygen.py uses:
+POST /prompt, GET /ws, GET /history/{prompt_id}, GET /view, GET /queue
+and POST /interrupt. Jobs run on a fixed number of "GPU" slots with
+configurable model-load and per-step timing, and failures can be injected
+either when queueing or during execution.
+
+Run standalone with:
+    python -m benchmarks.fake_comfyui --steps 20 --step-time 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import struct
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web, WSMsgType
+
+logger = logging.getLogger(__name__)
+
+# Node id the fake SaveImage output is reported under
+OUTPUT_NODE_ID = '9'
+
+def make_png(width: int, height: int, seed: int = 0) -> bytes:
+    """
+    Build an RGB PNG filled with noise. Noise does not compress, so the
+    file is about width * height * 3 bytes, like a real render would be.
+    """
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b''))
+
+@dataclass
+class FakeComfyConfig:
+    """Timing and failure knobs for the fake server"""
+    steps: int = 20
+    step_time: float = 0.05
+    load_time: float = 0.2
+    slots: int = 1
+    failure_rate: float = 0.0  # Chance a job fails with execution_error
+    queue_failure_rate: float = 0.0  # Chance POST /prompt returns 500
+    image_width: int = 1024
+    image_height: int = 1024
+    seed: Optional[int] = None
+
+@dataclass
+class FakeJob:
+    prompt_id: str
+    number: int
+    client_id: str
+    workflow: dict
+    queued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    status: str = 'pending'  # pending, running, success, error, interrupted
+    outputs: Dict[str, dict] = field(default_factory=dict)
+
+class FakeComfyUI:
+    def __init__(self, config: Optional[FakeComfyConfig] = None):
+        self.config = config or FakeComfyConfig()
+        self.rng = random.Random(self.config.seed)
+        self.image = make_png(self.config.image_width, self.config.image_height, self.config.seed or 0)
+        self.jobs: Dict[str, FakeJob] = {}
+        self.pending: asyncio.Queue = asyncio.Queue()
+        self.running: Set[str] = set()
+        self.sockets: Dict[str, Set[web.WebSocketResponse]] = {}
+        self.interrupted = False
+        self.counter = 0
+        self.workers: List[asyncio.Task] = []
+        self.runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post('/prompt', self.handle_prompt)
+        self.app.router.add_get('/ws', self.handle_ws)
+        self.app.router.add_get('/history/{prompt_id}', self.handle_history)
+        self.app.router.add_get('/view', self.handle_view)
+        self.app.router.add_get('/queue', self.handle_queue)
+        self.app.router.add_post('/interrupt', self.handle_interrupt)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8188):
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(max(1, self.config.slots))]
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host=host, port=port).start()
+        logger.info(f"Fake ComfyUI listening on {host}:{port} with {len(self.workers)} slot(s)")
+
+    async def stop(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def send(self, client_id: str, message: dict):
+        for ws in list(self.sockets.get(client_id, ())):
+            try:
+                await ws.send_str(json.dumps(message))
+            except ConnectionError:
+                self.sockets[client_id].discard(ws)
+
+    async def handle_prompt(self, request: web.Request) -> web.Response:
+        if self.rng.random() < self.config.queue_failure_rate:
+            return web.json_response({'error': 'Injected queue failure', 'node_errors': {}}, status=500)
+        data = await request.json()
+        if not isinstance(data.get('prompt'), dict):
+            return web.json_response({'error': 'Invalid prompt', 'node_errors': {}}, status=400)
+
+        self.counter += 1
+        job = FakeJob(str(uuid.uuid4()), self.counter, data.get('client_id', ''), data['prompt'])
+        self.jobs[job.prompt_id] = job
+        await self.pending.put(job)
+        return web.json_response({'prompt_id': job.prompt_id, 'number': job.number, 'node_errors': {}})
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        client_id = request.query.get('clientId') or str(uuid.uuid4())
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.setdefault(client_id, set()).add(ws)
+        await ws.send_str(json.dumps({
+            'type': 'status',
+            'data': {'status': {'exec_info': {'queue_remaining': self.pending.qsize()}}, 'sid': client_id}
+        }))
+        try:
+            async for msg in ws:
+                # The runner only ever sends clear_cache, which needs no reply
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.sockets.get(client_id, set()).discard(ws)
+        return ws
+
+    async def handle_history(self, request: web.Request) -> web.Response:
+        job = self.jobs.get(request.match_info['prompt_id'])
+        if job is None or job.status in ('pending', 'running'):
+            return web.json_response({})
+        return web.json_response({job.prompt_id: {
+            'prompt': [job.number, job.prompt_id, job.workflow, {}, [OUTPUT_NODE_ID]],
+            'outputs': job.outputs,
+            'status': {'status_str': job.status, 'completed': job.status == 'success'}
+        }})
+
+    async def handle_view(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.image, content_type='image/png')
+
+    async def handle_queue(self, request: web.Request) -> web.Response:
+        def entry(job: FakeJob):
+            return [job.number, job.prompt_id, {}, {}, [OUTPUT_NODE_ID]]
+        running = [entry(self.jobs[prompt_id]) for prompt_id in self.running]
+        pending = [entry(job) for job in self.jobs.values() if job.status == 'pending']
+        return web.json_response({'queue_running': running, 'queue_pending': pending})
+
+    async def handle_interrupt(self, request: web.Request) -> web.Response:
+        self.interrupted = True
+        return web.Response(text='')
+
+    async def worker(self):
+        while True:
+            job = await self.pending.get()
+            try:
+                await self.run_job(job)
+            except Exception as e:
+                logger.error(f"Fake job {job.prompt_id} crashed: {str(e)}")
+                job.status = 'error'
+            finally:
+                self.running.discard(job.prompt_id)
+                job.finished_at = time.monotonic()
+                # ComfyUI always closes a prompt with executing/node=None
+                await self.send(job.client_id, {
+                    'type': 'executing',
+                    'data': {'node': None, 'prompt_id': job.prompt_id}
+                })
+
+    async def run_job(self, job: FakeJob):
+        job.status = 'running'
+        job.started_at = time.monotonic()
+        self.running.add(job.prompt_id)
+        self.interrupted = False
+        await self.send(job.client_id, {'type': 'execution_start', 'data': {'prompt_id': job.prompt_id}})
+
+        await self.send(job.client_id, {'type': 'executing', 'data': {'node': 'UNETLoader', 'prompt_id': job.prompt_id}})
+        await asyncio.sleep(self.config.load_time)
+
+        fail_at = None
+        if self.rng.random() < self.config.failure_rate:
+            fail_at = self.rng.randint(1, max(1, self.config.steps))
+
+        for step in range(1, self.config.steps + 1):
+            await asyncio.sleep(self.config.step_time)
+            if self.interrupted:
+                job.status = 'interrupted'
+                await self.send(job.client_id, {'type': 'execution_interrupted', 'data': {'prompt_id': job.prompt_id}})
+                return
+            if step == fail_at:
+                job.status = 'error'
+                await self.send(job.client_id, {'type': 'execution_error', 'data': {
+                    'prompt_id': job.prompt_id,
+                    'exception_message': 'Injected failure'
+                }})
+                return
+            await self.send(job.client_id, {'type': 'progress', 'data': {
+                'value': step, 'max': self.config.steps, 'prompt_id': job.prompt_id
+            }})
+
+        job.outputs = {OUTPUT_NODE_ID: {'images': [{
+            'filename': f'ComfyUI_{job.number:05d}_.png',
+            'subfolder': '',
+            'type': 'output'
+        }]}}
+        job.status = 'success'
+        await self.send(job.client_id, {'type': 'executed', 'data': {
+            'node': OUTPUT_NODE_ID, 'output': job.outputs[OUTPUT_NODE_ID], 'prompt_id': job.prompt_id
+        }})
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--steps', type=int, default=20, help='Sampler steps per job')
+    parser.add_argument('--step-time', type=float, default=0.05, help='Seconds per step')
+    parser.add_argument('--load-time', type=float, default=0.2, help='Seconds of model loading per job')
+    parser.add_argument('--slots', type=int, default=1, help='Jobs executed concurrently')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Chance a job fails mid-run')
+    parser.add_argument('--queue-failure-rate', type=float, default=0.0, help='Chance POST /prompt fails')
+    parser.add_argument('--image-size', default='1024x1024', help='Output image size, WIDTHxHEIGHT')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for failure injection and image noise')
+
+def config_from_args(args) -> FakeComfyConfig:
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    return FakeComfyConfig(
+        steps=args.steps,
+        step_time=args.step_time,
+        load_time=args.load_time,
+        slots=args.slots,
+        failure_rate=args.failure_rate,
+        queue_failure_rate=args.queue_failure_rate,
+        image_width=width,
+        image_height=height,
+        seed=args.seed
+    )
+
+async def serve(config: FakeComfyConfig, host: str, port: int):
+    server = FakeComfyUI(config)
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake ComfyUI server for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8188)
+    add_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(serve(config_from_args(args), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+In-process stand-ins for the Discord objects the image pipeline touches.
+
+FakeInteraction can be passed to process_image_request, and FakeBot can be
+handed to start_web_server so the real /update_progress and /send_image
+handlers run against fake channels and messages. FakeBot reuses MyBot's
+queue dispatch, so jobs are launched through the real comfygen.py runner.
+Every simulated REST call sleeps for api_latency, and attachments also
+sleep in proportion to their size to model the upload. Modals are not
+simulated, so drivers call process_image_request directly; a send_modal
+call fails with AttributeError.
+"""
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from Main.custom_commands.message_constants import STATUS_MESSAGES
+from Main.request_queue import RequestQueue
+from Main.utils import load_json
+
+_ids = itertools.count(10 ** 17)
+
+def next_id() -> int:
+    """Snowflake-sized ids so int()/str() round trips behave like Discord's."""
+    return next(_ids)
+
+@dataclass
+class FakeDiscordConfig:
+    api_latency: float = 0.05  # Seconds per simulated REST call
+    upload_bandwidth: float = 20 * 1024 * 1024  # Bytes per second for attachments
+    lora_selection: List[str] = field(default_factory=list)  # Files picked in LoRAView
+
+class FakeColor:
+    def __init__(self, value: int = 0):
+        self.value = value
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.display_name = name
+        self.name = name
+        self.color = FakeColor(0)
+        self.roles = []
+        self.guild_permissions = None
+
+class FakeMessage:
+    def __init__(self, channel: 'FakeChannel', content: Optional[str] = None, ephemeral: bool = False):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        self.ephemeral = ephemeral
+        self.created = time.perf_counter()
+        self.edits = 0
+        self.attachment_bytes = 0
+        self.outcome: Optional[str] = None  # 'image' or 'error' once the job is final
+        self.finished = asyncio.Event()
+
+    async def edit(self, content=None, embed=None, attachments=None, view=None, **kwargs):
+        config = self.channel.config
+        await asyncio.sleep(config.api_latency)
+        self.edits += 1
+        self.content = content
+        if attachments:
+            size = sum(_attachment_size(attachment) for attachment in attachments)
+            await asyncio.sleep(size / config.upload_bandwidth)
+            self.attachment_bytes = size
+            self.finish('image')
+        elif content and content.startswith(STATUS_MESSAGES['error']['emoji']):
+            self.finish('error')
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.config.api_latency)
+        self.channel.messages.pop(self.id, None)
+
+    def finish(self, outcome: str):
+        if self.outcome is None:
+            self.outcome = outcome
+            self.finished.set()
+
+def _attachment_size(attachment) -> int:
+    fp = getattr(attachment, 'fp', None)
+    if fp is None:
+        return 0
+    position = fp.tell()
+    fp.seek(0, 2)
+    size = fp.tell()
+    fp.seek(position)
+    return size
+
+class FakeGuild:
+    def __init__(self, bot: 'FakeBot'):
+        self.id = next_id()
+        self.bot = bot
+
+    async def fetch_member(self, user_id: int) -> FakeUser:
+        await asyncio.sleep(self.bot.config.api_latency)
+        return self.bot.users[int(user_id)]
+
+class FakeChannel:
+    def __init__(self, bot: 'FakeBot'):
+        self.id = next_id()
+        self.bot = bot
+        self.config = bot.config
+        self.guild = bot.guild
+        self.messages: Dict[int, FakeMessage] = {}
+
+    async def send(self, content=None, ephemeral: bool = False, **kwargs) -> FakeMessage:
+        await asyncio.sleep(self.config.api_latency)
+        message = FakeMessage(self, content, ephemeral)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await asyncio.sleep(self.config.api_latency)
+        return self.messages[int(message_id)]
+
+class FakeResponse:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, ephemeral: bool = False, **kwargs):
+        await asyncio.sleep(self.interaction.client.config.api_latency)
+        self._done = True
+
+    async def send_message(self, content=None, ephemeral: bool = False, **kwargs):
+        await asyncio.sleep(self.interaction.client.config.api_latency)
+        self._done = True
+        self.interaction.notices.append(content)
+
+class FakeFollowup:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+
+    async def send(self, content=None, view=None, ephemeral: bool = False, **kwargs) -> FakeMessage:
+        message = await self.interaction.channel.send(content, ephemeral=ephemeral)
+        if not ephemeral:
+            self.interaction.public_messages.append(message)
+        else:
+            self.interaction.notices.append(content)
+        if view is not None and hasattr(view, 'has_confirmed'):
+            # Simulate the user confirming the LoRA picker straight away
+            view.selected_loras = list(self.interaction.client.config.lora_selection)
+            view.has_confirmed = True
+            view.stop()
+        return message
+
+class FakeInteraction:
+    def __init__(self, bot: 'FakeBot', user: FakeUser, channel: FakeChannel):
+        self.id = next_id()
+        self.client = bot
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = bot.guild
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.public_messages: List[FakeMessage] = []
+        self.notices: List[str] = []
+
+    @property
+    def status_message(self) -> Optional[FakeMessage]:
+        """The public "Starting generation" message the bot later edits."""
+        return self.public_messages[-1] if self.public_messages else None
+
+class FakeBot:
+    """
+    Enough of MyBot for the request pipeline: the subprocess queue,
+    pending requests, and the fetch/add_view calls the web handlers make.
+    """
+    def __init__(self, config: Optional[FakeDiscordConfig] = None):
+        # Imported lazily: importing bot.py constructs the real client
+        from bot import MyBot
+        self._dispatch = MyBot.process_subprocess_queue
+        self._redux = MyBot.process_redux_request
+        self._python = MyBot.get_python_command
+
+        self.config = config or FakeDiscordConfig()
+        self.subprocess_queue = RequestQueue()
+        self.pending_requests = {}
+        self.ai_provider = None
+        self.lora_options = load_json('lora.json')['available_loras']
+        self.resolution_options = list(load_json('ratios.json')['ratios'].keys())
+        self.guild = FakeGuild(self)
+        self.users: Dict[int, FakeUser] = {}
+        self.channel = FakeChannel(self)
+        self.allowed_channels = {self.channel.id}
+        self.views = 0
+
+    def get_python_command(self):
+        return self._python(self)
+
+    async def process_redux_request(self, request_id, request_item):
+        return await self._redux(self, request_id, request_item)
+
+    async def process_subprocess_queue(self):
+        return await self._dispatch(self)
+
+    def add_user(self, name: str) -> FakeUser:
+        user = FakeUser(next_id(), name)
+        self.users[user.id] = user
+        return user
+
+    def new_interaction(self, user: FakeUser) -> FakeInteraction:
+        return FakeInteraction(self, user, self.channel)
+
+    async def fetch_user(self, user_id: int) -> FakeUser:
+        await asyncio.sleep(self.config.api_latency)
+        return self.users[int(user_id)]
+
+    async def fetch_channel(self, channel_id: int) -> FakeChannel:
+        await asyncio.sleep(self.config.api_latency)
+        return self.channel
+
+    def add_view(self, view, message_id: Optional[int] = None):
+        self.views += 1
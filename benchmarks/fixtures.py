@@ -0,0 +1,180 @@
+"""
+Shared setup for the benchmarks: bot settings for a sandboxed run and
+realistic, deterministic fixtures built once and cached on disk.
+
+Fixtures live in benchmarks/.cache/<FIXTURE_VERSION>/ laid out like the
+repository root (Main/Datasets/*.json plus image_history.db), so the
+bot's cwd-relative file lookups work after chdir-ing into it.
+"""
+import json
+import os
+import random
+import shutil
+import sqlite3
+import string
+import time
+from typing import Dict, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(REPO_ROOT, 'benchmarks', '.cache')
+
+# Bump when a generator below changes so stale caches are rebuilt
+FIXTURE_VERSION = 'fixtures-v5'
+
+LORA_COUNT = 1000
+BANNED_WORD_COUNT = 5000
+HISTORY_ROWS = 1_000_000
+
+PROMPT_WORDS = (
+    'portrait landscape cinematic lighting volumetric fog neon city night rain '
+    'forest mountain lake sunset golden hour studio photo 35mm film grain '
+    'watercolor oil painting concept art octane render highly detailed '
+    'cyberpunk fantasy castle dragon astronaut ocean storm lighthouse cliff '
+    'macro flower insect dew bokeh street market crowd vintage car desert'
+).split()
+
+def prepare_environment(work_dir: str, overrides: Optional[Dict[str, str]] = None):
+    """
+    Give the bot's import-time settings placeholder values and point its
+    database, image store and trace file into work_dir.
+    Must run before anything from the bot is imported.
+    """
+    for key, value in {
+        'DISCORD_TOKEN': 'benchmark',
+        'COMMAND_PREFIX': '/',
+        'CHANNEL_IDS': '0',
+        'ALLOWED_SERVERS': '0',
+        'BOT_MANAGER_ROLE_ID': '0',
+        'fluxversion': 'FluxDev24GB.json',
+        'PULIDWORKFLOW': 'PulidFluxDev.json',
+        'ENABLE_PROMPT_ENHANCEMENT': 'false',
+    }.items():
+        os.environ.setdefault(key, value)
+    os.environ.update({
+        'IMAGE_HISTORY_DB': os.path.join(work_dir, 'image_history.db'),
+        'IMAGE_STORE_DIR': os.path.join(work_dir, 'images'),
+        'TRACE_FILE': os.path.join(work_dir, 'traces.jsonl'),
+    })
+    if overrides:
+        os.environ.update(overrides)
+
+def fixture_dir() -> str:
+    return os.path.join(CACHE_DIR, FIXTURE_VERSION)
+
+def make_prompt(rng: random.Random) -> str:
+    return ', '.join(rng.choice(PROMPT_WORDS) for _ in range(rng.randint(6, 18)))
+
+def make_lora_config(rng: random.Random, count: int = LORA_COUNT) -> dict:
+    """The real lora.json entries followed by synthetic ones up to count."""
+    with open(os.path.join(REPO_ROOT, 'Main', 'Datasets', 'lora.json'), encoding='utf-8') as f:
+        config = json.load(f)
+    loras = list(config['available_loras'])
+    while len(loras) < count:
+        index = len(loras)
+        name = f"{rng.choice(PROMPT_WORDS).title()}Style-FLUX-v{rng.randint(1, 9)}.{rng.randint(0, 9)}-{index}"
+        loras.append({
+            'file': f'{name}.safetensors',
+            'name': name,
+            'weight': round(rng.uniform(0.4, 1.2), 2),
+            'add_prompt': f'{rng.choice(PROMPT_WORDS)}{index}',
+            'url': f'https://civitai.com/models/{100000 + index}?modelVersionId={900000 + index}',
+            'is_active': True
+        })
+    config['available_loras'] = loras[:count]
+    return config
+
+def make_banned_words(rng: random.Random, count: int = BANNED_WORD_COUNT) -> list:
+    """The shipped banned list padded with pronounceable pseudo-words."""
+    with open(os.path.join(REPO_ROOT, 'Main', 'banned.json'), encoding='utf-8') as f:
+        words = set(json.load(f))
+    consonants = 'bcdfghjklmnprstvwz'
+    vowels = 'aeiou'
+    while len(words) < count:
+        length = rng.randint(2, 5)
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(length)))
+    return sorted(words)
+
+def build_history_db(path: str, rng: random.Random, lora_files: list, resolutions: list,
+                     banned_words: list, rows: int = HISTORY_ROWS):
+    """Create image_history.db with the bot's schema and `rows` history rows."""
+    from Main import database
+
+    previous = database.DB_NAME
+    database.DB_NAME = path
+    try:
+        database.init_db()
+    finally:
+        database.DB_NAME = previous
+
+    now = int(time.time())
+    two_years = 2 * 365 * 24 * 3600
+    hex_digits = string.hexdigits[:16]
+
+    def history_rows():
+        for _ in range(rows):
+            loras = rng.sample(lora_files, rng.randint(0, 3))
+            yield (
+                f'{rng.getrandbits(128):032x}',
+                str(rng.randint(10 ** 17, 10 ** 17 + 5000)),
+                make_prompt(rng),
+                'null',
+                ''.join(rng.choice(hex_digits) for _ in range(64)) + '.png',
+                rng.choice(resolutions),
+                time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.randint(0, two_years))),
+                json.dumps(loras),
+                rng.choice((1, 1, 1, 2, 4))
+            )
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.executemany("INSERT OR IGNORE INTO banned_words (word) VALUES (?)", ((word,) for word in banned_words))
+        conn.executemany(
+            "INSERT INTO image_history (request_id, user_id, prompt, workflow, image_filename, resolution, timestamp, loras, upscale_factor) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            history_rows()
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    # init_db built the banned-word matcher before the padded list was inserted
+    database._banned_matcher = None
+
+def ensure_fixtures(history_rows: int = HISTORY_ROWS, rebuild: bool = False) -> str:
+    """Build the fixture tree if it is missing and return its path."""
+    root = fixture_dir()
+    marker = os.path.join(root, 'READY')
+    if os.path.exists(marker) and not rebuild:
+        with open(marker, encoding='utf-8') as f:
+            if json.load(f).get('history_rows') == history_rows:
+                return root
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    datasets = os.path.join(root, 'Main', 'Datasets')
+    os.makedirs(datasets)
+
+    source = os.path.join(REPO_ROOT, 'Main', 'Datasets')
+    for name in os.listdir(source):
+        if name.endswith('.json') and name != 'lora.json':
+            shutil.copy(os.path.join(source, name), datasets)
+
+    rng = random.Random(1234)
+    lora_config = make_lora_config(rng)
+    with open(os.path.join(datasets, 'lora.json'), 'w', encoding='utf-8') as f:
+        json.dump(lora_config, f, indent=2)
+
+    with open(os.path.join(datasets, 'ratios.json'), encoding='utf-8') as f:
+        resolutions = list(json.load(f)['ratios'].keys())
+
+    print(f"Building fixture database with {history_rows:,} history rows (cached in {root})...")
+    started = time.perf_counter()
+    build_history_db(
+        os.path.join(root, 'image_history.db'), rng,
+        [lora['file'] for lora in lora_config['available_loras']],
+        resolutions, make_banned_words(rng), history_rows
+    )
+    print(f"Fixture database built in {time.perf_counter() - started:.1f}s")
+
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump({'history_rows': history_rows}, f)
+    return root
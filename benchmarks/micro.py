@@ -0,0 +1,486 @@
+"""
+Micro-benchmarks for the functions every image request runs through.
+
+Fixtures mirror a busy deployment: the real workflow templates, a
+lora.json with 1,000 entries, 5,000 banned words and a history table with
+1,000,000 rows (built once, cached in benchmarks/.cache).
+
+    python -m benchmarks.micro                  # run and compare to the baseline
+    python -m benchmarks.micro --save-baseline  # record a new baseline
+    python -m benchmarks.micro -k workflow      # only matching benchmarks
+
+A benchmark whose median is more than --threshold slower than its
+baseline is reported as a regression and makes the run exit with status 1.
+The committed baseline, benchmarks/baselines/micro.json, records the
+machine it was measured on. Timings don't carry across machines, so
+record your own with --save-baseline on a clean checkout before comparing
+a change. Benchmarks missing from the baseline (those needing discord.py
+when it was recorded) show as new, and --save-baseline adds them.
+Correctness checks run first, since a fast matcher that misses banned
+words is no use; a failed check also exits with status 1.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import timeit
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.fixtures import REPO_ROOT, HISTORY_ROWS, ensure_fixtures, fixture_dir, make_prompt, prepare_environment
+
+BASELINE_FILE = os.path.join(REPO_ROOT, 'benchmarks', 'baselines', 'micro.json')
+
+PROMPT = ('a lighthouse on a rocky cliff at dusk, volumetric fog, crashing waves, '
+          'cinematic lighting, 35mm film grain, highly detailed')
+RESOLUTION = '1:1 [1024x1024 square]'
+
+# A factory returns the function to time and an optional teardown
+Factory = Callable[[], Tuple[Callable[[], object], Optional[Callable[[], None]]]]
+
+@dataclass
+class Benchmark:
+    name: str
+    factory: Factory
+    # Module that must be importable; Main.custom_commands imports discord in its __init__
+    requires: Optional[str] = None
+    # (count, unit) processed per call, reported as a throughput next to the time
+    per_call: Optional[Tuple[int, str]] = None
+
+BENCHMARKS: List[Benchmark] = []
+# (name, function returning a list of problems) run before any timing
+CHECKS: List[Tuple[str, Callable[[], List[str]]]] = []
+
+def benchmark(name: str, requires: Optional[str] = None, per_call: Optional[Tuple[int, str]] = None):
+    def register(factory: Factory) -> Factory:
+        BENCHMARKS.append(Benchmark(name, factory, requires, per_call))
+        return factory
+    return register
+
+def check(name: str):
+    def register(func: Callable[[], List[str]]) -> Callable[[], List[str]]:
+        CHECKS.append((name, func))
+        return func
+    return register
+
+def fixture_loras(count: int = 3) -> List[str]:
+    from Main.utils import load_json
+    return [lora['file'] for lora in load_json('lora.json')['available_loras'][-count:]]
+
+@benchmark('utils.load_json lora.json (1,000 LoRAs)')
+def bench_load_lora_json():
+    from Main.utils import load_json
+    return (lambda: load_json('lora.json')), None
+
+@benchmark('utils.load_json workflow template')
+def bench_load_workflow_json():
+    from Main.utils import load_json
+    return (lambda: load_json('FluxDev24GB.json')), None
+
+@benchmark('utils.load_json_snapshot lora.json (1,000 LoRAs)')
+def bench_load_lora_snapshot():
+    from Main.utils import load_json_snapshot
+    return (lambda: load_json_snapshot('lora.json')), None
+
+@benchmark('utils.load_json lora.json uncached (1,000 LoRAs)')
+def bench_load_lora_json_uncached():
+    # What every call cost before the cache: find, read and parse the file
+    from Main.utils import load_json, invalidate_json
+    return (lambda: (invalidate_json('lora.json'), load_json('lora.json'))), None
+
+@benchmark('workflow_utils.update_workflow', requires='discord')
+def bench_update_workflow():
+    from Main.custom_commands.workflow_utils import update_workflow
+    loras = fixture_loras()
+    return (lambda: update_workflow('FluxDev24GB.json', PROMPT, RESOLUTION, loras, 2, 1234567)), None
+
+@benchmark('workflow template deep copy via JSON round trip (before templates)')
+def bench_workflow_deep_copy():
+    # What update_pulid_workflow and the runner did to every workflow before filling it in
+    import json
+    from Main.utils import load_json
+    template = load_json('FluxDev24GB.json')
+    return (lambda: json.loads(json.dumps(template))), None
+
+@benchmark('workflow_templates.instantiate FluxDev24GB (copy-on-write)')
+def bench_workflow_instantiate():
+    from Main.workflow_templates import get_template, STANDARD_SLOTS, STANDARD_REQUIRED
+    template = get_template('FluxDev24GB.json', STANDARD_SLOTS, STANDARD_REQUIRED)
+    entries = [{'on': True, 'lora': lora, 'strength': 0.5} for lora in fixture_loras()]
+    return (lambda: template.instantiate(prompt=PROMPT, resolution=RESOLUTION, loras=entries,
+                                         upscale_factor=2, seed=1234567, guidance=3.5)), None
+
+@benchmark('workflow_utils.update_pulid_workflow', requires='discord')
+def bench_update_pulid_workflow():
+    from Main.custom_commands.workflow_utils import update_pulid_workflow
+    loras = fixture_loras()
+    image_path = os.path.join('Main', 'DataSets', 'temp', 'reference.png')
+    return (lambda: update_pulid_workflow('PulidFluxDev.json', image_path, PROMPT, RESOLUTION, loras, 1234567)), None
+
+@benchmark('workflow_utils.update_reduxprompt_workflow', requires='discord')
+def bench_update_reduxprompt_workflow():
+    from Main.custom_commands.workflow_utils import update_reduxprompt_workflow
+    image_path = os.path.join('Main', 'DataSets', 'temp', 'reference.png')
+    return (lambda: update_reduxprompt_workflow('Reduxprompt.json', image_path, PROMPT, 'high', 1234567, RESOLUTION)), None
+
+@benchmark('banned_utils.check_banned clean prompt (5,000 words)', requires='discord')
+def bench_check_banned():
+    # The checks themselves; check_banned only adds the hop to the database thread
+    from Main.custom_commands.banned_utils import _check_banned
+    return (lambda: _check_banned('100000000000000001', PROMPT)), None
+
+def long_prompt(length: int = 2000, obfuscate: bool = False) -> str:
+    """A prompt of exactly length characters, optionally with leetspeak, lookalikes and zero-width spaces."""
+    text = (PROMPT + ', ') * (length // len(PROMPT) + 1)
+    if obfuscate:
+        text = text.replace('o', '0').replace('a', '\u0430').replace('i', '!').replace(' ', '\u200b ')
+    return text[:length]
+
+@benchmark('text_normalizer.normalize 2,000-char prompt', per_call=(2000, 'chars'))
+def bench_normalize_prompt():
+    from Main.text_normalizer import normalize
+    prompt = long_prompt()
+    return (lambda: normalize(prompt)), None
+
+@benchmark('text_normalizer.normalize 2,000-char obfuscated prompt', per_call=(2000, 'chars'))
+def bench_normalize_obfuscated_prompt():
+    from Main.text_normalizer import normalize
+    prompt = long_prompt(obfuscate=True)
+    return (lambda: normalize(prompt)), None
+
+# Obfuscated prompts and the banned word each must be flagged for ('nude' is added to banned.json)
+MODERATION_FLAGGED = {
+    'nude,woman': 'nude',
+    'nude-woman': 'nude',
+    'nude!': 'nude',
+    'NUDE!!!': 'nude',
+    "nude's": 'nude',
+    'a ｎｕｄｅ！ portrait': 'nude',
+    'C.h.i.l.d': 'child',
+    'C.h.i.l.d!': 'child',
+    'Ch!ld': 'child',
+    'ⅽհіⅼⅾ': 'child',
+    'chi\u200bld': 'child',
+    '$lut': 'slut',
+    'teeeen': 'teen',
+    't33n': 'teen',
+}
+
+# Ordinary prompts that must not be flagged: short words that sit next to banned ones once
+# folded ("ten"/"teen", "T3N"), and punctuation and symbols that only end or separate words
+MODERATION_CLEAN = (
+    'ten apples on a table',
+    'T3N red balloons',
+    'as seen from above',
+    'pop art poster',
+    'hel, a norse goddess',
+    'a book, an apple and a cup of tea',
+    'Hello!!! a sunny day',
+    'cat+dog, friends!',
+    'price: $5, 50% off',
+    'a kidney-shaped pool',
+    'boyish grin? no, a toy boat',
+    PROMPT,
+)
+
+def moderation_matchers():
+    """Matchers over the shipped banned.json, with typo matching on so false positives show up too."""
+    from Main.word_matcher import WordMatcher
+    from Main.fuzzy_matcher import FuzzyMatcher
+    from Main.text_normalizer import normalize
+    with open(os.path.join(REPO_ROOT, 'Main', 'banned.json'), encoding='utf-8') as f:
+        words = json.load(f) + ['nude']
+    return WordMatcher(words, normalize), FuzzyMatcher(words, 1, 6, normalize)
+
+@check('banned-word check catches obfuscated prompts')
+def check_moderation_flagged():
+    from Main.database import match_banned_word
+    from Main.text_normalizer import normalized_forms
+    matcher, fuzzy = moderation_matchers()
+    problems = []
+    for prompt, expected in MODERATION_FLAGGED.items():
+        found = match_banned_word(matcher, fuzzy, normalized_forms(prompt))
+        if found != expected:
+            problems.append(f"{prompt!r} matched {found!r}, expected {expected!r}")
+    return problems
+
+@check('banned-word check leaves ordinary prompts alone')
+def check_moderation_clean():
+    from Main.database import match_banned_word
+    from Main.text_normalizer import normalized_forms
+    matcher, fuzzy = moderation_matchers()
+    problems = []
+    for prompt in MODERATION_CLEAN:
+        found = match_banned_word(matcher, fuzzy, normalized_forms(prompt))
+        if found is not None:
+            problems.append(f"{prompt!r} matched {found!r}")
+    return problems
+
+@benchmark('banned-word matcher 2,000-char prompt (5,000 words)', per_call=(2000, 'chars'))
+def bench_banned_word_matcher():
+    from Main import database
+    matcher = database.get_banned_word_matcher()
+    prompt = long_prompt()
+    return (lambda: matcher.search(prompt)), None
+
+@benchmark('database.find_banned_word repeated 2,000-char prompt (verdict cache)', per_call=(2000, 'chars'))
+def bench_find_banned_word_cached():
+    from Main import database
+    prompt = long_prompt()
+    database.find_banned_word(prompt)
+    return (lambda: database.find_banned_word(prompt)), None
+
+def fuzzy_matcher(terms: int = 10000, max_distance: int = 1):
+    import random
+    from benchmarks.fixtures import make_banned_words
+    from Main.fuzzy_matcher import FuzzyMatcher
+    from Main.text_normalizer import normalize
+    return FuzzyMatcher(make_banned_words(random.Random(46), terms), max_distance, 6, normalize)
+
+def distinct_word_prompt(length: int = 2000) -> str:
+    """Random lowercase words up to length characters, so no token is checked twice."""
+    import random
+    rng = random.Random(46)
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10))))
+    return ' '.join(words)[:length]
+
+def fuzzy_worst_case(max_distance: int):
+    # Every token is looked up, as in a prompt with no near misses, and none come from the cache
+    matcher = fuzzy_matcher(max_distance=max_distance)
+    tokens = sorted(set(distinct_word_prompt().split()))
+    def run():
+        matcher.cache.clear()
+        return [matcher.match_token(token) for token in tokens]
+    return run, None
+
+@benchmark('fuzzy matcher clean prompt (10,000 terms, 1 edit)')
+def bench_fuzzy_matcher_prompt():
+    matcher = fuzzy_matcher()
+    return (lambda: (matcher.cache.clear(), matcher.search(PROMPT))), None
+
+@benchmark('fuzzy matcher 2,000 chars of distinct words (10,000 terms, 1 edit)', per_call=(2000, 'chars'))
+def bench_fuzzy_matcher_one_edit():
+    return fuzzy_worst_case(1)
+
+@benchmark('fuzzy matcher 2,000 chars of distinct words (10,000 terms, 2 edits)', per_call=(2000, 'chars'))
+def bench_fuzzy_matcher_two_edits():
+    return fuzzy_worst_case(2)
+
+@benchmark('image blocklist lookup miss (10,000 images, 10 bits)')
+def bench_image_blocklist_match():
+    import random
+    from Main.image_hash import BlockedImage, ImageBlocklist
+    rng = random.Random(47)
+    blocklist = ImageBlocklist(
+        (BlockedImage(i, rng.getrandbits(64), rng.getrandbits(64), 'fixture') for i in range(10000)), 10
+    )
+    phash, dhash = rng.getrandbits(64), rng.getrandbits(64)
+    return (lambda: blocklist.match(phash, dhash)), None
+
+@benchmark('image_hash.image_hashes uncached 1024x1024 PNG', requires='PIL')
+def bench_image_hashes():
+    import io
+    import random
+    from PIL import Image
+    from Main import image_hash
+    rng = random.Random(47)
+    image = Image.frombytes('RGB', (256, 256), bytes(rng.getrandbits(8) for _ in range(256 * 256 * 3)))
+    buffer = io.BytesIO()
+    image.resize((1024, 1024)).save(buffer, 'PNG')
+    data = buffer.getvalue()
+    def run():
+        image_hash._hash_cache.clear()
+        return image_hash.image_hashes(data)
+    return run, None
+
+@benchmark('database.add_to_history into the fixture history table')
+def bench_add_to_history():
+    import random
+    import sqlite3
+    from Main import database
+    from Main.utils import load_json
+
+    def last_id() -> int:
+        conn = sqlite3.connect(database.DB_NAME)
+        try:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM image_history").fetchone()[0]
+        finally:
+            conn.close()
+
+    start_id = last_id()
+    rng = random.Random(7)
+    loras = fixture_loras()
+    workflow = load_json('FluxDev24GB.json')
+
+    def run():
+        database.add_to_history(
+            str(rng.randint(10 ** 17, 10 ** 17 + 5000)), make_prompt(rng), workflow,
+            f'{rng.getrandbits(256):064x}.png', RESOLUTION, loras, 1,
+            request_id=f'{rng.getrandbits(128):032x}'
+        )
+
+    def teardown():
+        # Keep the cached fixture at its original size
+        conn = sqlite3.connect(database.DB_NAME)
+        try:
+            conn.execute("DELETE FROM image_history WHERE id > ?", (start_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    return run, teardown
+
+@benchmark('database.search_history 10th page of a common term')
+def bench_search_history():
+    from Main import database
+    cursor = None
+    for _ in range(9):
+        _, cursor = database.search_history('cinematic', before=cursor)
+    return (lambda: database.search_history('cinematic', before=cursor)), None
+
+@benchmark('views.PaginatedLoRASelect page of 1,000 LoRAs', requires='discord')
+def bench_paginated_lora_select():
+    from Main.utils import load_json
+    from Main.custom_commands.views import PaginatedLoRASelect
+    options = load_json('lora.json')['available_loras']
+    selected = fixture_loras()
+    return (lambda: PaginatedLoRASelect(options, page=len(options) // 25 - 1, selected_loras=selected)), None
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> Dict[str, float]:
+    """Time func with timeit, returning per-call statistics in microseconds."""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    runs = [total / number * 1e6 for total in timer.repeat(repeat=repeat, number=number)]
+    return {
+        'median_us': round(statistics.median(runs), 3),
+        'min_us': round(min(runs), 3),
+        'stdev_us': round(statistics.pstdev(runs), 3),
+        'loops': number
+    }
+
+def is_available(module: Optional[str]) -> bool:
+    if module is None:
+        return True
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+def run_checks() -> List[str]:
+    """Run every check and return the names of those that failed."""
+    failed = []
+    for name, func in CHECKS:
+        problems = func()
+        print(f"{'FAIL' if problems else 'PASS'}  {name}")
+        for problem in problems:
+            print(f"      {problem}")
+        if problems:
+            failed.append(name)
+    return failed
+
+def run_benchmarks(selected: List[Benchmark], repeat: int, min_time: float) -> Dict[str, dict]:
+    results = {}
+    for bench in selected:
+        if not is_available(bench.requires):
+            print(f"SKIP  {bench.name} ({bench.requires} not installed)")
+            continue
+        func, teardown = bench.factory()
+        try:
+            func()  # Warm caches and imports before timing
+            results[bench.name] = measure(func, repeat, min_time)
+        finally:
+            if teardown:
+                teardown()
+        rate = ''
+        if bench.per_call:
+            count, unit = bench.per_call
+            results[bench.name]['per_second'] = round(count / results[bench.name]['median_us'] * 1e6)
+            rate = f"  ({results[bench.name]['per_second'] / 1e6:,.1f}M {unit}/s)"
+        print(f"{results[bench.name]['median_us']:>14,.1f} us  {bench.name}{rate}")
+    return results
+
+def load_baseline(path: str) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('results', {})
+
+def save_baseline(path: str, results: Dict[str, dict], history_rows: int):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'machine': platform.platform(),
+            'python': platform.python_version(),
+            'history_rows': history_rows,
+            'results': results
+        }, f, indent=2, sort_keys=True)
+    print(f"Saved baseline to {path}")
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Print a comparison table and return the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<60} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<60} {'-':>12} {result['median_us']:>12,.1f} {'new':>8}")
+            continue
+        before = baseline[name]['median_us']
+        ratio = result['median_us'] / before if before else 1.0
+        status = ''
+        if ratio > 1 + threshold:
+            status = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            status = '  improved'
+        print(f"{name:<60} {before:>12,.1f} {result['median_us']:>12,.1f} {ratio - 1:>+8.1%}{status}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for request hot paths')
+    parser.add_argument('-k', dest='pattern', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds per repetition')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='Write results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+    parser.add_argument('--history-rows', type=int, default=HISTORY_ROWS, help='Rows in the fixture history table')
+    parser.add_argument('--rebuild-fixtures', action='store_true', help='Regenerate cached fixtures')
+    args = parser.parse_args()
+
+    prepare_environment(fixture_dir())
+    fixtures = ensure_fixtures(args.history_rows, args.rebuild_fixtures)
+    # Load templates, lora.json and the database from the fixture tree
+    os.chdir(fixtures)
+    logging.disable(logging.WARNING)
+
+    failed = run_checks()
+    if failed:
+        print(f"\n{len(failed)} check(s) failed; not timing anything")
+        sys.exit(1)
+
+    selected = [bench for bench in BENCHMARKS if not args.pattern or args.pattern.lower() in bench.name.lower()]
+    results = run_benchmarks(selected, args.repeat, args.min_time)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, {**load_baseline(args.baseline), **results}, args.history_rows)
+        return
+
+    baseline = load_baseline(args.baseline)
+    if not baseline:
+        print("\nNo baseline yet; run with --save-baseline to record one.")
+        return
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
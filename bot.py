@@ -4,7 +4,7 @@ import asyncio
 import subprocess
 import os
 import platform
-import uuid
+import time
 from typing import Dict, Optional, Any
 
 # Third-party imports
@@ -29,11 +29,25 @@ from Main.custom_commands import (
     RequestItem, ReduxRequestItem, ReduxPromptRequestItem,
     ImageControlView, setup_commands
 )
-from Main.database import init_db, get_all_image_info
+from Main.database import init_db, run_db, shutdown_db, sort_loras_by_usage
+from Main.quota import QuotaManager, parse_role_limits
+from Main.custom_commands.quota_utils import check_quota
 from Main.custom_commands.web_handlers import handle_generated_image
 from Main.utils import load_json
 from web_server import start_web_server
 from Main.lora_monitor import setup_lora_monitor, cleanup_lora_monitor
+from Main.image_compression import configure_compression_pool, shutdown_compression_pool
+from Main.metrics import bind_bot, instrument_discord_http
+from Main.tracing import configure_tracing, JsonlExporter, start_trace, record_span
+from Main.request_queue import RequestQueue
+from Main.history_writer import HistoryWriter
+from Main.retention import RetentionManager
+from config import (
+    IMAGE_COMPRESSION_WORKERS, TRACING_ENABLED, TRACE_FILE,
+    HISTORY_FLUSH_INTERVAL, HISTORY_BATCH_SIZE, HISTORY_DURABILITY,
+    HISTORY_RETENTION_DAYS, HISTORY_ARCHIVE_DIR, HISTORY_RETENTION_INTERVAL_HOURS, HISTORY_VACUUM_CONVERT,
+    LORA_SORT, QUOTA_GPU_SECONDS, QUOTA_WINDOW_HOURS, QUOTA_ROLE_LIMITS, QUOTA_CHECKPOINT_INTERVAL
+)
 try:
     from Main.LMstudio_bot.ai_providers import AIProviderFactory
 except ImportError:
@@ -42,7 +56,6 @@ except ImportError:
 
 import logging
 import json
-import uuid
 from discord import app_commands
 from Main.custom_commands.views import ReduxModal, ImageControlView
 
@@ -56,13 +69,30 @@ discord_logger.setLevel(logging.WARNING)
 class MyBot(discord_commands.Bot):
     def __init__(self):
         super().__init__(command_prefix=COMMAND_PREFIX, intents=intents)
-        self.subprocess_queue = asyncio.Queue()
+        self.subprocess_queue = RequestQueue()
         self.pending_requests = {}
         self.ai_provider = None
         self.allowed_channels = set(CHANNEL_IDS)
         self.resolution_options = []
         self.lora_options = []
         self.tree.on_error = self.on_tree_error
+        configure_compression_pool(IMAGE_COMPRESSION_WORKERS)
+        bind_bot(self)
+        configure_tracing(JsonlExporter(TRACE_FILE) if TRACING_ENABLED else None)
+        instrument_discord_http(self.http)
+        self.history_writer = HistoryWriter(HISTORY_FLUSH_INTERVAL, HISTORY_BATCH_SIZE, HISTORY_DURABILITY)
+        self.retention = None
+        if HISTORY_RETENTION_DAYS > 0:
+            self.retention = RetentionManager(
+                HISTORY_RETENTION_DAYS, HISTORY_ARCHIVE_DIR, HISTORY_RETENTION_INTERVAL_HOURS * 3600,
+                convert_vacuum=HISTORY_VACUUM_CONVERT
+            )
+        self.quota = None
+        if QUOTA_GPU_SECONDS > 0:
+            self.quota = QuotaManager(
+                QUOTA_GPU_SECONDS, QUOTA_WINDOW_HOURS * 3600,
+                parse_role_limits(QUOTA_ROLE_LIMITS), QUOTA_CHECKPOINT_INTERVAL
+            )
         setup_lora_monitor(self)
         
     def get_python_command(self):
@@ -125,8 +155,12 @@ class MyBot(discord_commands.Bot):
         while True:
             try:
                 request_item = await self.subprocess_queue.get()
-                request_id = str(uuid.uuid4())
+                request_id = request_item.request_id
+                start_trace(request_id)
+                record_span('queue_wait', time.monotonic() - request_item.created_at,
+                            phase='queue_wait', backend=request_item.backend)
                 self.pending_requests[request_id] = request_item
+                launch_started = time.perf_counter()
 
                 if isinstance(request_item, ReduxRequestItem):
                     await self.process_redux_request(request_id, request_item)
@@ -169,6 +203,7 @@ class MyBot(discord_commands.Bot):
                         str(request_item.is_pulid).lower()  # Pass is_pulid flag
                     ])
 
+                record_span('runner_launch', time.perf_counter() - launch_started, backend=request_item.backend)
                 self.subprocess_queue.task_done()
                 
             except Exception as e:
@@ -176,7 +211,12 @@ class MyBot(discord_commands.Bot):
 
     async def setup_hook(self):
         """Setup hook that runs before the bot starts."""
-        init_db()
+        await run_db(init_db)
+        self.history_writer.start()
+        if self.retention:
+            self.retention.start()
+        if self.quota:
+            await self.quota.start()
         try:
             if ENABLE_PROMPT_ENHANCEMENT and AIProviderFactory:
                 logger.info(f"Initializing AI provider. Provider: {AI_PROVIDER}")
@@ -202,7 +242,7 @@ class MyBot(discord_commands.Bot):
             self.resolution_options = list(ratios_data['ratios'].keys())
 
             lora_data = load_json('lora.json')
-            self.lora_options = lora_data['available_loras']
+            self.lora_options = await run_db(self.order_lora_options, lora_data['available_loras'])
             
         except Exception as e:
             logger.error(f"Error loading options: {str(e)}")
@@ -240,6 +280,11 @@ class MyBot(discord_commands.Bot):
                     )
                     return
 
+                message = check_quota(interaction, 'redux', resolution)
+                if message:
+                    await interaction.response.send_message(message, ephemeral=True)
+                    return
+
                 # Show the modal for image upload and strength settings
                 modal = ReduxModal(self, resolution)
                 await interaction.response.send_modal(modal)
@@ -262,7 +307,15 @@ class MyBot(discord_commands.Bot):
 
     async def close(self):
         cleanup_lora_monitor(self)
+        shutdown_compression_pool()
         await super().close()
+        if self.retention:
+            await self.retention.stop()
+        if self.quota:
+            await self.quota.stop()
+        # Write queued history before the database thread goes away
+        await self.history_writer.stop()
+        shutdown_db()
 
     async def on_ready(self):
         logger.info(f"Bot {self.user} is ready")
@@ -285,6 +338,16 @@ class MyBot(discord_commands.Bot):
                 ephemeral=True
             )
 
+    def order_lora_options(self, loras):
+        """Apply LORA_SORT to lora.json's entries; reads usage, so call it off the event loop."""
+        if LORA_SORT != 'popular':
+            return loras
+        try:
+            return sort_loras_by_usage(loras)
+        except Exception as e:
+            logger.error(f"Error ordering LoRAs by usage: {str(e)}")
+            return loras
+
     async def reload_options(self):
         """Reload LoRA and Resolution options"""
         try:
@@ -292,7 +355,7 @@ class MyBot(discord_commands.Bot):
             self.resolution_options = list(ratios_data['ratios'].keys())
 
             lora_data = load_json('lora.json')
-            self.lora_options = lora_data['available_loras']
+            self.lora_options = await run_db(self.order_lora_options, lora_data['available_loras'])
             logger.info("Successfully reloaded options")
             
             # Reinitialize AI provider if enabled
@@ -8,16 +8,19 @@ import sys
 import logging
 import os
 import time
-from Main.database import add_to_history
-from Main.utils import generate_random_seed, load_json, save_json
+from Main.utils import generate_random_seed, load_json, load_json_snapshot, save_json
+from Main.tracing import configure_tracing, start_trace, span, record_span
 import re
 from dotenv import load_dotenv
 from config import server_address, BOT_SERVER
 from Main.custom_commands.workflow_utils import (
     update_workflow, 
+    update_redux_workflow,
     update_reduxprompt_workflow,  
-    validate_workflow
+    validate_workflow,
+    lora_entries
 )
+from Main.workflow_templates import compile_template, STANDARD_SLOTS
 
 # Load environment variables
 load_dotenv()
@@ -27,10 +30,25 @@ logger = logging.getLogger(__name__)
 
 client_id = str(uuid.uuid4())
 
+# Spans recorded by this runner; they are sent back to the bot with the
+# final image or error update instead of being written locally
+runner_spans = []
+
+def take_runner_spans():
+    """Hand over the spans recorded so far so they are reported only once."""
+    spans = list(runner_spans)
+    runner_spans.clear()
+    return spans
+
 def open_workflow(workflow_filename):
     """Opens and loads workflow file from DataSets directory with validation"""
     try:
-        workflow_path = f"Main/DataSets/{workflow_filename}"
+        # save_json writes to whichever casing of the folder exists
+        workflow_path = next(
+            (path for path in (f"Main/DataSets/{workflow_filename}", f"Main/Datasets/{workflow_filename}")
+             if os.path.exists(path)),
+            f"Main/DataSets/{workflow_filename}"
+        )
         logger.debug(f"Opening workflow file: {workflow_path}")
         
         with open(workflow_path, "r", encoding="utf-8") as f:
@@ -63,58 +81,17 @@ def open_workflow(workflow_filename):
 def update_workflow(workflow, prompt, resolution, loras, upscale_factor, seed):
     """Updates the workflow with the provided parameters with validation"""
     try:
-        # Create a deep copy to avoid modifying original
-        workflow = json.loads(json.dumps(workflow))
-        
-        # Update prompt
-        if '69' in workflow:
-            workflow['69']['inputs']['prompt'] = prompt
-            logger.debug(f"Updated prompt in workflow")
-        
-        # Update resolution
-        if '258' in workflow:
-            workflow['258']['inputs']['ratio_selected'] = resolution
-            logger.debug(f"Updated resolution in workflow")
-
-        # Update LoRAs
-        if '271' in workflow:
-            lora_loader = workflow['271']['inputs']
-            
-            # Load lora config
-            lora_config = load_json('lora.json')
-            lora_info = {lora['file']: lora for lora in lora_config['available_loras']}
-
-            # Clean existing LoRA entries
-            for key in list(lora_loader.keys()):
-                if key.startswith('lora_'):
-                    del lora_loader[key]
-
-            # Add new LoRA entries
-            for i, lora in enumerate(loras, start=1):
-                if lora in lora_info:
-                    lora_key = f'lora_{i}'
-                    lora_loader[lora_key] = {
-                        'on': True,
-                        'lora': lora,
-                        'strength': float(lora_info[lora].get('weight', 1.0))
-                    }
-            logger.debug(f"Updated LoRAs in workflow: {len(loras)} LoRAs configured")
-
-        # Update upscale factor
-        if '279' in workflow:
-            workflow['279']['inputs']['rescale_factor'] = upscale_factor
-            logger.debug(f"Updated upscale factor in workflow")
-
-        # Update seed
-        if '198:2' in workflow:
-            workflow['198:2']['inputs']['noise_seed'] = seed
-            logger.debug(f"Updated seed in workflow: {seed}")
-
-        # Validate the final workflow
-        if not isinstance(workflow, dict):
-            raise ValueError("Workflow must remain a dictionary after updates")
-
-        logger.debug("Successfully updated workflow with all parameters")
+        # Only the nodes that change are copied; compiling validates the node structure
+        template = compile_template(workflow, STANDARD_SLOTS, name='workflow')
+        workflow = template.instantiate(
+            prompt=prompt,
+            resolution=resolution,
+            # The runner applies each LoRA's full lora.json weight
+            loras=lora_entries(loras, scale_multiple=False),
+            upscale_factor=upscale_factor,
+            seed=seed
+        )
+        logger.debug(f"Updated workflow: {len(loras)} LoRAs configured, seed {seed}")
         return workflow
 
     except Exception as e:
@@ -212,7 +189,7 @@ def clear_cache(ws):
     ws.send(clear_message)
     logger.debug("Sent clear_cache message to ComfyUI")
 
-def send_progress_update(request_id, progress_data):
+def send_progress_update(request_id, progress_data, spans=None):
     try:
         bot_server = os.getenv('BOT_SERVER', BOT_SERVER)
         retries = 3
@@ -222,6 +199,8 @@ def send_progress_update(request_id, progress_data):
             'request_id': request_id,
             'progress_data': progress_data
         }
+        if spans:
+            data['spans'] = spans
 
         for attempt in range(retries):
             try:
@@ -246,74 +225,81 @@ def send_progress_update(request_id, progress_data):
         logger.error(f"Error sending progress update: {str(e)}")
 
 def get_images(ws, workflow, progress_callback):
+    """
+    Queue the workflow and collect its output images, recording the ComfyUI
+    execution and the image download as spans of the current trace.
+    """
     try:
-        prompt_response = queue_prompt(workflow)
-        if 'prompt_id' not in prompt_response:
-            raise ValueError("No prompt_id in response from queue_prompt")
+        with span('comfyui_execution', phase='comfyui_execution'):
+            prompt_response = queue_prompt(workflow)
+            if 'prompt_id' not in prompt_response:
+                raise ValueError("No prompt_id in response from queue_prompt")
             
-        prompt_id = prompt_response['prompt_id']
-        output_images = {}
-        last_milestone = 0
+            prompt_id = prompt_response['prompt_id']
+            output_images = {}
+            last_milestone = 0
 
-        while True:
-            out = ws.recv()
-            if isinstance(out, str):
-                try:
-                    message = json.loads(out)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing WebSocket message: {e}")
-                    continue
-
-                if message['type'] == 'execution_start':
-                    progress_callback({
-                        "status": "execution",
-                        "message": "Starting execution..."
-                    })
-                
-                elif message['type'] == 'executing':
-                    data = message['data']
-                    
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
+            while True:
+                out = ws.recv()
+                if isinstance(out, str):
+                    try:
+                        message = json.loads(out)
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Error parsing WebSocket message: {e}")
+                        continue
+
+                    if message['type'] == 'execution_start':
                         progress_callback({
-                            "status": "complete",
-                            "message": "Generation complete!"
+                            "status": "execution",
+                            "message": "Starting execution..."
                         })
-                        break
+                
+                    elif message['type'] == 'executing':
+                        data = message['data']
                     
-                    if "UNETLoader" in str(data) or "CLIPLoader" in str(data) or "VAELoader" in str(data):
-                        progress_callback({
-                            "status": "loading_models",
-                            "message": "Loading models and preparing generation..."
-                        })
+                        if data['node'] is None and data['prompt_id'] == prompt_id:
+                            progress_callback({
+                                "status": "complete",
+                                "message": "Generation complete!"
+                            })
+                            break
+                    
+                        if "UNETLoader" in str(data) or "CLIPLoader" in str(data) or "VAELoader" in str(data):
+                            progress_callback({
+                                "status": "loading_models",
+                                "message": "Loading models and preparing generation..."
+                            })
                 
-                elif message['type'] == 'progress':
-                    data = message['data']
-                    current_step = data['value']
-                    max_steps = data['max']
-                    progress = int((current_step / max_steps) * 100)
+                    elif message['type'] == 'progress':
+                        data = message['data']
+                        current_step = data['value']
+                        max_steps = data['max']
+                        progress = int((current_step / max_steps) * 100)
                     
-                    current_milestone = (progress // 10) * 10
-                    if current_milestone > last_milestone:
+                        current_milestone = (progress // 10) * 10
+                        if current_milestone > last_milestone:
+                            progress_callback({
+                                "status": "generating",
+                                "progress": progress
+                            })
+                            last_milestone = current_milestone
+
+                    elif message['type'] == 'execution_cached':
                         progress_callback({
-                            "status": "generating",
-                            "progress": progress
+                            "status": "cached",
+                            "message": "Using cached result..."
                         })
-                        last_milestone = current_milestone
-
-                elif message['type'] == 'execution_cached':
-                    progress_callback({
-                        "status": "cached",
-                        "message": "Using cached result..."
-                    })
 
-        history = get_history(prompt_id)[prompt_id]
-        for node_id, node_output in history['outputs'].items():
-            if 'images' in node_output:
-                images_output = []
-                for image in node_output['images']:
-                    image_data, filename = get_image(image['filename'], image['subfolder'], image['type'])
-                    images_output.append((image_data, filename))
-                output_images[node_id] = images_output
+        with span('image_download', phase='image_download') as attrs:
+            history = get_history(prompt_id)[prompt_id]
+            for node_id, node_output in history['outputs'].items():
+                if 'images' in node_output:
+                    images_output = []
+                    for image in node_output['images']:
+                        image_data, filename = get_image(image['filename'], image['subfolder'], image['type'])
+                        images_output.append((image_data, filename))
+                    output_images[node_id] = images_output
+            attrs['images'] = sum(len(images) for images in output_images.values())
 
         return output_images
 
@@ -327,7 +313,7 @@ def get_images(ws, workflow, progress_callback):
 
 def calculate_upscaled_resolution(resolution, upscale_factor):
     try:
-        ratios_config = load_json('ratios.json')
+        ratios_config = load_json_snapshot('ratios.json')
         
         if resolution not in ratios_config['ratios']:
             raise ValueError(f"Resolution {resolution} not found in ratios configuration")
@@ -348,10 +334,11 @@ def cleanup_workflow_file(workflow_filename):
     """Delete a temporary workflow file and its associated temporary files after they've been used"""
     try:
         # Delete workflow file
-        file_path = os.path.join('Main', 'DataSets', workflow_filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.debug(f"Successfully deleted workflow file: {workflow_filename}")
+        for folder in ('DataSets', 'Datasets'):
+            file_path = os.path.join('Main', folder, workflow_filename)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.debug(f"Successfully deleted workflow file: {workflow_filename}")
             
         # Get the request ID from the workflow filename if it exists
         request_id = None
@@ -391,7 +378,7 @@ def cleanup_workflow_file(workflow_filename):
 
 def send_final_image(request_id, user_id, channel_id, interaction_id, original_message_id, 
                     prompt, resolution, upscaled_resolution, loras, upscale_factor, 
-                    seed, image_data, filename, workflow_filename=None):
+                    seed, image_data, filename, workflow_filename=None, spans=None, workflow=None):
     try:
         bot_server = os.getenv('BOT_SERVER', BOT_SERVER)
         retries = 3
@@ -409,7 +396,10 @@ def send_final_image(request_id, user_id, channel_id, interaction_id, original_m
             'upscaled_resolution': upscaled_resolution,
             'loras': json.dumps(loras),
             'upscale_factor': upscale_factor,
-            'seed': seed
+            'seed': seed,
+            # The bot records history, so it needs the workflow that was run
+            'workflow': json.dumps(workflow),
+            'spans': json.dumps(spans or [])
         }
 
         for attempt in range(retries):
@@ -449,11 +439,15 @@ if __name__ == "__main__":
     max_retries = 3
     retry_delay = 2  # seconds
     
+    runner_started = time.time()
+    configure_tracing(runner_spans.append, process_name='runner')
+
     try:
         if len(sys.argv) < 7:
             raise ValueError(f"Expected at least 7 arguments, but got {len(sys.argv) - 1}")
 
         request_id = sys.argv[1]
+        start_trace(request_id)
         user_id = sys.argv[2]
         channel_id = sys.argv[3]
         interaction_id = sys.argv[4]
@@ -516,27 +510,15 @@ if __name__ == "__main__":
             image2_path = sys.argv[12]
 
             workflow = open_workflow(workflow_filename)
-            comfy_image1_path = os.path.abspath(image1_path)
-            comfy_image2_path = os.path.abspath(image2_path)
-
-            comfy_image1_path = comfy_image1_path.replace('\\', '/')
-            comfy_image2_path = comfy_image2_path.replace('\\', '/')
-
-            if '40' in workflow:
-                workflow['40']['inputs']['image'] = comfy_image1_path
-            if '46' in workflow:
-                workflow['46']['inputs']['image'] = comfy_image2_path
-            if '53' in workflow:
-                workflow['53']['inputs']['conditioning_to_strength'] = strength1
-            if '44' in workflow:
-                workflow['44']['inputs']['conditioning_to_strength'] = strength2
-            if '49' in workflow:
-                workflow['49']['inputs']['ratio_selected'] = resolution
-            # Add random seed generation for redux using node '25'
-            if '25' in workflow:
-                seed = generate_random_seed()
-                workflow['25']['inputs']['noise_seed'] = seed
-                logger.debug(f"Set random seed for redux in node 25: {seed}")
+            # Random seed for every redux run
+            seed = generate_random_seed()
+            # ComfyUI needs absolute paths with forward slashes
+            comfy_image1_path = os.path.abspath(image1_path).replace('\\', '/')
+            comfy_image2_path = os.path.abspath(image2_path).replace('\\', '/')
+            workflow = update_redux_workflow(
+                workflow, resolution, strength1, strength2, comfy_image1_path, comfy_image2_path, seed
+            )
+            logger.debug(f"Set random seed for redux: {seed}")
 
             upscale_factor = 1
             full_prompt = "Redux image generation"
@@ -560,24 +542,13 @@ if __name__ == "__main__":
             })
 
             workflow = open_workflow(workflow_filename)
-            temp_image_path = os.path.abspath(temp_image_path)
-            temp_image_path = temp_image_path.replace('\\', '/')
 
             # Update the workflow with our parameters
             try:
-                if '40' in workflow:
-                    workflow['40']['inputs']['image'] = temp_image_path
-                if '6' in workflow:
-                    workflow['6']['inputs']['text'] = prompt
-                if '54' in workflow:
-                    workflow['54']['inputs']['image_strength'] = strength
-                if '62' in workflow:
-                    workflow['62']['inputs']['ratio_selected'] = resolution
-                # Add random seed generation for reduxprompt using node '25'
-                if '25' in workflow:
-                    seed = generate_random_seed()
-                    workflow['25']['inputs']['noise_seed'] = seed
-                    logger.debug(f"Set random seed for reduxprompt in node 25: {seed}")
+                # Random seed for every reduxprompt run
+                seed = generate_random_seed()
+                workflow = update_reduxprompt_workflow(workflow, temp_image_path, prompt, strength, seed, resolution)
+                logger.debug(f"Set random seed for reduxprompt: {seed}")
 
                 # Save the modified workflow
                 save_json(workflow_filename, workflow)
@@ -599,30 +570,35 @@ if __name__ == "__main__":
         else:
             raise ValueError(f"Invalid request type: {request_type}")
 
+        record_span('workflow_prepare', time.time() - runner_started, start=runner_started,
+                    request_type=request_type)
+
         # Get server address and client ID
         server_address = os.getenv('server_address', server_address)
         client_id = str(uuid.uuid4())
 
         # Connect to WebSocket with retries
-        for attempt in range(max_retries):
-            try:
-                send_progress_update(request_id, {
-                    'status': 'connecting',
-                    'message': f'Connecting to ComfyUI (attempt {attempt + 1})...'
-                })
-                ws = websocket.create_connection(
-                    f"ws://{server_address}:8188/ws?clientId={client_id}",
-                    timeout=120
-                )
-                break
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"WebSocket connection attempt {attempt + 1} failed: {str(e)}")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    logger.error(f"All WebSocket connection attempts failed: {str(e)}")
-                    raise
+        with span('comfyui_connect') as attrs:
+            for attempt in range(max_retries):
+                try:
+                    send_progress_update(request_id, {
+                        'status': 'connecting',
+                        'message': f'Connecting to ComfyUI (attempt {attempt + 1})...'
+                    })
+                    ws = websocket.create_connection(
+                        f"ws://{server_address}:8188/ws?clientId={client_id}",
+                        timeout=120
+                    )
+                    attrs['attempts'] = attempt + 1
+                    break
+                except Exception as e:
+                    if attempt < max_retries - 1:
+                        logger.warning(f"WebSocket connection attempt {attempt + 1} failed: {str(e)}")
+                        time.sleep(retry_delay)
+                        retry_delay *= 2  # Exponential backoff
+                    else:
+                        logger.error(f"All WebSocket connection attempts failed: {str(e)}")
+                        raise
 
         try:
             # Clear cache and prepare for generation
@@ -662,23 +638,23 @@ if __name__ == "__main__":
                     seed=seed,
                     image_data=image_data,
                     filename=filename,
-                    workflow_filename=workflow_filename
+                    workflow_filename=workflow_filename,
+                    spans=take_runner_spans(),
+                    workflow=workflow
                 )
-                
-                add_to_history(user_id, full_prompt, workflow, filename, resolution, loras, upscale_factor)
             else:
                 logger.error("No final image found to send.")
                 send_progress_update(request_id, {
                     'status': 'error',
                     'message': 'No final image generated'
-                })
+                }, spans=take_runner_spans())
 
         except Exception as e:
             logger.error(f"Error during image generation: {str(e)}", exc_info=True)
             send_progress_update(request_id, {
                 'status': 'error',
                 'message': f'Error during generation: {str(e)}'
-            })
+            }, spans=take_runner_spans())
             raise
 
     except ValueError as ve:
@@ -686,13 +662,13 @@ if __name__ == "__main__":
         send_progress_update(request_id, {
             'status': 'error',
             'message': f'Configuration error: {str(ve)}'
-        })
+        }, spans=take_runner_spans())
     except Exception as e:
         logger.error(f"An unexpected error occurred: {str(e)}", exc_info=True)
         send_progress_update(request_id, {
             'status': 'error',
             'message': f'Unexpected error: {str(e)}'
-        })
+        }, spans=take_runner_spans())
     finally:
         # Clean up WebSocket connection
         if ws:
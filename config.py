@@ -30,6 +30,56 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
 
+# Image ingestion limits for the /send_image callback
+MAX_IMAGE_UPLOAD_BYTES = int(os.getenv('MAX_IMAGE_UPLOAD_BYTES', str(100 * 1024 * 1024)))
+IMAGE_SPOOL_MEMORY_BYTES = int(os.getenv('IMAGE_SPOOL_MEMORY_BYTES', str(8 * 1024 * 1024)))
+
+# Images above this size are recompressed before uploading to Discord
+DISCORD_UPLOAD_LIMIT_BYTES = int(os.getenv('DISCORD_UPLOAD_LIMIT_BYTES', str(10 * 1024 * 1024)))
+IMAGE_COMPRESSION_WORKERS = int(os.getenv('IMAGE_COMPRESSION_WORKERS', '2'))
+
+# Local full-resolution image store served by the bot web server
+IMAGE_STORE_ENABLED = os.getenv('IMAGE_STORE_ENABLED', 'true').lower() == 'true'
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', os.path.join('output', 'images'))
+IMAGE_PUBLIC_BASE_URL = os.getenv('IMAGE_PUBLIC_BASE_URL', '').rstrip('/')
+IMAGE_PREVIEW_MAX_EDGE = int(os.getenv('IMAGE_PREVIEW_MAX_EDGE', '1536'))
+# Requests per minute one address may make for stored images
+IMAGE_PUBLIC_REQUESTS_PER_MINUTE = int(os.getenv('IMAGE_PUBLIC_REQUESTS_PER_MINUTE', '120'))
+
+# Addresses allowed to scrape /metrics
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+
+# Per-request trace spans, exported as JSON Lines
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+TRACE_FILE = os.getenv('TRACE_FILE', os.path.join('logs', 'traces.jsonl'))
+
+# Batched history/warning/audit writes; durability is 'buffered' or 'commit'
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '0.5'))
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '100'))
+HISTORY_DURABILITY = os.getenv('HISTORY_DURABILITY', 'buffered').lower()
+
+# History older than HISTORY_RETENTION_DAYS is archived to monthly files and deleted (0 keeps everything)
+HISTORY_RETENTION_DAYS = float(os.getenv('HISTORY_RETENTION_DAYS', '0'))
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'archive')
+HISTORY_RETENTION_INTERVAL_HOURS = float(os.getenv('HISTORY_RETENTION_INTERVAL_HOURS', '24'))
+# Convert a database created before incremental auto-vacuum with one full VACUUM on the next retention run;
+# it blocks database access until the file is rewritten
+HISTORY_VACUUM_CONVERT = os.getenv('HISTORY_VACUUM_CONVERT', 'false').lower() == 'true'
+
+# Where /history export writes its files
+HISTORY_EXPORT_DIR = os.getenv('HISTORY_EXPORT_DIR', 'exports')
+
+# GPU-time quotas: each user may spend QUOTA_GPU_SECONDS of estimated GPU time per
+# QUOTA_WINDOW_HOURS (0 disables quotas). QUOTA_ROLE_LIMITS raises it per role,
+# e.g. "123456789:3600,987654321:unlimited"
+QUOTA_GPU_SECONDS = float(os.getenv('QUOTA_GPU_SECONDS', '0'))
+QUOTA_WINDOW_HOURS = float(os.getenv('QUOTA_WINDOW_HOURS', '1'))
+QUOTA_ROLE_LIMITS = os.getenv('QUOTA_ROLE_LIMITS', '')
+QUOTA_CHECKPOINT_INTERVAL = float(os.getenv('QUOTA_CHECKPOINT_INTERVAL', '60'))
+
+# LoRA picker order: 'file' keeps lora.json order, 'popular' puts the most used first
+LORA_SORT = os.getenv('LORA_SORT', 'file').lower()
+
 # Discord intents
 intents = discord.Intents.default()
 intents.message_content = True
@@ -53,5 +103,30 @@ __all__ = [
     'OPENAI_API_KEY',
     'OPENAI_MODEL',
     'EMBEDDING_MODEL',
+    'MAX_IMAGE_UPLOAD_BYTES',
+    'IMAGE_SPOOL_MEMORY_BYTES',
+    'DISCORD_UPLOAD_LIMIT_BYTES',
+    'IMAGE_COMPRESSION_WORKERS',
+    'IMAGE_STORE_ENABLED',
+    'IMAGE_STORE_DIR',
+    'IMAGE_PUBLIC_BASE_URL',
+    'IMAGE_PREVIEW_MAX_EDGE',
+    'IMAGE_PUBLIC_REQUESTS_PER_MINUTE',
+    'METRICS_ALLOWED_IPS',
+    'TRACING_ENABLED',
+    'TRACE_FILE',
+    'HISTORY_FLUSH_INTERVAL',
+    'HISTORY_BATCH_SIZE',
+    'HISTORY_DURABILITY',
+    'HISTORY_EXPORT_DIR',
+    'HISTORY_RETENTION_DAYS',
+    'HISTORY_ARCHIVE_DIR',
+    'HISTORY_RETENTION_INTERVAL_HOURS',
+    'HISTORY_VACUUM_CONVERT',
+    'LORA_SORT',
+    'QUOTA_GPU_SECONDS',
+    'QUOTA_WINDOW_HOURS',
+    'QUOTA_ROLE_LIMITS',
+    'QUOTA_CHECKPOINT_INTERVAL',
     'intents'
 ]
\ No newline at end of file
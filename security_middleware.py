@@ -22,6 +22,16 @@ class SecurityConfig:
     allowed_methods: Set[str] = field(default_factory=lambda: {'POST'})
     allowed_paths: Set[str] = field(default_factory=lambda: {'/update_progress', '/send_image', '/image_generated'})
     blocked_user_agents: Set[str] = field(default_factory=set)
+    # Read-only paths (e.g. stored images) that anyone may GET; these are
+    # rate limited but never cause a permanent block
+    public_path_prefixes: Set[str] = field(default_factory=set)
+    public_methods: Set[str] = field(default_factory=lambda: {'GET', 'HEAD'})
+    # Separate from max_requests_per_minute: a gallery page or a download
+    # split into range requests makes many GETs from one address
+    public_requests_per_minute: int = 120
+    # Monitoring endpoints readable only from the listed IPs
+    metrics_paths: Set[str] = field(default_factory=set)
+    metrics_allowed_ips: Set[str] = field(default_factory=lambda: {'127.0.0.1', '::1'})
 
 class SecurityMiddleware:
     def __init__(self, config: SecurityConfig = SecurityConfig()):
@@ -90,6 +100,10 @@ class SecurityMiddleware:
         """Check if the request is for a bot endpoint"""
         return request.path in self.config.allowed_paths and request.method == 'POST'
 
+    def is_public_path(self, path: str) -> bool:
+        """Check if the path is under one of the public read-only prefixes"""
+        return any(path.startswith(prefix) for prefix in self.config.public_path_prefixes)
+
     def is_permanently_blocked(self, ip: str) -> bool:
         """Check if IP is permanently blocked"""
         return ip in self.permanent_blocks
@@ -179,6 +193,34 @@ class SecurityMiddleware:
                 content_type='text/plain'
             )
 
+        # Metrics are only served to allowlisted scrapers; others get a plain 403
+        if request.path in self.config.metrics_paths:
+            # Use the socket address; X-Forwarded-For is client controlled
+            if request.method not in self.config.public_methods or request.remote not in self.config.metrics_allowed_ips:
+                logger.warning(f"Rejected metrics request from {request.remote}")
+                return web.Response(
+                    status=403,
+                    text="Access Denied: Metrics are not available from this address.",
+                    content_type='text/plain'
+                )
+            return await self.handle(request, handler)
+
+        # Public read-only paths only need method checks and a soft rate limit
+        if self.is_public_path(request.path):
+            if request.method not in self.config.public_methods:
+                return web.Response(
+                    status=405,
+                    text="Method Not Allowed: This request method is not supported.",
+                    content_type='text/plain'
+                )
+            if self.is_public_rate_limited(client_ip):
+                return web.Response(
+                    status=429,
+                    text="Too Many Requests: Please slow down.",
+                    content_type='text/plain'
+                )
+            return await self.handle(request, handler)
+
         # Check if path is allowed
         if request.path not in self.config.allowed_paths:
             logger.warning(f"Unauthorized path access attempt from {client_ip}: {request.path}")
@@ -222,9 +264,29 @@ class SecurityMiddleware:
             # Add current request
             self.request_counts[client_ip].append(current_time)
 
+        return await self.handle(request, handler)
+
+    def is_public_rate_limited(self, ip: str) -> bool:
+        """Rate limit public paths without adding permanent blocks"""
+        if self.is_trusted_ip(ip):
+            return False
+        current_time = time.time()
+        key = f"public:{ip}"
+        self.request_counts[key] = [t for t in self.request_counts.get(key, [])
+                                    if current_time - t < 60]
+        if len(self.request_counts[key]) >= self.config.public_requests_per_minute:
+            logger.warning(f"Public rate limit exceeded for IP: {ip}")
+            return True
+        self.request_counts[key].append(current_time)
+        return False
+
+    async def handle(self, request: web.Request, handler) -> web.Response:
+        """Run the route handler, hiding unexpected errors from the client"""
         try:
             response = await handler(request)
             return response
+        except web.HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error processing request: {str(e)}")
             return web.Response(
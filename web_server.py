@@ -1,8 +1,13 @@
 from aiohttp import web
-from Main.custom_commands.web_handlers import handle_generated_image
+from Main.custom_commands.web_handlers import handle_generated_image, serve_stored_image
+from Main.image_store import ImageStore
+from Main.metrics import render_metrics, PROGRESS_EDITS, JOBS_COMPLETED
+from Main.tracing import start_trace, import_spans
 import logging
 from Main.custom_commands.message_constants import STATUS_MESSAGES
-from config import server_address
+from config import (
+    server_address, IMAGE_STORE_ENABLED, IMAGE_STORE_DIR, METRICS_ALLOWED_IPS, IMAGE_PUBLIC_REQUESTS_PER_MINUTE
+)
 import discord
 from security_middleware import SecurityMiddleware
 from app_config import SecurityConfig
@@ -23,6 +28,9 @@ async def update_progress(request):
             return web.Response(text="Unknown request_id", status=404)
             
         request_item = request.app['bot'].pending_requests[request_id]
+        start_trace(request_id)
+        if isinstance(data.get('spans'), list):
+            import_spans(data['spans'], getattr(request_item, 'backend', 'any'))
         
         try:
             channel = await request.app['bot'].fetch_channel(int(request_item.channel_id))
@@ -48,9 +56,11 @@ async def update_progress(request):
                 # Only remove on error
                 if request_id in request.app['bot'].pending_requests:
                     del request.app['bot'].pending_requests[request_id]
+                    JOBS_COMPLETED.inc(backend=getattr(request_item, 'backend', 'unknown'), outcome='error')
             else:
                 formatted_message = f"{status_info['emoji']} {status_info['message']}"
             await message.edit(content=formatted_message)
+            PROGRESS_EDITS.inc(status=status or 'unknown')
             logger.debug(f"Updated progress message: {formatted_message}")
             return web.Response(text="Progress updated")
             
@@ -68,6 +78,13 @@ async def update_progress(request):
         logger.error(f"Error in update_progress: {str(e)}")
         return web.Response(text="Internal server error", status=500)
 
+async def metrics(request):
+    return web.Response(
+        text=render_metrics(),
+        content_type='text/plain',
+        headers={'Cache-Control': 'no-store'}
+    )
+
 async def start_web_server(bot):
     app = web.Application()
     
@@ -75,6 +92,10 @@ async def start_web_server(bot):
     security_config = SecurityConfig()
     security_config.allowed_paths = {'/update_progress', '/send_image', '/image_generated'}  # Add other allowed paths as needed
     security_config.allowed_methods = {'POST'}
+    security_config.public_path_prefixes = {'/images/'}
+    security_config.public_requests_per_minute = IMAGE_PUBLIC_REQUESTS_PER_MINUTE
+    security_config.metrics_paths = {'/metrics'}
+    security_config.metrics_allowed_ips = set(METRICS_ALLOWED_IPS)
     security_config.max_requests_per_minute = 10
     
     # Add security middleware
@@ -85,8 +106,11 @@ async def start_web_server(bot):
     app.router.add_post('/send_image', handle_generated_image)
     app.router.add_post('/update_progress', update_progress)
     app.router.add_post('/image_generated', handle_generated_image)
+    app.router.add_get('/images/{filename}', serve_stored_image)
+    app.router.add_get('/metrics', metrics)
     
     app['bot'] = bot
+    app['image_store'] = ImageStore(IMAGE_STORE_DIR) if IMAGE_STORE_ENABLED else None
     
     runner = web.AppRunner(app)
     await runner.setup()